@@ -1,7 +1,9 @@
+from time import perf_counter
+_IMPORT_STARTED = perf_counter()
+
 from datetime import time
 import asyncio
 import os
-import requests
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -14,10 +16,14 @@ from telegram.ext import (
     filters,
 )
 
-from .config import BOT_TOKEN, DAILY_JOB_HOUR
-from .db import db_setup
-from .jobs import check_expirations
-from .handlers.common import force_join_checker, dynamic_button_handler, start_command
+from .config import BOT_TOKEN, DAILY_JOB_HOUR, CLIENT_INDEX_SYNC_MINUTES, BACKUP_INTERVAL_MINUTES, logger
+from .db import db_setup, close_db, adb, write_behind
+from .jobs import check_expirations, sync_client_index, scheduled_backup
+from .panel import shutdown_panel_io
+from .helpers.qr import shutdown_qr_render
+from .subscription import close_subscription_client
+from .broadcast import resume_broadcasts
+from .handlers.common import force_join_checker, dynamic_button_handler, start_command, is_channel_member, get_channel_join_info
 from .handlers.admin import (
     send_admin_panel,
     admin_command,
@@ -183,6 +189,7 @@ from .handlers.admin_stats_broadcast import (
     admin_broadcast_menu as admin_broadcast_menu,
     admin_broadcast_ask_message as admin_broadcast_ask_message,
     admin_broadcast_execute as admin_broadcast_execute,
+    admin_broadcast_cancel as admin_broadcast_cancel,
 )
 
 
@@ -202,17 +209,36 @@ async def debug_text_logger(update: Update, context: ContextTypes.DEFAULT_TYPE)
         pass
 
 
+async def _on_startup(application: Application) -> None:
+    await resume_broadcasts(application)
+
+
+async def _on_shutdown(application: Application) -> None:
+    shutdown_panel_io()
+    shutdown_qr_render()
+    await close_subscription_client()
+    write_behind.shutdown()
+    adb.shutdown()
+    close_db()
+
+
 def build_application() -> Application:
     db_setup()
     application = (
         Application.builder()
         .token(BOT_TOKEN)
         .concurrent_updates(True)
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
         .build()
     )
 
     if application.job_queue:
         application.job_queue.run_daily(check_expirations, time=time(hour=DAILY_JOB_HOUR, minute=0, second=0), name="daily_expiration_check")
+        if CLIENT_INDEX_SYNC_MINUTES > 0:
+            application.job_queue.run_repeating(sync_client_index, interval=CLIENT_INDEX_SYNC_MINUTES * 60, first=60, name="client_index_sync")
+        if BACKUP_INTERVAL_MINUTES > 0:
+            application.job_queue.run_repeating(scheduled_backup, interval=BACKUP_INTERVAL_MINUTES * 60, first=300, name="scheduled_backup")
 
     application.add_handler(TypeHandler(Update, force_join_checker), group=-1)
     # Early debug logger for text messages
@@ -523,50 +549,12 @@ def build_application() -> Application:
 
 
     async def check_join_and_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        # Verify membership before proceeding
-        from .config import CHANNEL_ID as _CID, CHANNEL_USERNAME as _CUN, logger as _logger
-        try:
-            from .config import CHANNEL_CHAT as _CHAT
-        except Exception:
-            _CHAT = None
-        chat_id = _CHAT if _CHAT is not None else (_CID or _CUN)
-        is_member = False
-        try:
-            member = await context.bot.get_chat_member(chat_id=chat_id, user_id=update.effective_user.id)
-            if getattr(member, 'status', None) in ['member', 'administrator', 'creator']:
-                is_member = True
-        except Exception as e:
-            # If cannot verify, treat as not joined to avoid bypass
-            try:
-                _logger.warning(f"check_join_and_start: membership check failed for {update.effective_user.id}: {e}")
-            except Exception:
-                pass
-            is_member = False
+        # Verify membership before proceeding (force_join_checker has just refreshed the verdict)
+        is_member = await is_channel_member(context.bot, update.effective_user.id)
 
         if not is_member:
             # Rebuild join gate UI
-            join_url = None
-            channel_hint = ""
-            try:
-                chat_obj = await context.bot.get_chat(chat_id=chat_id)
-                uname = getattr(chat_obj, 'username', None)
-                inv = getattr(chat_obj, 'invite_link', None)
-                if uname:
-                    handle = f"@{str(uname).replace('@','')}"
-                    join_url = f"https://t.me/{str(uname).replace('@','')}"
-                    channel_hint = f"\n\nکانال: {handle}"
-                elif inv:
-                    join_url = inv
-                    channel_hint = "\n\nلینک دعوت کانال در دکمه زیر موجود است."
-            except Exception:
-                if (_CUN or '').strip():
-                    handle = (_CUN or '').strip()
-                    if not handle.startswith('@'):
-                        handle = f"@{handle}"
-                    join_url = f"https://t.me/{handle.replace('@','')}"
-                    channel_hint = f"\n\nکانال: {handle}"
-                elif _CID:
-                    channel_hint = f"\n\nشناسه کانال: `{_CID}`"
+            join_url, channel_hint = await get_channel_join_info(context.bot)
 
             from telegram import InlineKeyboardButton, InlineKeyboardMarkup
             from telegram.constants import ParseMode
@@ -667,6 +655,7 @@ def build_application() -> Application:
 
     # Purchase quick handlers
     application.add_handler(CallbackQueryHandler(pay_method_wallet, pattern=r'^pay_method_wallet$'), group=3)
+    application.add_handler(CallbackQueryHandler(admin_broadcast_cancel, pattern=r'^broadcast_cancel_\d+$'), group=3)
 
     return application
 
@@ -680,17 +669,15 @@ def run():
 
     use_webhook = (os.getenv('USE_WEBHOOK') or '').lower() in ('1', 'true', 'yes')
 
-    # Proactively clear old webhook to avoid event-loop race and drop stale updates
-    try:
-        requests.post(
-            f'https://api.telegram.org/bot{token}/deleteWebhook',
-            params={'drop_pending_updates': 'true'},
-            timeout=5,
-        )
-    except Exception:
-        pass
-
+    # Old webhook and stale updates are dropped below through app.bot.delete_webhook,
+    # so startup doesn't block on a separate HTTP call first
+    build_started = perf_counter()
     app = build_application()
+    logger.info(
+        f"Startup: imports {(build_started - _IMPORT_STARTED) * 1000:.0f} ms, "
+        f"build_application {(perf_counter() - build_started) * 1000:.0f} ms "
+        f"(run with PYTHONPROFILEIMPORTTIME=1 for a per-module import report)"
+    )
 
     if not use_webhook:
         # Long polling mode (recommended for VPS/server)
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from .config import DB_NAME, ADMIN_ID, logger
+from .db import BACKUP_TRACKED_TABLES, execute_db
+from .panel import VpnPanelAPI
+from .settings import set_setting
+from .stats import read_stats
+
+
+# Admin backup ZIP. Everything here runs in a worker thread: the live DB is
+# copied with SQLite's online backup API, tables are exported from that copy
+# row by row straight into the ZIP on disk, and the caller uploads the file.
+# Scheduled backups alternate between that full ZIP and incremental ones built
+# from backup_changes, which triggers on the tracked tables keep up to date.
+
+_BACKUP_PAGES_PER_STEP = 1024
+
+
+def snapshot_db(dest_path: str):
+    """Consistent copy of the live DB at ``dest_path``, taken in small steps so writers aren't blocked."""
+    src = sqlite3.connect(DB_NAME)
+    try:
+        dst = sqlite3.connect(dest_path)
+        try:
+            src.backup(dst, pages=_BACKUP_PAGES_PER_STEP)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _write_json_rows(zf: zipfile.ZipFile, arcname: str, rows):
+    # A JSON array written one row at a time, so a large table never sits in memory
+    count = 0
+    with zf.open(arcname, 'w') as f:
+        f.write(b'[')
+        first = True
+        for row in rows:
+            f.write(b'\n' if first else b',\n')
+            f.write(json.dumps(dict(row), ensure_ascii=False).encode('utf-8'))
+            first = False
+            count += 1
+        f.write(b'\n]' if not first else b']')
+    return count
+
+
+def _write_json(zf: zipfile.ZipFile, arcname: str, obj):
+    zf.writestr(arcname, json.dumps(obj, ensure_ascii=False, indent=2))
+
+
+def _panel_clients(panel_id: int) -> list:
+    api = VpnPanelAPI(panel_id=panel_id)
+    # Marzban supports get_all_users; X-UI-like panels only summarize there, so dump full clients below
+    if not hasattr(api, '_fetch_inbound_detail'):
+        try:
+            users, _msg = api._get_all_users()
+        except Exception as e:
+            logger.warning(f"Backup: get_all_users failed for panel {panel_id}: {e}")
+            users = None
+        if users:
+            return users
+    payload = []
+    try:
+        inbounds, _ = api.list_inbounds()
+    except Exception:
+        inbounds = None
+    fetch = getattr(api, '_fetch_inbound_detail', None)
+    if not inbounds or not callable(fetch):
+        return payload
+    for ib in inbounds:
+        inbound_id = ib.get('id')
+        try:
+            detail = fetch(inbound_id)
+        except Exception:
+            detail = None
+        if not detail:
+            continue
+        settings_str = detail.get('settings')
+        try:
+            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
+        except Exception:
+            settings_obj = {}
+        clients = settings_obj.get('clients') or []
+        if isinstance(clients, list):
+            for c in clients:
+                payload.append({
+                    'email': c.get('email'),
+                    'totalGB': c.get('totalGB'),
+                    'expiryTime': c.get('expiryTime'),
+                    'enable': c.get('enable'),
+                    'subId': c.get('subId'),
+                    'inbound_id': inbound_id,
+                })
+    return payload
+
+
+def _write_stats(zf: zipfile.ZipFile, conn: sqlite3.Connection):
+    stats = read_stats(conn)
+    stats['total_orders'] = int(conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] or 0)
+    stats['approved_orders'] = int(conn.execute(
+        "SELECT COALESCE(SUM(orders), 0) FROM stats_revenue WHERE dim = 'all' AND length(period) = 7"
+    ).fetchone()[0] or 0)
+    _write_json(zf, "stats.json", stats)
+
+
+_TABLE_EXPORTS = [
+    ("users.json", "SELECT user_id, first_name, join_date, referrer_id FROM users ORDER BY user_id"),
+    ("services.json", "SELECT id, user_id, plan_id, status, marzban_username, timestamp, final_price, panel_id, panel_type, last_link, is_trial FROM orders ORDER BY id"),
+    ("wallet_balances.json", "SELECT user_id, balance FROM user_wallets ORDER BY user_id"),
+    ("plans.json", "SELECT id, name, description, price, duration_days, traffic_gb FROM plans ORDER BY id"),
+    ("panels.json", "SELECT id, name, panel_type, url, sub_base FROM panels ORDER BY id"),
+]
+
+
+@contextmanager
+def _snapshot():
+    """Online snapshot of the DB in a temp file; yields ``(conn, path)`` and deletes it afterwards."""
+    fd, snap_path = tempfile.mkstemp(prefix='bot_db_', suffix='.sqlite')
+    os.close(fd)
+    try:
+        snapshot_db(snap_path)
+        conn = sqlite3.connect(snap_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn, snap_path
+        finally:
+            conn.close()
+    finally:
+        try:
+            os.remove(snap_path)
+        except OSError:
+            pass
+
+
+def _write_full(zf: zipfile.ZipFile, conn: sqlite3.Connection, snap_path: str, panel_ids) -> int:
+    total_users_count = 0
+    zf.write(snap_path, 'bot_db.sqlite')
+    for panel_id in panel_ids:
+        try:
+            base_dir = f"panel_{panel_id}"
+            panel_row = conn.execute("SELECT * FROM panels WHERE id = ?", (panel_id,)).fetchone()
+            safe_info = dict(panel_row) if panel_row else {}
+            if safe_info.get('password'):
+                safe_info['password'] = '***'
+            _write_json(zf, f"{base_dir}/panel_info.json", safe_info)
+            _write_json_rows(zf, f"{base_dir}/panel_inbounds.json", conn.execute(
+                "SELECT id, protocol, tag FROM panel_inbounds WHERE panel_id = ? ORDER BY id", (panel_id,)
+            ))
+            clients = _panel_clients(panel_id)
+            total_users_count += len(clients)
+            _write_json(zf, f"{base_dir}/clients_or_users.json", clients)
+        except Exception as e:
+            logger.error(f"Error adding panel {panel_id} to backup ZIP: {e}")
+
+    # Bot-wide snapshots: members, services, wallets, plans, panels, stats, admins
+    for arcname, sql in _TABLE_EXPORTS:
+        try:
+            _write_json_rows(zf, arcname, conn.execute(sql))
+        except Exception as e:
+            logger.error(f"Could not add {arcname}: {e}")
+    try:
+        _write_stats(zf, conn)
+    except Exception as e:
+        logger.error(f"Could not add stats.json: {e}")
+    try:
+        _write_json(zf, "admins.json", {
+            'primary_admin_id': ADMIN_ID,
+            'additional_admin_ids': [r[0] for r in conn.execute("SELECT user_id FROM admins ORDER BY user_id")],
+        })
+    except Exception as e:
+        logger.error(f"Could not add admins.json: {e}")
+    return total_users_count
+
+
+def build_backup_zip(panel_ids, zip_path: str) -> int:
+    """Write the backup ZIP to ``zip_path``; returns the number of panel users/clients included."""
+    with _snapshot() as (conn, snap_path):
+        with zipfile.ZipFile(zip_path, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+            return _write_full(zf, conn, snap_path, panel_ids)
+
+
+def _write_changes(zf: zipfile.ZipFile, conn: sqlite3.Connection, since_seq: int) -> int:
+    # Current state of every tracked row touched after since_seq, plus the rowids deleted since
+    changed = 0
+    for table in BACKUP_TRACKED_TABLES:
+        changed += _write_json_rows(zf, f"{table}.json", conn.execute(
+            f"SELECT t.* FROM backup_changes c JOIN {table} t ON t.rowid = c.row_id "
+            f"WHERE c.tbl = ? AND c.seq > ? AND c.deleted = 0 ORDER BY c.seq",
+            (table, since_seq),
+        ))
+    deleted = {}
+    for row in conn.execute("SELECT tbl, row_id FROM backup_changes WHERE seq > ? AND deleted = 1 ORDER BY seq", (since_seq,)):
+        deleted.setdefault(row['tbl'], []).append(row['row_id'])
+    _write_json(zf, "deleted.json", deleted)
+    return changed + sum(len(ids) for ids in deleted.values())
+
+
+def build_scheduled_backup(zip_path: str, full: bool, since_seq: int):
+    """Write a scheduled backup to ``zip_path``: the full snapshot, or only rows changed after ``since_seq``.
+
+    Returns ``(seq, changed)``: the change sequence the file covers up to and,
+    for incremental runs, how many rows it holds.
+    """
+    with _snapshot() as (conn, snap_path):
+        row = conn.execute("SELECT MAX(seq) FROM backup_changes").fetchone()
+        seq = int((row[0] if row else 0) or 0)
+        changed = 0
+        with zipfile.ZipFile(zip_path, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+            if full:
+                _write_full(zf, conn, snap_path, [])
+            else:
+                changed = _write_changes(zf, conn, since_seq)
+            _write_json(zf, "manifest.json", {
+                'type': 'full' if full else 'incremental',
+                'since_seq': None if full else since_seq,
+                'seq': seq,
+                'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            })
+    return seq, changed
+
+
+def mark_backup_shipped(seq: int, full: bool):
+    """Record that changes up to ``seq`` are backed up and drop the older change rows."""
+    set_setting('backup_change_seq', str(seq))
+    if full:
+        set_setting('backup_last_full_at', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    # Keep the row holding seq itself so MAX(seq) never goes backwards
+    execute_db("DELETE FROM backup_changes WHERE seq < ?", (seq,))
+
+
+async def generate_backup(panel_ids):
+    """Build the backup ZIP off the event loop; returns ``(zip_path, total_users)``. Caller deletes the file."""
+    fd, zip_path = tempfile.mkstemp(prefix='panel_backup_', suffix='.zip')
+    os.close(fd)
+    try:
+        total = await asyncio.to_thread(build_backup_zip, list(panel_ids), zip_path)
+    except Exception:
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
+        raise
+    return zip_path, total
+
+
+async def generate_scheduled_backup(full: bool, since_seq: int):
+    """Build a scheduled backup off the event loop; returns ``(zip_path, seq, changed)``. Caller deletes the file."""
+    fd, zip_path = tempfile.mkstemp(prefix='scheduled_backup_', suffix='.zip')
+    os.close(fd)
+    try:
+        seq, changed = await asyncio.to_thread(build_scheduled_backup, zip_path, full, since_seq)
+    except Exception:
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
+        raise
+    return zip_path, seq, changed
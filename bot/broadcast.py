@@ -0,0 +1,193 @@
+import asyncio
+import time
+from datetime import datetime
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, BadRequest, TelegramError
+
+from .config import logger, BROADCAST_CHUNK_SIZE, BROADCAST_PROGRESS_SECONDS
+from .db import adb, get_connection
+from .helpers.throttle import RateLimitedSender
+
+
+# Background broadcast engine. Each broadcast is a row in `broadcasts`; every
+# recipient gets a row in `broadcast_deliveries` as soon as its send finishes.
+# Recipients are walked in user_id order in chunks and `resume_after` is moved
+# past each finished chunk, so after a restart a running broadcast picks up at
+# the interrupted chunk and skips everyone already recorded there. Delivery is
+# at-least-once: a recipient whose send completed but wasn't recorded yet when
+# the process died (at most the sends in flight) gets the message again.
+
+_AUDIENCE_SQL = {
+    'all': "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+    'buyers': "SELECT DISTINCT user_id FROM orders WHERE status = 'approved' AND user_id > ? ORDER BY user_id LIMIT ?",
+}
+_AUDIENCE_COUNT_SQL = {
+    'all': "SELECT COUNT(*) AS c FROM users",
+    'buyers': "SELECT COUNT(DISTINCT user_id) AS c FROM orders WHERE status = 'approved'",
+}
+
+_tasks = {}
+
+
+def _progress_text(b, finished: bool = False) -> str:
+    done = (b['sent'] or 0) + (b['failed'] or 0)
+    total = b['total'] or 0
+    percent = int(done * 100 / total) if total else 100
+    if finished:
+        title = "✅ **گزارش ارسال همگانی** ✅" if b['status'] == 'done' else "⛔ **ارسال همگانی لغو شد**"
+    else:
+        title = "\U0001F4E4 **ارسال همگانی در حال انجام...**"
+    return (
+        f"{title}\n\n"
+        f"تعداد کل هدف: {total}\n"
+        f"ارسال موفق: {b['sent'] or 0}\n"
+        f"ارسال ناموفق: {b['failed'] or 0}\n"
+        f"پیشرفت: {percent}%"
+    )
+
+
+def _cancel_markup(broadcast_id: int):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⛔ توقف ارسال", callback_data=f"broadcast_cancel_{broadcast_id}")]])
+
+
+async def _update_progress(bot, b, finished: bool = False):
+    if not b['progress_message_id']:
+        if finished:
+            try:
+                await bot.send_message(b['admin_chat_id'], _progress_text(b, finished), parse_mode='Markdown')
+            except TelegramError as e:
+                logger.warning(f"Broadcast {b['id']}: report failed: {e}")
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=b['admin_chat_id'],
+            message_id=b['progress_message_id'],
+            text=_progress_text(b, finished),
+            reply_markup=None if finished else _cancel_markup(b['id']),
+            parse_mode='Markdown',
+        )
+    except BadRequest as e:
+        if 'Message is not modified' not in str(e):
+            logger.warning(f"Broadcast {b['id']}: progress edit failed: {e}")
+    except TelegramError as e:
+        logger.warning(f"Broadcast {b['id']}: progress edit failed: {e}")
+
+
+async def start_broadcast(application, admin_chat_id: int, from_chat_id: int, message_id: int, mode: str, audience: str) -> int:
+    """Record a new broadcast and start sending it in the background; returns its id."""
+    audience = audience if audience in _AUDIENCE_SQL else 'all'
+    total = ((await adb.query(_AUDIENCE_COUNT_SQL[audience], one=True)) or {}).get('c', 0)
+    broadcast_id = await adb.execute(
+        "INSERT INTO broadcasts (admin_chat_id, from_chat_id, message_id, mode, audience, status, total, sent, failed, created_at) "
+        "VALUES (?, ?, ?, ?, ?, 'running', ?, 0, 0, ?)",
+        (admin_chat_id, from_chat_id, message_id, 'forward' if mode == 'forward' else 'copy', audience, total, datetime.now().isoformat()),
+    )
+    if not broadcast_id:
+        raise RuntimeError("could not create broadcast record")
+    try:
+        msg = await application.bot.send_message(
+            admin_chat_id,
+            f"\U0001F4E4 **ارسال همگانی در حال انجام...**\n\nتعداد کل هدف: {total}",
+            reply_markup=_cancel_markup(broadcast_id),
+            parse_mode='Markdown',
+        )
+        await adb.execute("UPDATE broadcasts SET progress_message_id = ? WHERE id = ?", (msg.message_id, broadcast_id))
+    except TelegramError as e:
+        logger.warning(f"Broadcast {broadcast_id}: could not send progress message: {e}")
+    _spawn(application, broadcast_id)
+    return broadcast_id
+
+
+async def cancel_broadcast(broadcast_id: int) -> bool:
+    row = await adb.query("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,), one=True)
+    if not row or row['status'] != 'running':
+        return False
+    await adb.execute("UPDATE broadcasts SET status = 'cancelled', finished_at = ? WHERE id = ?", (datetime.now().isoformat(), broadcast_id))
+    return True
+
+
+async def resume_broadcasts(application):
+    """Restart every broadcast that was still running when the bot stopped."""
+    rows = await adb.query("SELECT id FROM broadcasts WHERE status = 'running'") or []
+    for r in rows:
+        logger.info(f"Resuming broadcast {r['id']}")
+        _spawn(application, r['id'])
+
+
+def _spawn(application, broadcast_id: int):
+    task = _tasks.get(broadcast_id)
+    if task and not task.done():
+        return
+    _tasks[broadcast_id] = application.create_task(_run_broadcast(application.bot, broadcast_id), name=f"broadcast-{broadcast_id}")
+
+
+async def _run_broadcast(bot, broadcast_id: int):
+    try:
+        await _send_all(bot, broadcast_id)
+    except Exception as e:
+        # Leave status 'running' so the next start resumes it
+        logger.error(f"Broadcast {broadcast_id} stopped: {e}")
+    finally:
+        _tasks.pop(broadcast_id, None)
+
+
+def _record_delivery(broadcast_id: int, user_id: int, status: str, error):
+    # Delivery row and counter in one transaction; a recipient is only ever counted once
+    conn = get_connection()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status, error) VALUES (?, ?, ?, ?)",
+            (broadcast_id, user_id, status, error),
+        )
+        if cur.rowcount:
+            column = 'sent' if status == 'sent' else 'failed'
+            conn.execute(f"UPDATE broadcasts SET {column} = {column} + 1 WHERE id = ?", (broadcast_id,))
+
+
+async def _send_all(bot, broadcast_id: int):
+    b = await adb.query("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,), one=True)
+    if not b or b['status'] != 'running':
+        return
+    sender = RateLimitedSender(bot)
+    method = bot.forward_message if b['mode'] == 'forward' else bot.copy_message
+    cursor = b.get('resume_after') or 0
+    sql = _AUDIENCE_SQL.get(b['audience'], _AUDIENCE_SQL['all'])
+    last_progress = 0.0
+
+    async def _deliver(uid):
+        try:
+            await sender.call(method, uid, from_chat_id=b['from_chat_id'], message_id=b['message_id'])
+            status, error = 'sent', None
+        except Forbidden as e:
+            status, error = 'blocked', str(e)[:200]
+        except Exception as e:
+            status, error = 'failed', str(e)[:200]
+        await adb.run(_record_delivery, broadcast_id, uid, status, error)
+
+    while True:
+        state = await adb.query("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,), one=True)
+        if not state or state['status'] != 'running':
+            break
+        rows = await adb.query(sql, (cursor, max(1, BROADCAST_CHUNK_SIZE))) or []
+        if not rows:
+            await adb.execute("UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?", (datetime.now().isoformat(), broadcast_id))
+            break
+        # Skip recipients already recorded in this range (an interrupted chunk being resumed)
+        done = await adb.query(
+            "SELECT user_id FROM broadcast_deliveries WHERE broadcast_id = ? AND user_id > ? AND user_id <= ?",
+            (broadcast_id, cursor, rows[-1]['user_id']),
+        ) or []
+        done_ids = {r['user_id'] for r in done}
+        await asyncio.gather(*(_deliver(r['user_id']) for r in rows if r['user_id'] not in done_ids))
+        cursor = rows[-1]['user_id']
+        await adb.execute("UPDATE broadcasts SET resume_after = ? WHERE id = ?", (cursor, broadcast_id))
+        if time.monotonic() - last_progress >= BROADCAST_PROGRESS_SECONDS:
+            last_progress = time.monotonic()
+            b = await adb.query("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,), one=True)
+            await _update_progress(bot, b)
+
+    b = await adb.query("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,), one=True)
+    if b:
+        await _update_progress(bot, b, finished=True)
+        logger.info(f"Broadcast {broadcast_id} {b['status']}: sent={b['sent']} failed={b['failed']} total={b['total']}")
@@ -63,7 +63,54 @@ def _unify_chat_identifier(raw_id: str, username: str):
 # Prefer CHANNEL_ID if provided, otherwise CHANNEL_USERNAME
 CHANNEL_CHAT = _unify_chat_identifier(RAW_CHANNEL_ID, CHANNEL_USERNAME)
 DB_NAME = os.getenv("DB_NAME", "bot.db")
+# SQLite tuning (applied to every pooled connection)
+DB_BUSY_TIMEOUT = _safe_int(os.getenv("DB_BUSY_TIMEOUT", "10"), 10)
+DB_CACHE_SIZE_KB = _safe_int(os.getenv("DB_CACHE_SIZE_KB", "16384"), 16384)
+DB_MMAP_SIZE_MB = _safe_int(os.getenv("DB_MMAP_SIZE_MB", "128"), 128)
+# Reader threads behind the async DB facade (writes always use a single thread)
+DB_READ_WORKERS = _safe_int(os.getenv("DB_READ_WORKERS", "4"), 4)
+# Milliseconds non-critical writes wait to be committed together (0 writes them immediately)
+DB_WRITE_BEHIND_MS = _safe_int(os.getenv("DB_WRITE_BEHIND_MS", "300"), 300)
 NOBITEX_TOKEN = os.getenv("NOBITEX_TOKEN", "")
 
+# Panel HTTP: worker threads for blocking panel calls and keep-alive connections per panel
+PANEL_IO_WORKERS = _safe_int(os.getenv("PANEL_IO_WORKERS", "16"), 16)
+PANEL_POOL_SIZE = _safe_int(os.getenv("PANEL_POOL_SIZE", "8"), 8)
+# Seconds a panel login (cookie or token without a readable expiry) is reused before logging in again
+PANEL_AUTH_TTL = _safe_int(os.getenv("PANEL_AUTH_TTL", "600"), 600)
+# Seconds a fetched X-UI inbound (with its parsed client list) is reused by read-only views
+PANEL_INBOUND_CACHE_TTL = _safe_int(os.getenv("PANEL_INBOUND_CACHE_TTL", "30"), 30)
+
+# Force-join: seconds a "member" / "not a member" verdict is trusted, and seconds the channel link is cached
+FORCE_JOIN_MEMBER_TTL = _safe_int(os.getenv("FORCE_JOIN_MEMBER_TTL", "600"), 600)
+FORCE_JOIN_NEGATIVE_TTL = _safe_int(os.getenv("FORCE_JOIN_NEGATIVE_TTL", "15"), 15)
+FORCE_JOIN_CHANNEL_TTL = _safe_int(os.getenv("FORCE_JOIN_CHANNEL_TTL", "3600"), 3600)
+
 # Job schedule hour for daily tasks
 DAILY_JOB_HOUR = _safe_int(os.getenv("DAILY_JOB_HOUR", "9"), 9)
+# Panels fetched concurrently by the daily expiration check
+EXPIRY_PANEL_CONCURRENCY = _safe_int(os.getenv("EXPIRY_PANEL_CONCURRENCY", "4"), 4)
+# Renewal reminders sent per batch; each batch's reminder dates are saved before the next
+REMINDER_CHUNK_SIZE = _safe_int(os.getenv("REMINDER_CHUNK_SIZE", "200"), 200)
+# Telegram send limits: messages per second bot-wide, and seconds between messages to one chat
+TG_GLOBAL_RATE = _safe_int(os.getenv("TG_GLOBAL_RATE", "25"), 25)
+TG_PER_CHAT_INTERVAL = _safe_int(os.getenv("TG_PER_CHAT_INTERVAL", "1"), 1)
+# Admin notifications sent at the same time (one per admin)
+ADMIN_NOTIFY_CONCURRENCY = _safe_int(os.getenv("ADMIN_NOTIFY_CONCURRENCY", "5"), 5)
+# Broadcast engine: recipients loaded per chunk and seconds between progress message edits
+BROADCAST_CHUNK_SIZE = _safe_int(os.getenv("BROADCAST_CHUNK_SIZE", "200"), 200)
+BROADCAST_PROGRESS_SECONDS = _safe_int(os.getenv("BROADCAST_PROGRESS_SECONDS", "5"), 5)
+# Minutes between rebuilds of the X-UI email -> inbound index (0 disables the job)
+CLIENT_INDEX_SYNC_MINUTES = _safe_int(os.getenv("CLIENT_INDEX_SYNC_MINUTES", "30"), 30)
+# Minutes between scheduled backups sent to the primary admin by DM. Off by default (0):
+# full backups contain the whole DB, including panel passwords and tokens
+BACKUP_INTERVAL_MINUTES = _safe_int(os.getenv("BACKUP_INTERVAL_MINUTES", "0"), 0)
+# Hours between full scheduled backups; runs in between only ship rows changed since the last run
+BACKUP_FULL_INTERVAL_HOURS = _safe_int(os.getenv("BACKUP_FULL_INTERVAL_HOURS", "24"), 24)
+# QR codes: rendered images (and their Telegram file_id) kept per link, and threads that render cache misses
+QR_CACHE_SIZE = _safe_int(os.getenv("QR_CACHE_SIZE", "256"), 256)
+QR_RENDER_WORKERS = _safe_int(os.getenv("QR_RENDER_WORKERS", "2"), 2)
+# Subscription content: seconds a fetched /sub result is reused, URLs kept, and request timeout
+SUB_CACHE_TTL = _safe_int(os.getenv("SUB_CACHE_TTL", "60"), 60)
+SUB_CACHE_SIZE = _safe_int(os.getenv("SUB_CACHE_SIZE", "1000"), 1000)
+SUB_FETCH_TIMEOUT = _safe_int(os.getenv("SUB_FETCH_TIMEOUT", "15"), 15)
@@ -1,36 +1,246 @@
+import asyncio
+import functools
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from .config import DB_NAME, logger
+from .config import DB_NAME, DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB, DB_READ_WORKERS, DB_WRITE_BEHIND_MS, logger
+
+
+# --- Connection pool: one long-lived connection per thread ---
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # Per-connection pragmas; journal_mode=WAL is persistent and set once in db_setup
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{max(0, DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size={max(0, DB_MMAP_SIZE_MB) * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_db():
+    with _connections_lock:
+        conns = list(_connections)
+        _connections.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.__dict__.pop('conn', None)
 
 
 def query_db(query: str, args=(), one: bool = False):
     try:
-        with sqlite3.connect(DB_NAME, check_same_thread=False) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(query, args)
-            rows = cursor.fetchall()
-            if one:
-                return dict(rows[0]) if rows else None
-            return [dict(row) for row in rows]
+        conn = get_connection()
+        cursor = conn.execute(query, args)
+        rows = cursor.fetchall()
+        if conn.in_transaction:
+            conn.commit()
+        if one:
+            return dict(rows[0]) if rows else None
+        return [dict(row) for row in rows]
     except sqlite3.Error as e:
         logger.error(f"DB query error: {e}")
         return None if one else []
 
 
 def execute_db(query: str, args=()):
+    conn = None
     try:
-        with sqlite3.connect(DB_NAME, check_same_thread=False) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, args)
-            conn.commit()
-            return cursor.lastrowid
+        conn = get_connection()
+        cursor = conn.execute(query, args)
+        conn.commit()
+        return cursor.lastrowid
     except sqlite3.Error as e:
         logger.error(f"DB execute error: {e}")
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
         return None
 
 
-def initialize_default_content(cursor: sqlite3.Cursor, conn: sqlite3.Connection):
+def execute_many_db(query: str, seq_of_args):
+    """Run one statement for many parameter tuples in a single transaction."""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.executemany(query, seq_of_args)
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"DB executemany error: {e}")
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+        return None
+
+
+class AsyncDB:
+    """Async facade over query_db/execute_db for use inside handlers.
+
+    Reads run on a small pool of reader threads and writes on a single writer
+    thread, each with its own pooled connection, so a slow statement never
+    blocks the event loop. Writes made through adb are serialized with each
+    other, but not with code that still calls execute_db/query_db directly
+    (from the loop thread, jobs or the write-behind flusher); those rely on
+    SQLite's locking and DB_BUSY_TIMEOUT like any other connection.
+    """
+
+    def __init__(self, read_workers: int = DB_READ_WORKERS):
+        self._read_workers = max(1, read_workers)
+        self._reader: ThreadPoolExecutor | None = None
+        self._writer: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _pools(self) -> tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        if self._reader is None or self._writer is None:
+            with self._lock:
+                if self._reader is None:
+                    self._reader = ThreadPoolExecutor(max_workers=self._read_workers, thread_name_prefix='db-read')
+                if self._writer is None:
+                    self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        return self._reader, self._writer
+
+    async def query(self, query: str, args=(), one: bool = False):
+        reader, _ = self._pools()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(reader, functools.partial(query_db, query, args, one))
+
+    async def execute(self, query: str, args=()):
+        _, writer = self._pools()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(writer, functools.partial(execute_db, query, args))
+
+    async def execute_many(self, query: str, seq_of_args):
+        _, writer = self._pools()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(writer, functools.partial(execute_many_db, query, list(seq_of_args)))
+
+    async def run_read(self, func, *args, **kwargs):
+        """Run a read-only DB-bound callable (several queries, building a result) on a reader thread."""
+        reader, _ = self._pools()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(reader, functools.partial(func, *args, **kwargs))
+
+    async def run(self, func, *args, **kwargs):
+        """Run an arbitrary DB-bound callable on the writer thread."""
+        _, writer = self._pools()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(writer, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        with self._lock:
+            pools = (self._reader, self._writer)
+            self._reader = None
+            self._writer = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+
+adb = AsyncDB()
+
+
+class WriteBehind:
+    """Queue for non-critical writes (last seen link, referral rows, ...).
+
+    put() returns immediately; a background thread commits everything queued
+    in a single transaction at most every ``interval_ms``. Writes queued under
+    the same ``key`` replace each other, so only the latest value is written.
+    Anything a later read depends on right away must not go through here.
+    """
+
+    def __init__(self, interval_ms: int = DB_WRITE_BEHIND_MS):
+        self._interval = max(0, interval_ms) / 1000.0
+        self._pending: dict = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+
+    def put(self, query: str, args=(), key=None):
+        if self._interval <= 0 or self._closed:
+            execute_db(query, args)
+            return
+        with self._cond:
+            if key is None:
+                self._seq += 1
+                key = ('_seq', self._seq)
+            # Re-insert so a replaced write keeps its place after earlier ones
+            self._pending.pop(key, None)
+            self._pending[key] = (query, tuple(args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            # Give other writes of the same burst a chance to join this batch
+            time.sleep(self._interval)
+            self.flush()
+
+    def flush(self) -> int:
+        """Commit everything queued now; returns the number of statements written."""
+        with self._cond:
+            batch = list(self._pending.values())
+            self._pending.clear()
+        if not batch:
+            return 0
+        conn = get_connection()
+        try:
+            with conn:
+                for query, args in batch:
+                    conn.execute(query, args)
+        except sqlite3.Error as e:
+            logger.error(f"Write-behind batch of {len(batch)} failed ({e}); retrying one by one")
+            for query, args in batch:
+                execute_db(query, args)
+        return len(batch)
+
+    def shutdown(self):
+        """Stop the flusher thread and write whatever is still queued."""
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._thread = None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush()
+
+
+write_behind = WriteBehind()
+
+
+def initialize_default_content(cursor: sqlite3.Cursor):
     default_messages = {
         'start_main': ('\U0001F44B سلام! به ربات فروش کانفیگ ما خوش آمدید.\nبرای شروع از دکمه‌های زیر استفاده کنید.', None, None),
         'admin_panel_main': ('\U0001F5A5\uFE0F پنل مدیریت ربات. لطفا یک گزینه را انتخاب کنید.', None, None),
@@ -39,50 +249,46 @@ def initialize_default_content(cursor: sqlite3.Cursor, conn: sqlite3.Connection)
         'renewal_reminder_text': ('\u26A0\uFE0F **یادآوری تمدید سرویس**\n\nکاربر گرامی، اعتبار سرویس شما با نام کاربری `{marzban_username}` رو به اتمام است.\n\n{details}\n\nبرای جلوگیری از قطع شدن سرویس، لطفاً از طریق دکمه "سرویس من" در منوی اصلی ربات اقدام به تمدید نمایید.', None, None)
     }
 
-    for name, (text, f_id, f_type) in default_messages.items():
-        cursor.execute(
-            "INSERT OR IGNORE INTO messages (message_name, text, file_id, file_type) VALUES (?, ?, ?, ?)",
-            (name, text, f_id, f_type),
-        )
-
-    conn.commit()
+    cursor.executemany(
+        "INSERT OR IGNORE INTO messages (message_name, text, file_id, file_type) VALUES (?, ?, ?, ?)",
+        [(name, text, f_id, f_type) for name, (text, f_id, f_type) in default_messages.items()],
+    )
 
-    from .db import query_db as _query_db, execute_db as _execute_db
+    def _one(sql, args=()):
+        return cursor.execute(sql, args).fetchone()
 
-    if not _query_db("SELECT 1 FROM panels", one=True):
-        url_row = _query_db("SELECT value FROM settings WHERE key = 'panel_url'", one=True)
-        user_row = _query_db("SELECT value FROM settings WHERE key = 'panel_user'", one=True)
-        password_row = _query_db("SELECT value FROM settings WHERE key = 'panel_pass'", one=True)
+    if not _one("SELECT 1 FROM panels"):
+        url_row = _one("SELECT value FROM settings WHERE key = 'panel_url'")
+        user_row = _one("SELECT value FROM settings WHERE key = 'panel_user'")
+        password_row = _one("SELECT value FROM settings WHERE key = 'panel_pass'")
 
-        url = url_row.get('value') if url_row else 'https://your-panel.com'
-        user = user_row.get('value') if user_row else 'admin'
-        password = password_row.get('value') if password_row else 'password'
+        url = url_row['value'] if url_row else 'https://your-panel.com'
+        user = user_row['value'] if user_row else 'admin'
+        password = password_row['value'] if password_row else 'password'
 
-        _execute_db(
+        cursor.execute(
             "INSERT INTO panels (name, panel_type, url, username, password, sub_base) VALUES (?, ?, ?, ?, ?, ?)",
             ('پنل اصلی (پیش‌فرض)', 'marzban', url, user, password, None),
         )
-        _execute_db("DELETE FROM settings WHERE key IN ('panel_url', 'panel_user', 'panel_pass')")
-
-    default_settings = {'free_trial_days': '1', 'free_trial_gb': '0.2', 'free_trial_status': '1'}
-    for key, value in default_settings.items():
-        _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
+        cursor.execute("DELETE FROM settings WHERE key IN ('panel_url', 'panel_user', 'panel_pass')")
 
     # Insert default cards
-    if not _query_db("SELECT 1 FROM cards", one=True):
-        _execute_db(
+    if not _one("SELECT 1 FROM cards"):
+        cursor.execute(
             "INSERT INTO cards (card_number, holder_name) VALUES (?, ?)",
             ("6037-0000-0000-0000", "نام دارنده کارت"),
         )
 
-    # Ensure USD rate related settings exist
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_manual', ''))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_cached', ''))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_cached_ts', ''))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_mode', 'manual'))
-
-    # Payment method toggles and gateway config
     defaults = [
+        ('free_trial_days', '1'),
+        ('free_trial_gb', '0.2'),
+        ('free_trial_status', '1'),
+        # USD rate
+        ('usd_irt_manual', ''),
+        ('usd_irt_cached', ''),
+        ('usd_irt_cached_ts', ''),
+        ('usd_irt_mode', 'manual'),
+        # Payment method toggles and gateway config
         ('pay_card_enabled', '1'),
         ('pay_crypto_enabled', '1'),
         ('pay_gateway_enabled', '0'),
@@ -107,278 +313,568 @@ def initialize_default_content(cursor: sqlite3.Cursor, conn: sqlite3.Connection)
         ('reseller_duration_days', '30'),
         ('reseller_max_purchases', '10'),
     ]
-    for k, v in defaults:
-        _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (k, v))
+    cursor.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", defaults)
 
 
-def db_setup():
-    with sqlite3.connect(DB_NAME, check_same_thread=False) as conn:
-        cursor = conn.cursor()
-        # --- Create Tables ---
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, join_date TEXT)"
+# --- Versioned migrations ---
+# Each step runs once, in order; db_setup applies all pending steps in a single
+# transaction and records them in schema_version. Append new steps to
+# MIGRATIONS (including new default settings), never edit old ones.
+
+def _add_missing_columns(cursor: sqlite3.Cursor, table: str, columns):
+    existing = {col[1] for col in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+    for name, decl in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _migrate_legacy_columns(cursor: sqlite3.Cursor):
+    # Columns added to existing installs before migrations were versioned;
+    # new databases already get them from CREATE TABLE.
+    _add_missing_columns(cursor, 'users', [('referrer_id', 'INTEGER')])
+    panel_cols = {col[1] for col in cursor.execute("PRAGMA table_info(panels)").fetchall()}
+    _add_missing_columns(cursor, 'panels', [
+        ('panel_type', "TEXT NOT NULL DEFAULT 'marzban'"),
+        ('sub_base', 'TEXT'),
+        ('token', 'TEXT'),
+        ('endpoint_hints', 'TEXT'),
+    ])
+    if 'panel_type' not in panel_cols:
+        cursor.execute("UPDATE panels SET panel_type = 'marzban' WHERE panel_type IS NULL")
+    _add_missing_columns(cursor, 'orders', [
+        ('panel_id', 'INTEGER'),
+        ('discount_code', 'TEXT'),
+        ('final_price', 'INTEGER'),
+        ('last_reminder_date', 'TEXT'),
+        ('panel_type', 'TEXT'),
+        ('last_link', 'TEXT'),
+        ('xui_inbound_id', 'INTEGER'),
+        ('xui_client_id', 'TEXT'),
+        ('is_trial', 'INTEGER DEFAULT 0'),
+        ('reseller_applied', 'INTEGER DEFAULT 0'),
+    ])
+
+
+def _migrate_hot_query_indexes(cursor: sqlite3.Cursor):
+    # orders(status, user_id) serves both "status = ?" scans and "user_id = ? AND status = ?" lookups;
+    # referrals(referrer_id) is already covered by its UNIQUE(referrer_id, referee_id) index
+    for stmt in (
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_user ON orders(status, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_username ON orders(marzban_username)",
+        "CREATE INDEX IF NOT EXISTS idx_wallet_tx_status ON wallet_transactions(status)",
+        "CREATE INDEX IF NOT EXISTS idx_wallet_tx_reference ON wallet_transactions(reference)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets(status)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket ON ticket_messages(ticket_id)",
+        "CREATE INDEX IF NOT EXISTS idx_buttons_menu ON buttons(menu_name, row, col)",
+        "CREATE INDEX IF NOT EXISTS idx_tutorial_media_tutorial ON tutorial_media(tutorial_id, sort_order)",
+    ):
+        cursor.execute(stmt)
+
+
+# Tables whose changed rows go into incremental backups (see bot/backup.py)
+BACKUP_TRACKED_TABLES = ('users', 'orders', 'wallet_transactions', 'tickets')
+
+
+def _migrate_backup_change_tracking(cursor: sqlite3.Cursor):
+    # One row per touched (table, rowid) holding the latest change sequence, so
+    # the log stays bounded by table size even if backups never prune it.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backup_changes (
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tbl, row_id)
         )
-        # Referrals
-        cursor.execute("PRAGMA table_info(users)")
-        ucols = [col[1] for col in cursor.fetchall()]
-        if 'referrer_id' not in ucols:
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER")
-            except sqlite3.Error:
-                pass
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_id INTEGER NOT NULL,
-                referee_id INTEGER NOT NULL,
-                created_at TEXT NOT NULL,
-                UNIQUE(referrer_id, referee_id)
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_backup_changes_seq ON backup_changes(seq)")
+    next_seq = "(SELECT COALESCE(MAX(seq), 0) + 1 FROM backup_changes)"
+    for table in BACKUP_TRACKED_TABLES:
+        for event, ref, deleted in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0), ('DELETE', 'OLD', 1)):
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS trg_backup_{table}_{event.lower()} AFTER {event} ON {table} BEGIN "
+                f"INSERT OR REPLACE INTO backup_changes (tbl, row_id, seq, deleted) "
+                f"VALUES ('{table}', {ref}.rowid, {next_seq}, {deleted}); END"
             )
-            """
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS messages (message_name TEXT PRIMARY KEY, text TEXT, file_id TEXT, file_type TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS buttons (id INTEGER PRIMARY KEY AUTOINCREMENT, menu_name TEXT, text TEXT, target TEXT, is_url BOOLEAN DEFAULT 0, row INTEGER, col INTEGER)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS plans (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, price INTEGER NOT NULL, duration_days INTEGER NOT NULL, traffic_gb REAL NOT NULL)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY AUTOINCREMENT, card_number TEXT NOT NULL, holder_name TEXT NOT NULL)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS free_trials (user_id INTEGER PRIMARY KEY, timestamp TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS discount_codes (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT UNIQUE NOT NULL, percentage INTEGER NOT NULL, usage_limit INTEGER NOT NULL, times_used INTEGER DEFAULT 0, expiry_date TEXT)"
-        )
+
+
+# Columns whose updates count as a change for incremental backups; service-only
+# columns (last_link, last_reminder_date) are rewritten constantly and left out
+_BACKUP_UPDATE_COLUMNS = {
+    'orders': (
+        'user_id', 'plan_id', 'status', 'marzban_username', 'screenshot_file_id', 'timestamp', 'panel_id',
+        'discount_code', 'final_price', 'panel_type', 'xui_inbound_id', 'xui_client_id', 'reseller_applied',
+        'is_trial', 'payment_method',
+    ),
+    'users': ('first_name', 'join_date', 'referrer_id'),
+}
+
+
+def _migrate_backup_update_columns(cursor: sqlite3.Cursor):
+    next_seq = "(SELECT COALESCE(MAX(seq), 0) + 1 FROM backup_changes)"
+    for table, columns in _BACKUP_UPDATE_COLUMNS.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_backup_{table}_update")
         cursor.execute(
-            "CREATE TABLE IF NOT EXISTS panels (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, panel_type TEXT NOT NULL DEFAULT 'marzban', url TEXT NOT NULL, username TEXT NOT NULL, password TEXT NOT NULL, sub_base TEXT, token TEXT)"
+            f"CREATE TRIGGER trg_backup_{table}_update AFTER UPDATE OF {', '.join(columns)} ON {table} BEGIN "
+            f"INSERT OR REPLACE INTO backup_changes (tbl, row_id, seq, deleted) "
+            f"VALUES ('{table}', NEW.rowid, {next_seq}, 0); END"
         )
-        # Migrations for existing tables
-        cursor.execute("PRAGMA table_info(panels)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'panel_type' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN panel_type TEXT NOT NULL DEFAULT 'marzban'")
-                cursor.execute("UPDATE panels SET panel_type = 'marzban' WHERE panel_type IS NULL")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding panel_type to panels: {e}")
-        cursor.execute("PRAGMA table_info(panels)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'sub_base' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN sub_base TEXT")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding sub_base to panels: {e}")
-        cursor.execute("PRAGMA table_info(panels)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'token' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN token TEXT")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding token to panels: {e}")
-        # --- NEW: Table for manually setting inbounds for each panel ---
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS panel_inbounds (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                panel_id INTEGER NOT NULL,
-                protocol TEXT NOT NULL,
-                tag TEXT NOT NULL,
-                UNIQUE(panel_id, tag),
-                FOREIGN KEY (panel_id) REFERENCES panels(id) ON DELETE CASCADE
+
+
+# Revenue aggregates (see bot/stats.py): one row per period (YYYY-MM-DD and
+# YYYY-MM) and breakdown key, kept current by triggers on orders.
+_STATS_DIMS = (
+    ('all', "''"),
+    ('plan', "CAST({r}.plan_id AS TEXT)"),
+    ('panel', "COALESCE(CAST({r}.panel_id AS TEXT), '')"),
+    ('method', "COALESCE({r}.payment_method, '')"),
+)
+_STATS_TS = "COALESCE({r}.timestamp, datetime('now', 'localtime'))"
+_STATS_PERIODS = ("substr(" + _STATS_TS + ", 1, 10)", "substr(" + _STATS_TS + ", 1, 7)")
+_STATS_AMOUNT = "COALESCE({r}.final_price, (SELECT price FROM plans WHERE id = {r}.plan_id), 0)"
+
+
+def _stats_revenue_stmts(r: str, sign: int) -> str:
+    stmts = []
+    for period in _STATS_PERIODS:
+        for dim, key in _STATS_DIMS:
+            stmts.append(
+                f"INSERT INTO stats_revenue (period, dim, key, orders, revenue) "
+                f"VALUES ({period.format(r=r)}, '{dim}', {key.format(r=r)}, {sign}, {sign} * {_STATS_AMOUNT.format(r=r)}) "
+                f"ON CONFLICT(period, dim, key) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue;"
             )
-            """
+    return ' '.join(stmts)
+
+
+def _migrate_stats_aggregates(cursor: sqlite3.Cursor):
+    _add_missing_columns(cursor, 'orders', [('payment_method', 'TEXT')])
+    # Best guess for existing orders; new ones record the method when created
+    cursor.execute(
+        """
+        UPDATE orders SET payment_method = CASE
+            WHEN COALESCE(is_trial, 0) = 1 THEN 'trial'
+            WHEN EXISTS (SELECT 1 FROM wallet_transactions w WHERE w.reference = 'order_' || orders.id) THEN 'wallet'
+            WHEN screenshot_file_id IS NOT NULL THEN 'card'
+            ELSE NULL END
+        WHERE payment_method IS NULL
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_revenue (
+            period TEXT NOT NULL,
+            dim TEXT NOT NULL,
+            key TEXT NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, dim, key)
         )
+        """
+    )
+    cursor.execute("CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
 
-        # Orders table with conditional add columns
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='orders'")
-        if cursor.fetchone():
-            cursor.execute("PRAGMA table_info(orders)")
-            columns = [col[1] for col in cursor.fetchall()]
-            if 'panel_id' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN panel_id INTEGER")
-            if 'discount_code' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN discount_code TEXT")
-            if 'final_price' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN final_price INTEGER")
-            if 'last_reminder_date' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN last_reminder_date TEXT")
-            if 'panel_type' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN panel_type TEXT")
-            if 'last_link' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN last_link TEXT")
-                except sqlite3.Error:
-                    pass
-            if 'xui_inbound_id' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN xui_inbound_id INTEGER")
-                except sqlite3.Error:
-                    pass
-            if 'xui_client_id' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN xui_client_id TEXT")
-                except sqlite3.Error:
-                    pass
-            if 'is_trial' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN is_trial INTEGER DEFAULT 0")
-                except sqlite3.Error:
-                    pass
-        else:
+    # Backfill from history once; from here on the triggers keep both tables current
+    for period in _STATS_PERIODS:
+        for dim, key in _STATS_DIMS:
             cursor.execute(
-                """
-                CREATE TABLE orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, plan_id INTEGER NOT NULL,
-                    status TEXT DEFAULT 'pending', marzban_username TEXT, screenshot_file_id TEXT, timestamp TEXT,
-                    panel_id INTEGER, discount_code TEXT, final_price INTEGER, last_reminder_date TEXT, panel_type TEXT,
-                    last_link TEXT, xui_inbound_id INTEGER, xui_client_id TEXT, reseller_applied INTEGER DEFAULT 0,
-                    is_trial INTEGER DEFAULT 0
-                )
-                """
+                f"INSERT OR REPLACE INTO stats_revenue (period, dim, key, orders, revenue) "
+                f"SELECT {period.format(r='o')}, '{dim}', {key.format(r='o')}, COUNT(*), SUM({_STATS_AMOUNT.format(r='o')}) "
+                f"FROM orders o WHERE o.status = 'approved' GROUP BY 1, 3"
             )
-        # NEW: wallets and wallet_transactions
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS wallets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                asset TEXT NOT NULL,
-                chain TEXT NOT NULL,
-                address TEXT NOT NULL,
-                memo TEXT
+    cursor.execute("INSERT OR REPLACE INTO stats_counters (name, value) SELECT 'users', COUNT(*) FROM users")
+    cursor.execute("INSERT OR REPLACE INTO stats_counters (name, value) SELECT 'buyers', COUNT(DISTINCT user_id) FROM orders WHERE status = 'approved'")
+
+    buyer_added = (
+        "UPDATE stats_counters SET value = value + 1 WHERE name = 'buyers' AND NOT EXISTS "
+        "(SELECT 1 FROM orders WHERE user_id = NEW.user_id AND status = 'approved' AND id != NEW.id);"
+    )
+    buyer_removed = (
+        "UPDATE stats_counters SET value = value - 1 WHERE name = 'buyers' AND NOT EXISTS "
+        "(SELECT 1 FROM orders WHERE user_id = OLD.user_id AND status = 'approved');"
+    )
+    for name, event, when, body in (
+        ('orders_insert', 'INSERT', "NEW.status = 'approved'", _stats_revenue_stmts('NEW', 1) + ' ' + buyer_added),
+        ('orders_approve', 'UPDATE OF status', "NEW.status = 'approved' AND OLD.status IS NOT 'approved'", _stats_revenue_stmts('NEW', 1) + ' ' + buyer_added),
+        ('orders_unapprove', 'UPDATE OF status', "OLD.status = 'approved' AND NEW.status IS NOT 'approved'", _stats_revenue_stmts('OLD', -1) + ' ' + buyer_removed),
+        ('orders_delete', 'DELETE', "OLD.status = 'approved'", _stats_revenue_stmts('OLD', -1) + ' ' + buyer_removed),
+    ):
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_stats_{name} AFTER {event} ON orders WHEN {when} BEGIN {body} END")
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users BEGIN UPDATE stats_counters SET value = value + 1 WHERE name = 'users'; END")
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users BEGIN UPDATE stats_counters SET value = value - 1 WHERE name = 'users'; END")
+
+
+def _migrate_broadcast_resume(cursor: sqlite3.Cursor):
+    # Highest user_id of the last fully handled chunk; deliveries themselves are recorded one by one
+    _add_missing_columns(cursor, 'broadcasts', [('resume_after', 'INTEGER NOT NULL DEFAULT 0')])
+
+
+# Per-order snapshot of what each approved order contributed to stats_revenue,
+# so removing or re-filing an order subtracts exactly what was added even if
+# the plan price changed in between.
+_STATS_SNAPSHOT_COLS = ("day", "month")
+_STATS_SNAPSHOT_KEYS = (('all', None), ('plan', 'plan_key'), ('panel', 'panel_key'), ('method', 'method_key'))
+
+
+def _stats_snapshot_insert(r: str) -> str:
+    keys = {dim: key for dim, key in _STATS_DIMS}
+    return (
+        "INSERT OR REPLACE INTO stats_orders (order_id, day, month, plan_key, panel_key, method_key, amount) "
+        f"VALUES ({r}.id, {_STATS_PERIODS[0].format(r=r)}, {_STATS_PERIODS[1].format(r=r)}, "
+        f"{keys['plan'].format(r=r)}, {keys['panel'].format(r=r)}, {keys['method'].format(r=r)}, {_STATS_AMOUNT.format(r=r)});"
+    )
+
+
+def _stats_snapshot_apply(r: str, sign: int) -> str:
+    stmts = []
+    for period_col in _STATS_SNAPSHOT_COLS:
+        for dim, key_col in _STATS_SNAPSHOT_KEYS:
+            key = f"s.{key_col}" if key_col else "''"
+            stmts.append(
+                f"INSERT INTO stats_revenue (period, dim, key, orders, revenue) "
+                f"SELECT s.{period_col}, '{dim}', {key}, {sign}, {sign} * s.amount "
+                f"FROM stats_orders s WHERE s.order_id = {r}.id "
+                f"ON CONFLICT(period, dim, key) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue;"
             )
-            """
+    return ' '.join(stmts)
+
+
+def _migrate_stats_order_snapshots(cursor: sqlite3.Cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_orders (
+            order_id INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            month TEXT NOT NULL,
+            plan_key TEXT NOT NULL,
+            panel_key TEXT NOT NULL,
+            method_key TEXT NOT NULL,
+            amount INTEGER NOT NULL
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS user_wallets (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER NOT NULL DEFAULT 0
+        """
+    )
+    # Rebuild the aggregates from the snapshots so both start out consistent
+    cursor.execute("DELETE FROM stats_orders")
+    keys = {dim: key for dim, key in _STATS_DIMS}
+    cursor.execute(
+        "INSERT INTO stats_orders (order_id, day, month, plan_key, panel_key, method_key, amount) "
+        f"SELECT o.id, {_STATS_PERIODS[0].format(r='o')}, {_STATS_PERIODS[1].format(r='o')}, "
+        f"{keys['plan'].format(r='o')}, {keys['panel'].format(r='o')}, {keys['method'].format(r='o')}, {_STATS_AMOUNT.format(r='o')} "
+        "FROM orders o WHERE o.status = 'approved'"
+    )
+    cursor.execute("DELETE FROM stats_revenue")
+    for period_col in _STATS_SNAPSHOT_COLS:
+        for dim, key_col in _STATS_SNAPSHOT_KEYS:
+            key = key_col or "''"
+            cursor.execute(
+                f"INSERT INTO stats_revenue (period, dim, key, orders, revenue) "
+                f"SELECT {period_col}, '{dim}', {key}, COUNT(*), SUM(amount) FROM stats_orders GROUP BY 1, 3"
             )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS wallet_transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                amount INTEGER NOT NULL,
-                direction TEXT NOT NULL, -- credit/debit
-                method TEXT NOT NULL,    -- gateway/crypto/card/manual
-                status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
-                created_at TEXT NOT NULL,
-                screenshot_file_id TEXT,
-                reference TEXT,
-                meta TEXT
+
+    buyer_added = (
+        "UPDATE stats_counters SET value = value + 1 WHERE name = 'buyers' AND NOT EXISTS "
+        "(SELECT 1 FROM orders WHERE user_id = NEW.user_id AND status = 'approved' AND id != NEW.id);"
+    )
+    buyer_removed = (
+        "UPDATE stats_counters SET value = value - 1 WHERE name = 'buyers' AND NOT EXISTS "
+        "(SELECT 1 FROM orders WHERE user_id = OLD.user_id AND status = 'approved');"
+    )
+    add = _stats_snapshot_insert('NEW') + ' ' + _stats_snapshot_apply('NEW', 1)
+    remove = _stats_snapshot_apply('OLD', -1) + " DELETE FROM stats_orders WHERE order_id = OLD.id;"
+    refile = _stats_snapshot_apply('OLD', -1) + ' ' + add
+    for name, event, when, body in (
+        ('orders_insert', 'INSERT', "NEW.status = 'approved'", add + ' ' + buyer_added),
+        ('orders_approve', 'UPDATE OF status', "NEW.status = 'approved' AND OLD.status IS NOT 'approved'", add + ' ' + buyer_added),
+        ('orders_unapprove', 'UPDATE OF status', "OLD.status = 'approved' AND NEW.status IS NOT 'approved'", remove + ' ' + buyer_removed),
+        ('orders_delete', 'DELETE', "OLD.status = 'approved'", remove + ' ' + buyer_removed),
+        # Edits to an order that stays approved move its contribution to the new buckets
+        ('orders_refile', 'UPDATE OF final_price, plan_id, panel_id, payment_method, timestamp',
+         "OLD.status = 'approved' AND NEW.status = 'approved'", refile),
+    ):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_stats_{name}")
+        cursor.execute(f"CREATE TRIGGER trg_stats_{name} AFTER {event} ON orders WHEN {when} BEGIN {body} END")
+
+
+MIGRATIONS = [
+    (1, "legacy column additions", _migrate_legacy_columns),
+    (2, "indexes for hot queries", _migrate_hot_query_indexes),
+    (3, "default messages, settings, panel and card", initialize_default_content),
+    (4, "change tracking for incremental backups", _migrate_backup_change_tracking),
+    (5, "materialized revenue and user stats", _migrate_stats_aggregates),
+    (6, "backup change tracking ignores service-only columns", _migrate_backup_update_columns),
+    (7, "broadcast resume point", _migrate_broadcast_resume),
+    (8, "per-order stats snapshots and re-filing of edited orders", _migrate_stats_order_snapshots),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        # No schema_version table yet: brand-new or pre-versioning database
+        return 0
+    return (row[0] if row else None) or 0
+
+
+def db_setup():
+    conn = get_connection()
+    try:
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()
+        logger.info(f"SQLite journal_mode={mode[0] if mode else 'unknown'}")
+    except sqlite3.Error as e:
+        logger.error(f"Could not enable WAL mode: {e}")
+    current = _schema_version(conn)
+    if current >= SCHEMA_VERSION:
+        logger.info(f"DB schema is up to date (version {current})")
+        return
+    # Tables, pending migrations and their version rows commit together or not at all
+    conn.execute("BEGIN")
+    try:
+        _create_tables(conn.cursor())
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            step(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now().isoformat()),
             )
-            """
+            logger.info(f"Applied DB migration {version}: {name}")
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"DB setup failed at schema version {current}: {e}")
+        raise
+
+
+def _create_tables(cursor: sqlite3.Cursor):
+    # --- Create Tables ---
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, join_date TEXT)"
+    )
+    # Referrals
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referrer_id INTEGER NOT NULL,
+            referee_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            UNIQUE(referrer_id, referee_id)
         )
-        # Reseller tables
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS resellers (
-                user_id INTEGER PRIMARY KEY,
-                status TEXT NOT NULL DEFAULT 'active',
-                activated_at TEXT NOT NULL,
-                expires_at TEXT NOT NULL,
-                discount_percent INTEGER NOT NULL,
-                max_purchases INTEGER NOT NULL,
-                used_purchases INTEGER NOT NULL DEFAULT 0
-            )
-            """
+        """
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS messages (message_name TEXT PRIMARY KEY, text TEXT, file_id TEXT, file_type TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS buttons (id INTEGER PRIMARY KEY AUTOINCREMENT, menu_name TEXT, text TEXT, target TEXT, is_url BOOLEAN DEFAULT 0, row INTEGER, col INTEGER)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS plans (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, price INTEGER NOT NULL, duration_days INTEGER NOT NULL, traffic_gb REAL NOT NULL)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY AUTOINCREMENT, card_number TEXT NOT NULL, holder_name TEXT NOT NULL)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS free_trials (user_id INTEGER PRIMARY KEY, timestamp TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS discount_codes (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT UNIQUE NOT NULL, percentage INTEGER NOT NULL, usage_limit INTEGER NOT NULL, times_used INTEGER DEFAULT 0, expiry_date TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS panels (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, panel_type TEXT NOT NULL DEFAULT 'marzban', url TEXT NOT NULL, username TEXT NOT NULL, password TEXT NOT NULL, sub_base TEXT, token TEXT)"
+    )
+    # --- NEW: Table for manually setting inbounds for each panel ---
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS panel_inbounds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            panel_id INTEGER NOT NULL,
+            protocol TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            UNIQUE(panel_id, tag),
+            FOREIGN KEY (panel_id) REFERENCES panels(id) ON DELETE CASCADE
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS reseller_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                amount INTEGER NOT NULL,
-                method TEXT NOT NULL, -- card/crypto/gateway
-                status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
-                created_at TEXT NOT NULL,
-                screenshot_file_id TEXT,
-                reference TEXT,
-                meta TEXT
-            )
-            """
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, plan_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending', marzban_username TEXT, screenshot_file_id TEXT, timestamp TEXT,
+            panel_id INTEGER, discount_code TEXT, final_price INTEGER, last_reminder_date TEXT, panel_type TEXT,
+            last_link TEXT, xui_inbound_id INTEGER, xui_client_id TEXT, reseller_applied INTEGER DEFAULT 0,
+            is_trial INTEGER DEFAULT 0
         )
-        # Migration: add reseller_applied if missing
-        cursor.execute("PRAGMA table_info(orders)")
-        ocols = [col[1] for col in cursor.fetchall()]
-        if 'reseller_applied' not in ocols:
-            try:
-                cursor.execute("ALTER TABLE orders ADD COLUMN reseller_applied INTEGER DEFAULT 0")
-            except sqlite3.Error:
-                pass
-        # Tickets table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                content_type TEXT,
-                text TEXT,
-                file_id TEXT,
-                created_at TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'pending'
-            )
-            """
+        """
+    )
+    # NEW: wallets and wallet_transactions
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wallets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            asset TEXT NOT NULL,
+            chain TEXT NOT NULL,
+            address TEXT NOT NULL,
+            memo TEXT
         )
-        # Threaded ticket messages (new)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS ticket_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticket_id INTEGER NOT NULL,
-                sender TEXT NOT NULL, -- 'user' | 'admin'
-                content_type TEXT,
-                text TEXT,
-                file_id TEXT,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
-            )
-            """
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_wallets (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0
         )
-        # Tutorials
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tutorials (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                sort_order INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL
-            )
-            """
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wallet_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            direction TEXT NOT NULL, -- credit/debit
+            method TEXT NOT NULL,    -- gateway/crypto/card/manual
+            status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
+            created_at TEXT NOT NULL,
+            screenshot_file_id TEXT,
+            reference TEXT,
+            meta TEXT
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tutorial_media (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tutorial_id INTEGER NOT NULL,
-                content_type TEXT NOT NULL,
-                file_id TEXT NOT NULL,
-                caption TEXT,
-                sort_order INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (tutorial_id) REFERENCES tutorials(id) ON DELETE CASCADE
-            )
-            """
+        """
+    )
+    # Reseller tables
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS resellers (
+            user_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'active',
+            activated_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            discount_percent INTEGER NOT NULL,
+            max_purchases INTEGER NOT NULL,
+            used_purchases INTEGER NOT NULL DEFAULT 0
         )
-        # Admins table (additional admins besides primary ADMIN_ID)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS admins (
-                user_id INTEGER PRIMARY KEY
-            )
-            """
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reseller_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            method TEXT NOT NULL, -- card/crypto/gateway
+            status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
+            created_at TEXT NOT NULL,
+            screenshot_file_id TEXT,
+            reference TEXT,
+            meta TEXT
         )
-        conn.commit()
-        initialize_default_content(cursor, conn)
\ No newline at end of file
+        """
+    )
+    # Tickets table
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            content_type TEXT,
+            text TEXT,
+            file_id TEXT,
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending'
+        )
+        """
+    )
+    # Threaded ticket messages (new)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            sender TEXT NOT NULL, -- 'user' | 'admin'
+            content_type TEXT,
+            text TEXT,
+            file_id TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+        )
+        """
+    )
+    # Tutorials
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tutorials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            sort_order INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tutorial_media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tutorial_id INTEGER NOT NULL,
+            content_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            caption TEXT,
+            sort_order INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (tutorial_id) REFERENCES tutorials(id) ON DELETE CASCADE
+        )
+        """
+    )
+    # Admins table (additional admins besides primary ADMIN_ID)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY
+        )
+        """
+    )
+    # Background broadcasts and their per-recipient delivery log (for resume)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            mode TEXT NOT NULL DEFAULT 'copy',
+            audience TEXT NOT NULL DEFAULT 'all',
+            status TEXT NOT NULL DEFAULT 'running',
+            progress_message_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id),
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT NOT NULL)"
+    )
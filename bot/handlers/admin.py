@@ -1,10 +1,10 @@
 import asyncio
 import io
 import csv
+import os
 import sqlite3
 from datetime import datetime
 import base64
-import requests
 import json as _json
 from urllib.parse import urlsplit, quote as _urlquote
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
@@ -17,11 +17,14 @@ import re
 
 from ..config import ADMIN_ID, logger
 from ..db import query_db, execute_db
-from ..panel import VpnPanelAPI
+from .common import invalidate_menu_cache
+from ..settings import get_setting, get_settings, set_setting
+from ..panel import VpnPanelAPI, run_panel_io, invalidate_panel_client
 from ..utils import register_new_user
 from ..states import *
 from .renewal import process_renewal_for_order
-from ..helpers.tg import safe_edit_text as _safe_edit_text, safe_edit_caption as _safe_edit_caption
+from ..wallet import credit_wallet
+from ..helpers.tg import safe_edit_text as _safe_edit_text, safe_edit_caption as _safe_edit_caption, is_admin, reload_admin_ids
 
 # Normalize Persian/Arabic digits to ASCII
 _DIGIT_MAP = str.maketrans({
@@ -48,10 +51,7 @@ def _md_escape(text: str) -> str:
     )
 
 def _is_admin(user_id: int) -> bool:
-    if int(user_id) == int(ADMIN_ID):
-        return True
-    row = query_db("SELECT 1 FROM admins WHERE user_id = ?", (user_id,), one=True)
-    return bool(row)
+    return is_admin(user_id)
 
 
 async def admin_set_trial_inbound_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -64,8 +64,8 @@ async def admin_set_trial_inbound_start(update: Update, context: ContextTypes.DE
         "اینباندی را انتخاب کنید تا کانفیگ‌های تست روی همان اینباند ساخته شوند."
     )
     # Choose panel first: use selected free_trial_panel_id or ask user to pick if not set
-    sel = query_db("SELECT value FROM settings WHERE key='free_trial_panel_id'", one=True)
-    panel_id = int((sel.get('value') or 0)) if sel and str(sel.get('value') or '').isdigit() else None
+    sel = str(get_setting('free_trial_panel_id') or '')
+    panel_id = int(sel) if sel.isdigit() else None
     if not panel_id:
         await _safe_edit_text(query.message, "ابتدا از گزینه 'انتخاب پنل ساخت تست' یک پنل انتخاب کنید.")
         return SETTINGS_MENU
@@ -78,7 +78,7 @@ async def admin_set_trial_inbound_start(update: Update, context: ContextTypes.DE
         await _safe_edit_text(query.message, "این تنظیم فقط برای پنل‌های XUI/3xUI/Alireza/TX-UI است.")
         return SETTINGS_MENU
     api = VpnPanelAPI(panel_id=panel_id)
-    inbounds, msg_err = getattr(api, 'list_inbounds', lambda: (None,'NA'))()
+    inbounds, msg_err = await run_panel_io(getattr(api, 'list_inbounds', lambda: (None,'NA')))
     if not inbounds:
         await _safe_edit_text(query.message, f"لیست اینباندها دریافت نشد: {msg_err}")
         return SETTINGS_MENU
@@ -99,46 +99,10 @@ async def admin_set_trial_inbound_choose(update: Update, context: ContextTypes.D
         await query.answer("شناسه نامعتبر", show_alert=True)
         return SETTINGS_MENU
     # Persist setting
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('free_trial_inbound_id', ?)", (inbound_id,))
+    set_setting('free_trial_inbound_id', inbound_id)
     await query.answer("اینباند تست ذخیره شد", show_alert=True)
     return await admin_settings_manage(update, context)
 
-def _fetch_subscription_configs(sub_url: str, timeout_seconds: int = 15) -> list[str]:
-    """Fetch subscription content and return a list of config URIs.
-
-    Supports plain-text lists and base64-encoded payloads. Filters known URI schemes.
-    """
-    try:
-        headers = {
-            'Accept': 'text/plain, application/octet-stream, */*',
-            'User-Agent': 'Mozilla/5.0',
-        }
-        resp = requests.get(sub_url, headers=headers, timeout=timeout_seconds)
-        resp.raise_for_status()
-        raw_text = (resp.text or '').strip()
-        if any(proto in raw_text for proto in ("vmess://", "vless://", "trojan://", "ss://", "hy2://")):
-            text = raw_text
-        else:
-            # Try base64 decode when content does not directly contain URIs
-            b = raw_text.strip()
-            # Remove whitespace and fix padding
-            compact = "".join(b.split())
-            missing = len(compact) % 4
-            if missing:
-                compact += "=" * (4 - missing)
-            try:
-                decoded = base64.b64decode(compact, validate=False)
-                text = decoded.decode('utf-8', errors='ignore')
-            except Exception:
-                text = raw_text
-        lines = [ln.strip() for ln in (text or '').splitlines()]
-        configs = [ln for ln in lines if ln and ln.split(':', 1)[0] in ("vmess", "vless", "trojan", "ss", "hy2") and 
-                   (ln.startswith("vmess://") or ln.startswith("vless://") or ln.startswith("trojan://") or ln.startswith("ss://") or ln.startswith("hy2://"))]
-        return configs
-    except Exception as e:
-        logger.error(f"Failed to fetch/parse subscription from {sub_url}: {e}")
-        return []
-
 def _infer_origin_host(panel_row: dict) -> str:
     try:
         base = (panel_row.get('sub_base') or panel_row.get('url') or '').strip()
@@ -396,7 +360,7 @@ async def admin_approve_on_panel(update: Update, context: ContextTypes.DEFAULT_T
 
     if ptype in ('xui', 'x-ui', 'sanaei', 'alireza', '3xui', '3x-ui', 'txui', 'tx-ui', 'sui', 's-ui'):
         # Step 1: show inbound list to admin
-        inbounds, msg = api.list_inbounds() if hasattr(api, 'list_inbounds') else (None, 'Not supported')
+        inbounds, msg = await run_panel_io(api.list_inbounds) if hasattr(api, 'list_inbounds') else (None, 'Not supported')
         if not inbounds:
             safe = html_escape(str(msg))
             err_text = base_text + f"\n\n<b>خطای پنل:</b>\n<code>{safe}</code>"
@@ -422,8 +386,7 @@ async def admin_approve_on_panel(update: Update, context: ContextTypes.DEFAULT_T
             execute_db("UPDATE discount_codes SET times_used = times_used + 1 WHERE code = ?", (order['discount_code'],))
         # Apply referral bonus
         await _apply_referral_bonus(order_id, context)
-        cfg = query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True)
-        footer = (cfg.get('value') if cfg else '') or ''
+        footer = get_setting('config_footer_text') or ''
         # Always send ONLY subscription link for Marzban/Marzneshin
         final_message = (
             f"✅ سفارش شما تایید شد!\n\n"
@@ -487,7 +450,7 @@ async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT
             pass
         return
 
-    username, sub_link, msg = api.create_user_on_inbound(inbound_id, order['user_id'], plan)
+    username, sub_link, msg = await run_panel_io(api.create_user_on_inbound, inbound_id, order['user_id'], plan)
     if not sub_link or not username:
         safe = html_escape(str(msg))
         err_text = base_text + f"\n\n<b>خطای پنل:</b>\n<code>{safe}</code>"
@@ -507,7 +470,7 @@ async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT
     if order.get('discount_code'):
         execute_db("UPDATE discount_codes SET times_used = times_used + 1 WHERE code = ?", (order['discount_code'],))
 
-    inbound_detail = getattr(api, '_fetch_inbound_detail', lambda _id: None)(int(inbound_id))
+    inbound_detail = await run_panel_io(getattr(api, '_fetch_inbound_detail', lambda _id: None), int(inbound_id))
     built_confs = []
     if inbound_detail:
         try:
@@ -516,17 +479,17 @@ async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT
             built_confs = []
     # If none, try decoding subscription
     if not built_confs:
-        built_confs = _fetch_subscription_configs(sub_link)
+        built_confs = await fetch_subscription_configs(sub_link)
     # As an extra attempt (but still ensure single output), try API helper only if still empty
     api_confs = []
     if not built_confs and hasattr(api, 'get_configs_for_user_on_inbound'):
         try:
-            api_confs = api.get_configs_for_user_on_inbound(int(inbound_id), username) or []
+            api_confs = await run_panel_io(api.get_configs_for_user_on_inbound, int(inbound_id), username) or []
         except Exception:
             api_confs = []
     display_confs = built_confs or api_confs
 
-    footer = ((query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True) or {}).get('value') or '')
+    footer = (get_setting('config_footer_text') or '')
     ptype_lower = (panel_row.get('panel_type') or '').lower()
     if display_confs:
         preview = display_confs[:1]  # send only the first config
@@ -1132,7 +1095,7 @@ async def admin_plan_edit_save(update: Update, context: ContextTypes.DEFAULT_TYP
 async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     trial_status = settings.get('free_trial_status', '0')
     trial_button_text = "\u274C غیرفعال کردن تست" if trial_status == '1' else "\u2705 فعال کردن تست"
     trial_button_callback = "set_trial_status_0" if trial_status == '1' else "set_trial_status_1"
@@ -1196,7 +1159,7 @@ async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TY
 async def admin_toggle_trial_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     new_status = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_status'", (new_status,))
+    set_setting('free_trial_status', new_status)
     await query.answer(f"وضعیت تست رایگان {'فعال' if new_status == '1' else 'غیرفعال'} شد.", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -1205,7 +1168,7 @@ async def admin_toggle_trial_status(update: Update, context: ContextTypes.DEFAUL
 async def admin_reseller_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     enabled = settings.get('reseller_enabled', '1') == '1'
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     percent = int((settings.get('reseller_discount_percent') or '50') or 50)
@@ -1234,7 +1197,7 @@ async def admin_toggle_reseller(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     val = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('reseller_enabled', ?)", (val,))
+    set_setting('reseller_enabled', val)
     return await admin_reseller_menu(update, context)
 
 
@@ -1277,7 +1240,7 @@ async def admin_reseller_set_value_save(update: Update, context: ContextTypes.DE
         await update.message.reply_text("جلسه منقضی شده است.")
         return await admin_reseller_menu(update, context)
     val = _normalize_digits(update.message.text.strip())
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, val))
+    set_setting(key, val)
     context.user_data.pop('reseller_edit_key', None)
     await update.message.reply_text("ذخیره شد.")
     # Return to reseller menu
@@ -1344,7 +1307,7 @@ async def admin_reseller_approve(update: Update, context: ContextTypes.DEFAULT_T
         await query.answer("این درخواست قبلا بررسی شده است.", show_alert=True)
         return SETTINGS_MENU
     # Activate reseller for user
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     percent = int((settings.get('reseller_discount_percent') or '50') or 50)
     days = int((settings.get('reseller_duration_days') or '30') or 30)
     cap = int((settings.get('reseller_max_purchases') or '10') or 10)
@@ -1383,7 +1346,7 @@ async def admin_toggle_usd_mode(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'usd_irt_mode'", (target,))
+    set_setting('usd_irt_mode', target)
     return await admin_settings_manage(update, context)
 
 
@@ -1533,8 +1496,8 @@ async def admin_settings_ask(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def admin_settings_save_trial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         days, gb = update.message.text.split('-')
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_days'", (days.strip(),))
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_gb'", (gb.strip(),))
+        set_setting('free_trial_days', days.strip())
+        set_setting('free_trial_gb', gb.strip())
         await update.message.reply_text("\u2705 تنظیمات تست رایگان با موفقیت ذخیره شد.")
     except Exception:
         await update.message.reply_text("فرمت نامعتبر است. لطفا با فرمت `روز-حجم` وارد کنید.")
@@ -1552,6 +1515,7 @@ async def admin_settings_save_payment_text(update: Update, context: ContextTypes
         await update.message.reply_text("ورودی نامعتبر است. متن خالی ارسال نکنید.")
         return ConversationHandler.END
     execute_db("UPDATE messages SET text = ? WHERE message_name = ?", (new_text, 'payment_info_text'))
+    invalidate_menu_cache()
     context.user_data.pop('awaiting_admin', None)
     await update.message.reply_text("\u2705 متن پرداخت با موفقیت ذخیره شد.")
     # If invoked globally, refresh settings view
@@ -1788,6 +1752,7 @@ async def admin_panel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     panel_id = int(query.data.split('_')[-1])
     execute_db("DELETE FROM panels WHERE id=?", (panel_id,))
+    invalidate_panel_client(panel_id)
     await query.answer("پنل و اینباندهای مرتبط با آن حذف شدند.", show_alert=True)
     return await admin_panels_menu(update, context)
 
@@ -1915,13 +1880,13 @@ async def admin_panel_inbounds_menu(update: Update, context: ContextTypes.DEFAUL
             prow = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True)
             if prow and (prow.get('panel_type') or 'marzban').lower() in ('marzban', 'marzneshin'):
                 api = VpnPanelAPI(panel_id=panel_id)
-                found, msg = getattr(api, 'list_inbounds', lambda: (None, 'NA'))()
+                found, msg = await run_panel_io(getattr(api, 'list_inbounds', lambda: (None, 'NA')))
                 # Fallback: try Marzneshin API style if Marzban paths returned 404/empty
                 if not found:
                     try:
                         from ..panel import MarzneshinAPI as _MZ
                         alt = _MZ(prow)
-                        found, msg = alt.list_inbounds()
+                        found, msg = await run_panel_io(alt.list_inbounds)
                         logger.info(f"Auto-discover fallback (apiv2) used for panel {panel_id}: {bool(found)}")
                     except Exception as _e:
                         logger.error(f"Auto-discover apiv2 fallback failed: {_e}")
@@ -1989,7 +1954,7 @@ async def admin_panel_inbounds_refresh(update: Update, context: ContextTypes.DEF
     # Try to fetch inbounds
     try:
         api = VpnPanelAPI(panel_id=panel_id)
-        found, msg = getattr(api, 'list_inbounds', lambda: (None, 'NA'))()
+        found, msg = await run_panel_io(getattr(api, 'list_inbounds', lambda: (None, 'NA')))
         if not found:
             try:
                 await query.answer(f"ناموفق: {msg}", show_alert=True)
@@ -2116,6 +2081,7 @@ async def msg_add_receive_content(update: Update, context: ContextTypes.DEFAULT_
         "INSERT INTO messages (message_name, text, file_id, file_type) VALUES (?, ?, ?, ?)",
         (message_name, text, file_id, file_type),
     )
+    invalidate_menu_cache()
     await update.message.reply_text(f"\u2705 پیام جدید با نام `{message_name}` ساخته شد.")
     context.user_data.clear()
     return await send_admin_panel(update, context)
@@ -2156,6 +2122,7 @@ async def admin_messages_edit_text_save(update: Update, context: ContextTypes.DE
     message_name = context.user_data['editing_message_name']
     new_text = update.message.text
     execute_db("UPDATE messages SET text = ? WHERE message_name = ?", (new_text, message_name))
+    invalidate_menu_cache()
     await update.message.reply_text("\u2705 متن با موفقیت بروزرسانی شد.")
     context.user_data.clear()
     return await send_admin_panel(update, context)
@@ -2185,6 +2152,7 @@ async def admin_button_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     button_id = int(query.data.replace("btn_delete_", ""))
     execute_db("DELETE FROM buttons WHERE id = ?", (button_id,))
+    invalidate_menu_cache()
     await query.answer("دکمه حذف شد.", show_alert=True)
     return await admin_buttons_menu(update, context)
 
@@ -2242,6 +2210,7 @@ async def admin_button_add_save(update: Update, context: ContextTypes.DEFAULT_TY
         "INSERT INTO buttons (menu_name, text, target, is_url, row, col) VALUES (?, ?, ?, ?, ?, ?)",
         (b['menu_name'], b['text'], b['target'], b['is_url'], b['row'], b['col']),
     )
+    invalidate_menu_cache()
     await update.message.reply_text("\u2705 دکمه با موفقیت اضافه شد.")
     return await admin_buttons_menu(update, context)
 
@@ -2402,171 +2371,28 @@ async def admin_generate_backup(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.edit_text("خطا: پنلی برای بکاپ‌گیری یافت نشد.")
         return await send_admin_panel(update, context)
 
-    import io as _io
-    import json as _json
-    import zipfile as _zipfile
-    from ..config import DB_NAME
-
-    zip_buffer = _io.BytesIO()
-    total_users_count = 0
-    with _zipfile.ZipFile(zip_buffer, mode='w', compression=_zipfile.ZIP_DEFLATED) as zf:
-        # Include bot database
-        try:
-            with open(DB_NAME, 'rb') as fdb:
-                zf.writestr('bot_db.sqlite', fdb.read())
-        except Exception as e:
-            logger.error(f"Could not include bot DB in backup: {e}")
-        # Add per-panel snapshots
-        for panel_id in panel_ids:
-            try:
-                panel_row = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True) or {}
-                base_dir = f"panel_{panel_id}"
-                # Panel info (mask password minimally)
-                safe_info = dict(panel_row)
-                if safe_info.get('password'):
-                    safe_info['password'] = '***'
-                zf.writestr(f"{base_dir}/panel_info.json", _json.dumps(safe_info, ensure_ascii=False, indent=2))
-
-                # Inbounds from our DB
-                inbounds = query_db("SELECT id, protocol, tag FROM panel_inbounds WHERE panel_id = ? ORDER BY id", (panel_id,)) or []
-                zf.writestr(f"{base_dir}/panel_inbounds.json", _json.dumps(inbounds, ensure_ascii=False, indent=2))
-
-                # Clients/users snapshot via panel API when possible
-                api = VpnPanelAPI(panel_id=panel_id)
-                users_payload = []
-                # Marzban supports get_all_users
-                try:
-                    users, msg = await api.get_all_users()
-                except Exception as e:
-                    users, msg = None, str(e)
-                if users:
-                    users_payload = users
-                    total_users_count += len(users)
-                else:
-                    # Try to enumerate clients from inbounds for X-UI-like panels
-                    list_inb = None
-                    try:
-                        list_inb, _ = api.list_inbounds()
-                    except Exception:
-                        list_inb = None
-                    if list_inb:
-                        for ib in list_inb:
-                            inbound_id = ib.get('id')
-                            fetch = getattr(api, '_fetch_inbound_detail', None)
-                            detail = None
-                            if callable(fetch):
-                                try:
-                                    detail = fetch(inbound_id)
-                                except Exception:
-                                    detail = None
-                            if not detail:
-                                continue
-                            settings_str = detail.get('settings')
-                            try:
-                                settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else {}
-                            except Exception:
-                                settings_obj = {}
-                            clients = settings_obj.get('clients') or []
-                            if isinstance(clients, list):
-                                for c in clients:
-                                    users_payload.append({
-                                        'email': c.get('email'),
-                                        'totalGB': c.get('totalGB'),
-                                        'expiryTime': c.get('expiryTime'),
-                                        'enable': c.get('enable'),
-                                        'subId': c.get('subId'),
-                                        'inbound_id': inbound_id,
-                                    })
-                        total_users_count += len(users_payload)
-                zf.writestr(f"{base_dir}/clients_or_users.json", _json.dumps(users_payload, ensure_ascii=False, indent=2))
-            except Exception as e:
-                logger.error(f"Error adding panel {panel_id} to backup ZIP: {e}")
-
-        # Bot-wide snapshots: members, services, wallets, plans, panels, stats, admins
-        try:
-            users_tbl = query_db("SELECT user_id, first_name, join_date, referrer_id FROM users ORDER BY user_id") or []
-            zf.writestr("users.json", _json.dumps(users_tbl, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add users.json: {e}")
-
-        try:
-            orders_tbl = query_db(
-                "SELECT id, user_id, plan_id, status, marzban_username, timestamp, final_price, panel_id, panel_type, last_link, is_trial FROM orders ORDER BY id"
-            ) or []
-            zf.writestr("services.json", _json.dumps(orders_tbl, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add services.json: {e}")
-
-        try:
-            wallets_tbl = query_db("SELECT user_id, balance FROM user_wallets ORDER BY user_id") or []
-            zf.writestr("wallet_balances.json", _json.dumps(wallets_tbl, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add wallet_balances.json: {e}")
+    from ..backup import generate_backup
 
-        try:
-            plans_tbl = query_db("SELECT id, name, description, price, duration_days, traffic_gb FROM plans ORDER BY id") or []
-            zf.writestr("plans.json", _json.dumps(plans_tbl, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add plans.json: {e}")
-
-        try:
-            panels_tbl = query_db("SELECT id, name, panel_type, url, sub_base FROM panels ORDER BY id") or []
-            zf.writestr("panels.json", _json.dumps(panels_tbl, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add panels.json: {e}")
-
-        try:
-            total_users = (query_db("SELECT COUNT(*) AS c FROM users", one=True) or {}).get('c', 0)
-            buyers = (query_db("SELECT COUNT(DISTINCT user_id) AS c FROM orders WHERE status='approved'", one=True) or {}).get('c', 0)
-            daily_rev = (query_db(
-                """
-                SELECT COALESCE(SUM(CASE WHEN o.final_price IS NOT NULL THEN o.final_price ELSE p.price END),0) AS rev
-                FROM orders o
-                JOIN plans p ON p.id = o.plan_id
-                WHERE o.status='approved' AND date(o.timestamp) = date('now','localtime')
-                """,
-                one=True,
-            ) or {}).get('rev', 0)
-            monthly_rev = (query_db(
-                """
-                SELECT COALESCE(SUM(CASE WHEN o.final_price IS NOT NULL THEN o.final_price ELSE p.price END),0) AS rev
-                FROM orders o
-                JOIN plans p ON p.id = o.plan_id
-                WHERE o.status='approved' AND strftime('%Y-%m', o.timestamp) = strftime('%Y-%m', 'now','localtime')
-                """,
-                one=True,
-            ) or {}).get('rev', 0)
-            total_orders = (query_db("SELECT COUNT(*) AS c FROM orders", one=True) or {}).get('c', 0)
-            approved_orders = (query_db("SELECT COUNT(*) AS c FROM orders WHERE status='approved'", one=True) or {}).get('c', 0)
-            stats_obj = {
-                'total_users': int(total_users or 0),
-                'buyers': int(buyers or 0),
-                'daily_revenue_toman': int(daily_rev or 0),
-                'monthly_revenue_toman': int(monthly_rev or 0),
-                'total_orders': int(total_orders or 0),
-                'approved_orders': int(approved_orders or 0),
-            }
-            zf.writestr("stats.json", _json.dumps(stats_obj, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add stats.json: {e}")
-
-        try:
-            add_admins = [row['user_id'] for row in (query_db("SELECT user_id FROM admins ORDER BY user_id") or [])]
-            admins_obj = {
-                'primary_admin_id': ADMIN_ID,
-                'additional_admin_ids': add_admins,
-            }
-            zf.writestr("admins.json", _json.dumps(admins_obj, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"Could not add admins.json: {e}")
-
-    zip_buffer.seek(0)
+    try:
+        zip_path, total_users_count = await generate_backup(panel_ids)
+    except Exception as e:
+        logger.error(f"Backup generation failed: {e}")
+        await query.message.edit_text("خطا در تهیه فایل بکاپ.")
+        return await send_admin_panel(update, context)
     filename = f"panel_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-    file_to_send = InputFile(zip_buffer, filename=filename)
+    caption = f"✅ فایل بکاپ آماده شد. مجموع کاربران: {total_users_count}"
     try:
-        await context.bot.send_document(chat_id=query.message.chat_id, document=file_to_send, caption=f"✅ فایل بکاپ آماده شد. مجموع کاربران: {total_users_count}")
-    except TelegramError:
-        await context.bot.send_document(chat_id=ADMIN_ID, document=file_to_send, caption=f"✅ فایل بکاپ آماده شد. مجموع کاربران: {total_users_count}")
+        try:
+            with open(zip_path, 'rb') as f:
+                await context.bot.send_document(chat_id=query.message.chat_id, document=InputFile(f, filename=filename), caption=caption)
+        except TelegramError:
+            with open(zip_path, 'rb') as f:
+                await context.bot.send_document(chat_id=ADMIN_ID, document=InputFile(f, filename=filename), caption=caption)
+    finally:
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
     try:
         await query.message.delete()
     except Exception:
@@ -2603,13 +2429,13 @@ async def admin_set_usd_rate_save(update: Update, context: ContextTypes.DEFAULT_
         else:
             val = update.message.text.strip()
         if val == '-' or val == '' or val.lower() == 'clear':
-            execute_db("UPDATE settings SET value = NULL WHERE key = 'usd_irt_manual'", ())
+            set_setting('usd_irt_manual', None)
             await update.message.reply_text("نرخ دلار پاک شد؛ از نرخ API استفاده خواهد شد.")
         else:
             rate = int(float(val))
             if rate <= 0:
                 raise ValueError()
-            execute_db("UPDATE settings SET value = ? WHERE key = 'usd_irt_manual'", (str(rate),))
+            set_setting('usd_irt_manual', str(rate))
             await update.message.reply_text("نرخ دلار ذخیره شد.")
     except Exception:
         await update.message.reply_text("ورودی نامعتبر است. یک عدد صحیح تومان وارد کنید یا '-' برای پاک کردن.")
@@ -2633,7 +2459,8 @@ async def admin_set_usd_rate_save(update: Update, context: ContextTypes.DEFAULT_
 
 async def admin_clear_usd_cache(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    execute_db("UPDATE settings SET value = '' WHERE key IN ('usd_irt_cached','usd_irt_cached_ts')")
+    set_setting('usd_irt_cached', '')
+    set_setting('usd_irt_cached_ts', '')
     await query.answer("کش دلار پاک شد.", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -2641,35 +2468,35 @@ async def admin_clear_usd_cache(update: Update, context: ContextTypes.DEFAULT_TY
 async def admin_toggle_pay_card(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'pay_card_enabled'", (val,))
+    set_setting('pay_card_enabled', val)
     return await admin_settings_manage(update, context)
 
 
 async def admin_toggle_pay_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'pay_crypto_enabled'", (val,))
+    set_setting('pay_crypto_enabled', val)
     return await admin_settings_manage(update, context)
 
 
 async def admin_toggle_pay_gateway(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'pay_gateway_enabled'", (val,))
+    set_setting('pay_gateway_enabled', val)
     return await admin_settings_manage(update, context)
 
 
 async def admin_toggle_gateway_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     t = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'gateway_type'", (t,))
+    set_setting('gateway_type', t)
     return await admin_settings_manage(update, context)
 
 
 async def admin_set_gateway_api_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     context.user_data['gateway_setup'] = {'step': 1, 'type': gateway_type}
     if gateway_type == 'zarinpal':
@@ -2690,7 +2517,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
             if len(txt) < 5:
                 await update.message.reply_text("MerchantID نامعتبر است. دوباره وارد کنید:")
                 return SETTINGS_AWAIT_GATEWAY_API
-            execute_db("UPDATE settings SET value = ? WHERE key = 'zarinpal_merchant_id'", (txt,))
+            set_setting('zarinpal_merchant_id', txt)
             context.user_data['gateway_setup']['step'] = 2
             await update.message.reply_text("مرحله 2/2: Callback URL را وارد کنید (مثال: https://site.com/pay/callback):")
             return SETTINGS_AWAIT_GATEWAY_API
@@ -2698,7 +2525,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
             if not (txt.startswith('http://') or txt.startswith('https://')):
                 await update.message.reply_text("Callback URL نامعتبر است. با http(s) شروع شود:")
                 return SETTINGS_AWAIT_GATEWAY_API
-            execute_db("UPDATE settings SET value = ? WHERE key = 'gateway_callback_url'", (txt,))
+            set_setting('gateway_callback_url', txt)
             await update.message.reply_text("اطلاعات زرین‌پال ذخیره شد.")
             context.user_data.pop('gateway_setup', None)
             return await admin_settings_manage(update, context)
@@ -2707,7 +2534,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
             if len(txt) < 4:
                 await update.message.reply_text("PIN نامعتبر است. دوباره وارد کنید:")
                 return SETTINGS_AWAIT_GATEWAY_API
-            execute_db("UPDATE settings SET value = ? WHERE key = 'aghapay_pin'", (txt,))
+            set_setting('aghapay_pin', txt)
             context.user_data['gateway_setup']['step'] = 2
             await update.message.reply_text("مرحله 2/2: Callback URL را وارد کنید (اختیاری، برای رد این مرحله '-' بزنید):")
             return SETTINGS_AWAIT_GATEWAY_API
@@ -2716,7 +2543,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
                 if not (txt.startswith('http://') or txt.startswith('https://')):
                     await update.message.reply_text("Callback URL نامعتبر است. با http(s) شروع شود یا '-' برای رد:")
                     return SETTINGS_AWAIT_GATEWAY_API
-                execute_db("UPDATE settings SET value = ? WHERE key = 'gateway_callback_url'", (txt,))
+                set_setting('gateway_callback_url', txt)
             await update.message.reply_text("اطلاعات آقای پرداخت ذخیره شد.")
             context.user_data.pop('gateway_setup', None)
             return await admin_settings_manage(update, context)
@@ -2788,8 +2615,10 @@ async def admin_wallet_tx_view(update: Update, context: ContextTypes.DEFAULT_TYP
 
 def _wallet_apply_balance(user_id: int, amount: int, direction: str):
     delta = amount if direction == 'credit' else -amount
-    execute_db("INSERT OR IGNORE INTO user_wallets (user_id, balance) VALUES (?, 0)", (user_id,))
-    execute_db("UPDATE user_wallets SET balance = balance + ? WHERE user_id = ?", (delta, user_id))
+    execute_db(
+        "INSERT INTO user_wallets (user_id, balance) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance",
+        (user_id, delta),
+    )
 
 
 async def admin_wallet_tx_approve(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -3265,7 +3094,7 @@ async def admin_tutorial_view(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def admin_toggle_signup_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'signup_bonus_enabled'", (val,))
+    set_setting('signup_bonus_enabled', val)
     await query.answer("ذخیره شد.", show_alert=False)
     return await admin_settings_manage(update, context)
 
@@ -3286,7 +3115,7 @@ async def admin_set_signup_bonus_amount_save(update: Update, context: ContextTyp
     except Exception:
         await update.message.reply_text("مبلغ نامعتبر است. یک عدد صحیح وارد کنید:")
         return SETTINGS_AWAIT_SIGNUP_BONUS
-    execute_db("UPDATE settings SET value = ? WHERE key = 'signup_bonus_amount'", (str(amount),))
+    set_setting('signup_bonus_amount', str(amount))
     await update.message.reply_text("ذخیره شد.")
     fake_query = type('obj', (object,), {
         'data': 'admin_settings_manage',
@@ -3319,7 +3148,7 @@ async def _apply_referral_bonus(order_id: int, context: ContextTypes.DEFAULT_TYP
             base_price = 0
         if base_price <= 0:
             return
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = get_settings()
         pct = 10
         try:
             pct = int((settings.get('referral_commission_percent') or '10').strip())
@@ -3328,12 +3157,7 @@ async def _apply_referral_bonus(order_id: int, context: ContextTypes.DEFAULT_TYP
         pct = max(0, min(100, pct))
         bonus = max(1, int(base_price * (pct / 100.0)))
         # ensure wallet row and credit
-        execute_db("INSERT OR IGNORE INTO user_wallets (user_id, balance) VALUES (?, 0)", (ref_id,))
-        execute_db("UPDATE user_wallets SET balance = COALESCE(balance,0) + ? WHERE user_id = ?", (bonus, ref_id))
-        execute_db(
-            "INSERT INTO wallet_transactions (user_id, amount, direction, method, status, created_at, reference, meta) VALUES (?, ?, 'credit', 'referral', 'approved', ?, ?, ?)",
-            (ref_id, bonus, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), f"ref_bonus_order_{order_id}", None)
-        )
+        await credit_wallet(ref_id, bonus, 'referral', f"ref_bonus_order_{order_id}")
         # notify referrer
         try:
             await context.bot.send_message(chat_id=ref_id, text=f"\U0001F389 پاداش معرفی: `{bonus:,}` تومان")
@@ -3393,6 +3217,7 @@ async def admin_add_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         try:
             uid = int(parts[1])
             execute_db("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (uid,))
+            reload_admin_ids()
             await update.message.reply_text(f"✅ کاربر `{uid}` به عنوان ادمین اضافه شد.", parse_mode=ParseMode.MARKDOWN)
             return
         except Exception as e:
@@ -3410,6 +3235,7 @@ async def admin_del_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         try:
             uid = int(parts[1])
             execute_db("DELETE FROM admins WHERE user_id = ?", (uid,))
+            reload_admin_ids()
             await update.message.reply_text(f"✅ کاربر `{uid}` از لیست ادمین‌ها حذف شد.", parse_mode=ParseMode.MARKDOWN)
             return
         except Exception as e:
@@ -3424,7 +3250,7 @@ async def admin_setms_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     txt = (update.message.text or '').strip()
     arg = txt[len('/setms'):].strip() if txt.startswith('/setms') else ''
     if arg:
-        execute_db("UPDATE settings SET value = ? WHERE key = 'config_footer_text'", (arg,))
+        set_setting('config_footer_text', arg)
         await update.message.reply_text("✅ متن زیر کانفیگ بروزرسانی شد.")
         return
     context.user_data['awaiting_admin'] = 'set_config_footer'
@@ -3467,7 +3293,7 @@ async def admin_set_config_footer_save(update: Update, context: ContextTypes.DEF
     if context.user_data.get('awaiting_admin') != 'set_config_footer':
         return ConversationHandler.END
     new_text = (update.message.text or '').strip()
-    execute_db("UPDATE settings SET value = ? WHERE key = 'config_footer_text'", (new_text,))
+    set_setting('config_footer_text', new_text)
     context.user_data.pop('awaiting_admin', None)
     await update.message.reply_text("✅ متن زیر کانفیگ ذخیره شد.")
     # Refresh settings view
@@ -3501,7 +3327,7 @@ async def admin_set_ref_percent_save(update: Update, context: ContextTypes.DEFAU
         percent = int(float(txt))
         if percent < 0 or percent > 100:
             raise ValueError()
-        execute_db("UPDATE settings SET value = ? WHERE key = 'referral_commission_percent'", (str(percent),))
+        set_setting('referral_commission_percent', str(percent))
         await update.message.reply_text("✅ درصد کمیسیون ذخیره شد.")
         context.user_data.pop('awaiting_admin', None)
     except Exception:
@@ -3536,6 +3362,6 @@ async def admin_set_trial_panel_choose(update: Update, context: ContextTypes.DEF
     await query.answer()
     panel_id = query.data.split('_')[-1]
     value = '' if panel_id == '0' else panel_id
-    execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_panel_id'", (value,))
+    set_setting('free_trial_panel_id', value)
     await query.answer("ذخیره شد", show_alert=True)
     return await admin_settings_manage(update, context)
\ No newline at end of file
@@ -3,6 +3,8 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
 from ..db import query_db, execute_db
+from .common import invalidate_menu_cache
+from ..settings import get_setting
 from ..states import (
     ADMIN_MESSAGES_MENU,
     ADMIN_MESSAGES_SELECT,
@@ -126,6 +128,7 @@ async def msg_add_receive_content(update: Update, context: ContextTypes.DEFAULT_
         "INSERT INTO messages (message_name, text, file_id, file_type) VALUES (?, ?, ?, ?)",
         (message_name, text, file_id, file_type),
     )
+    invalidate_menu_cache()
     context.user_data.pop('new_message_name', None)
     # Return to paginated list
     fake_query = type('obj', (object,), {'data': f"admin_messages_menu_page_{context.user_data.get('msg_page', 0)}", 'message': update.message, 'answer': (lambda *args, **kwargs: None)})
@@ -164,6 +167,7 @@ async def admin_messages_edit_text_save(update: Update, context: ContextTypes.DE
         await update.message.reply_text("ابتدا یک پیام را انتخاب کنید.")
         return ADMIN_MESSAGES_MENU
     execute_db("UPDATE messages SET text = ? WHERE message_name = ?", (update.message.text, message_name))
+    invalidate_menu_cache()
     await update.message.reply_text("✅ متن پیام بروزرسانی شد.")
     # Back to select view
     fake_query = type('obj', (object,), {'data': f"msg_select_{message_name}", 'message': update.message, 'answer': (lambda *args, **kwargs: None)})
@@ -178,6 +182,7 @@ async def admin_messages_delete(update: Update, context: ContextTypes.DEFAULT_TY
     if not message_name:
         return await admin_messages_menu(update, context)
     execute_db("DELETE FROM messages WHERE message_name = ?", (message_name,))
+    invalidate_menu_cache()
     await _safe_edit_text(query.message, "✅ پیام حذف شد.")
     # Go back to list
     return await admin_messages_menu(update, context)
@@ -195,8 +200,7 @@ async def admin_buttons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         # Desired layout: row1: [buy_config_main, get_free_config]; row2: [my_services, ...]
         buy_info = next(({'row': r['row'], 'col': r['col']} for r in existing_rows if r['target'] == 'buy_config_main'), None)
-        trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-        trial_enabled = bool(trial_status and (trial_status.get('value') == '1'))
+        trial_enabled = get_setting('free_trial_status') == '1'
 
         # Ensure buy button
         if 'buy_config_main' not in existing_targets:
@@ -204,6 +208,7 @@ async def admin_buttons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 "INSERT INTO buttons (menu_name, text, target, is_url, row, col) VALUES (?, ?, ?, ?, ?, ?)",
                 (message_name, "\U0001F4E1 خرید کانفیگ", 'buy_config_main', 0, 1, 1),
             )
+            invalidate_menu_cache()
             buy_info = {'row': 1, 'col': 1}
         elif not buy_info:
             buy_info = {'row': 1, 'col': 1}
@@ -217,8 +222,10 @@ async def admin_buttons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     "INSERT INTO buttons (menu_name, text, target, is_url, row, col) VALUES (?, ?, ?, ?, ?, ?)",
                     (message_name, "\U0001F381 دریافت تست", 'get_free_config', 0, int(buy_info['row']), desired_col),
                 )
+                invalidate_menu_cache()
             elif not (gf_row and int(gf_row['row']) == int(buy_info['row']) and int(gf_row['col']) == desired_col):
                 execute_db("UPDATE buttons SET row = ?, col = ? WHERE menu_name = ? AND target = ?", (int(buy_info['row']), desired_col, message_name, 'get_free_config'))
+                invalidate_menu_cache()
 
         # Ensure my_services under them (row+1). Add or reposition to first available col in that row.
         ms_row = next(({'row': r['row'], 'col': r['col']} for r in existing_rows if r['target'] == 'my_services'), None)
@@ -231,8 +238,10 @@ async def admin_buttons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 "INSERT INTO buttons (menu_name, text, target, is_url, row, col) VALUES (?, ?, ?, ?, ?, ?)",
                 (message_name, "\U0001F4DD سرویس‌های من", 'my_services', 0, target_row, desired_ms_col),
             )
+            invalidate_menu_cache()
         elif not (ms_row and int(ms_row['row']) == target_row and int(ms_row['col']) in (1, 2)):
             execute_db("UPDATE buttons SET row = ?, col = ? WHERE menu_name = ? AND target = ?", (target_row, desired_ms_col, message_name, 'my_services'))
+            invalidate_menu_cache()
 
         # Add other core buttons if missing (append in subsequent columns/rows)
         core_extras = [
@@ -253,6 +262,7 @@ async def admin_buttons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 "INSERT INTO buttons (menu_name, text, target, is_url, row, col) VALUES (?, ?, ?, ?, ?, ?)",
                 (message_name, text, target, 0, next_row, col_cursor),
             )
+            invalidate_menu_cache()
             col_cursor = 2 if col_cursor == 1 else 1
 
     rows = query_db("SELECT id, text, row, col FROM buttons WHERE menu_name = ? ORDER BY row, col", (message_name,))
@@ -274,6 +284,7 @@ async def admin_button_delete(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     button_id = int(query.data.replace("btn_delete_", ""))
     execute_db("DELETE FROM buttons WHERE id = ?", (button_id,))
+    invalidate_menu_cache()
     await query.answer("حذف شد", show_alert=True)
     return await admin_buttons_menu(update, context)
 
@@ -345,6 +356,7 @@ async def admin_button_edit_set_is_url(update: Update, context: ContextTypes.DEF
         button_id = int(bid)
         is_url_val = int(val)
         execute_db("UPDATE buttons SET is_url = ? WHERE id = ?", (is_url_val, button_id))
+        invalidate_menu_cache()
         await query.answer("نوع دکمه بروزرسانی شد.", show_alert=True)
     except Exception:
         await query.answer("خطا در بروزرسانی نوع دکمه.", show_alert=True)
@@ -363,6 +375,7 @@ async def admin_button_add_receive_text(update: Update, context: ContextTypes.DE
     if context.user_data.get('editing_button_id') and context.user_data.get('editing_button_field') == 'text':
         btn_id = context.user_data['editing_button_id']
         execute_db("UPDATE buttons SET text = ? WHERE id = ?", (update.message.text, btn_id))
+        invalidate_menu_cache()
         await update.message.reply_text("✅ متن دکمه بروزرسانی شد.")
         context.user_data.pop('editing_button_id', None)
         context.user_data.pop('editing_button_field', None)
@@ -378,6 +391,7 @@ async def admin_button_add_receive_target(update: Update, context: ContextTypes.
     if context.user_data.get('editing_button_id') and context.user_data.get('editing_button_field') == 'target':
         btn_id = context.user_data['editing_button_id']
         execute_db("UPDATE buttons SET target = ? WHERE id = ?", (update.message.text, btn_id))
+        invalidate_menu_cache()
         await update.message.reply_text("✅ هدف دکمه بروزرسانی شد.")
         context.user_data.pop('editing_button_id', None)
         context.user_data.pop('editing_button_field', None)
@@ -405,6 +419,7 @@ async def admin_button_add_receive_row(update: Update, context: ContextTypes.DEF
             new_row = int(update.message.text)
             btn_id = context.user_data['editing_button_id']
             execute_db("UPDATE buttons SET row = ? WHERE id = ?", (new_row, btn_id))
+            invalidate_menu_cache()
             await update.message.reply_text("✅ سطر دکمه بروزرسانی شد.")
             context.user_data.pop('editing_button_id', None)
             context.user_data.pop('editing_button_field', None)
@@ -429,6 +444,7 @@ async def admin_button_add_save(update: Update, context: ContextTypes.DEFAULT_TY
             new_col = int(update.message.text)
             btn_id = context.user_data['editing_button_id']
             execute_db("UPDATE buttons SET col = ? WHERE id = ?", (new_col, btn_id))
+            invalidate_menu_cache()
             await update.message.reply_text("✅ ستون دکمه بروزرسانی شد.")
             context.user_data.pop('editing_button_id', None)
             context.user_data.pop('editing_button_field', None)
@@ -441,6 +457,7 @@ async def admin_button_add_save(update: Update, context: ContextTypes.DEFAULT_TY
         context.user_data['new_button']['col'] = int(update.message.text)
         b = context.user_data['new_button']
         execute_db("INSERT INTO buttons (menu_name, text, target, is_url, row, col) VALUES (?, ?, ?, ?, ?, ?)", (b['menu_name'], b['text'], b['target'], int(b.get('is_url') or 0), b['row'], b['col']))
+        invalidate_menu_cache()
         await update.message.reply_text("✅ دکمه اضافه شد.")
     except Exception:
         await update.message.reply_text("مقدار نامعتبر است. دوباره وارد کنید:")
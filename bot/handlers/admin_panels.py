@@ -4,6 +4,7 @@ from telegram.constants import ParseMode
 import re
 
 from ..db import query_db, execute_db
+from ..panel import invalidate_panel_client
 from ..states import (
     ADMIN_PANELS_MENU,
     ADMIN_PANEL_AWAIT_NAME,
@@ -59,6 +60,7 @@ async def admin_panel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     panel_id = int(query.data.split('_')[-1])
     execute_db("DELETE FROM panels WHERE id=?", (panel_id,))
+    invalidate_panel_client(panel_id)
     await query.answer("پنل و اینباندهای مرتبط با آن حذف شدند.", show_alert=True)
     return await admin_panels_menu(update, context)
 
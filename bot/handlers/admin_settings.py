@@ -3,6 +3,8 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, ConversationHandler
 
 from ..db import query_db, execute_db
+from .common import invalidate_menu_cache
+from ..settings import get_settings, set_setting
 from ..states import SETTINGS_MENU, SETTINGS_AWAIT_TRIAL_DAYS, SETTINGS_AWAIT_PAYMENT_TEXT, SETTINGS_AWAIT_USD_RATE, SETTINGS_AWAIT_GATEWAY_API, SETTINGS_AWAIT_SIGNUP_BONUS
 from ..helpers.tg import safe_edit_text as _safe_edit_text
 from ..config import ADMIN_ID, logger
@@ -26,7 +28,7 @@ def _md_escape(text: str) -> str:
 async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     trial_status = settings.get('free_trial_status', '0')
     trial_button_text = "\u274C غیرفعال کردن تست" if trial_status == '1' else "\u2705 فعال کردن تست"
     trial_button_callback = "set_trial_status_0" if trial_status == '1' else "set_trial_status_1"
@@ -86,7 +88,7 @@ async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TY
 async def admin_toggle_trial_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     new_status = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_status'", (new_status,))
+    set_setting('free_trial_status', new_status)
     await query.answer(f"وضعیت تست رایگان {'فعال' if new_status == '1' else 'غیرفعال'} شد.", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -95,7 +97,7 @@ async def admin_toggle_usd_mode(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'usd_irt_mode'", (target,))
+    set_setting('usd_irt_mode', target)
     return await admin_settings_manage(update, context)
 
 
@@ -117,8 +119,8 @@ async def admin_settings_ask(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def admin_settings_save_trial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         days, gb = update.message.text.split('-')
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_days'", (days.strip(),))
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_gb'", (gb.strip(),))
+        set_setting('free_trial_days', days.strip())
+        set_setting('free_trial_gb', gb.strip())
         await update.message.reply_text("\u2705 تنظیمات تست رایگان با موفقیت ذخیره شد.")
     except Exception:
         await update.message.reply_text("فرمت نامعتبر است. لطفا با فرمت `روز-حجم` وارد کنید.")
@@ -135,6 +137,7 @@ async def admin_settings_save_payment_text(update: Update, context: ContextTypes
         await update.message.reply_text("ورودی نامعتبر است. متن خالی ارسال نکنید.")
         return ConversationHandler.END
     execute_db("UPDATE messages SET text = ? WHERE message_name = ?", (new_text, 'payment_info_text'))
+    invalidate_menu_cache()
     context.user_data.pop('awaiting_admin', None)
     await update.message.reply_text("\u2705 متن پرداخت با موفقیت ذخیره شد.")
     fake_query = type('obj', (object,), {
@@ -1,11 +1,17 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
-from ..db import query_db, execute_db
-from ..helpers.tg import safe_edit_text as _safe_edit_text
+from ..broadcast import start_broadcast, cancel_broadcast
+from ..config import logger
+from ..db import adb
+from ..helpers.tg import safe_edit_text as _safe_edit_text, get_all_admin_ids
 from ..states import BROADCAST_SELECT_AUDIENCE, BROADCAST_SELECT_MODE, BROADCAST_AWAIT_MESSAGE, ADMIN_MAIN_MENU
 from ..states import ADMIN_STATS_MENU
+from ..stats import read_stats, PAYMENT_METHOD_LABELS
+
+
+# Rows shown per breakdown on the stats screen
+_BREAKDOWN_TOP = 5
 
 
 async def admin_broadcast_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -44,63 +50,69 @@ async def admin_broadcast_execute(update: Update, context: ContextTypes.DEFAULT_
     if not audience:
         await update.message.reply_text("ابتدا مخاطب ارسال را انتخاب کنید.")
         return ADMIN_MAIN_MENU
-    users = []
-    if audience == 'buyers':
-        users = query_db("SELECT DISTINCT user_id FROM orders WHERE status='approved'")
-    else:
-        users = query_db("SELECT user_id FROM users")
-    sent = 0
-    for u in users or []:
-        uid = u['user_id']
-        try:
-            if mode == 'forward':
-                await context.bot.forward_message(chat_id=uid, from_chat_id=update.message.chat_id, message_id=update.message.message_id)
-            else:
-                await context.bot.copy_message(chat_id=uid, from_chat_id=update.message.chat_id, message_id=update.message.message_id)
-            sent += 1
-        except Exception:
-            pass
-    await update.message.reply_text(f"✅ ارسال انجام شد. ({sent} نفر)")
+    # Sending runs in the background; progress is shown in a message that is edited live
+    try:
+        await start_broadcast(
+            context.application,
+            admin_chat_id=update.effective_chat.id,
+            from_chat_id=update.message.chat_id,
+            message_id=update.message.message_id,
+            mode=mode,
+            audience=audience,
+        )
+    except Exception as e:
+        logger.error(f"Failed to start broadcast: {e}")
+        await update.message.reply_text("خطا در شروع ارسال همگانی.")
     context.user_data.pop('broadcast_audience', None)
     return ADMIN_MAIN_MENU
 
 
+async def admin_broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if query.from_user.id not in get_all_admin_ids():
+        await query.answer()
+        return
+    broadcast_id = int(query.data.split('_')[-1])
+    if await cancel_broadcast(broadcast_id):
+        await query.answer("ارسال همگانی متوقف می‌شود.", show_alert=True)
+    else:
+        await query.answer("این ارسال در حال انجام نیست.", show_alert=True)
+
+
+def _breakdown_lines(title: str, rows: list, label) -> list:
+    if not rows:
+        return []
+    lines = [f"\n{title}"]
+    for r in rows[:_BREAKDOWN_TOP]:
+        lines.append(f"• {label(r['key'])}: {r['orders']} سفارش / {r['revenue']:,} تومان")
+    return lines
+
+
 async def admin_stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    total_users = (query_db("SELECT COUNT(*) AS c FROM users", one=True) or {}).get('c', 0)
-    buyers = (query_db("SELECT COUNT(DISTINCT user_id) AS c FROM orders WHERE status='approved'", one=True) or {}).get('c', 0)
-    daily_rev = (query_db(
-        """
-        SELECT COALESCE(SUM(CASE WHEN o.final_price IS NOT NULL THEN o.final_price ELSE p.price END),0) AS rev
-        FROM orders o
-        JOIN plans p ON p.id = o.plan_id
-        WHERE o.status='approved' AND date(o.timestamp) = date('now','localtime')
-        """,
-        one=True,
-    ) or {}).get('rev', 0)
-    monthly_rev = (query_db(
-        """
-        SELECT COALESCE(SUM(CASE WHEN o.final_price IS NOT NULL THEN o.final_price ELSE p.price END),0) AS rev
-        FROM orders o
-        JOIN plans p ON p.id = o.plan_id
-        WHERE o.status='approved' AND strftime('%Y-%m', o.timestamp) = strftime('%Y-%m', 'now','localtime')
-        """,
-        one=True,
-    ) or {}).get('rev', 0)
-
-    text = (
-        "📊 آمار ربات:\n\n"
-        f"کاربران: {int(total_users)}\n"
-        f"خریداران: {int(buyers)}\n\n"
-        f"درآمد امروز: {int(daily_rev):,} تومان\n"
-        f"درآمد این ماه: {int(monthly_rev):,} تومان"
-    )
+    # Precomputed aggregates: constant cost regardless of order history
+    stats = await adb.run_read(read_stats)
+    plan_names = {str(r['id']): r['name'] for r in (await adb.query("SELECT id, name FROM plans") or [])}
+    panel_names = {str(r['id']): r['name'] for r in (await adb.query("SELECT id, name FROM panels") or [])}
+
+    lines = [
+        "📊 آمار ربات:\n",
+        f"کاربران: {stats['total_users']}",
+        f"خریداران: {stats['buyers']}\n",
+        f"درآمد امروز: {stats['daily_revenue_toman']:,} تومان ({stats['daily_orders']} سفارش)",
+        f"درآمد این ماه: {stats['monthly_revenue_toman']:,} تومان ({stats['monthly_orders']} سفارش)",
+    ]
+    lines += _breakdown_lines("📦 این ماه به تفکیک پلن:", stats['monthly_by_plan'], lambda k: plan_names.get(k, f"پلن {k}"))
+    lines += _breakdown_lines("🖥 این ماه به تفکیک پنل:", stats['monthly_by_panel'], lambda k: panel_names.get(k, f"پنل {k}") if k else "نامشخص")
+    lines += _breakdown_lines("💳 این ماه به تفکیک روش پرداخت:", stats['monthly_by_method'], lambda k: PAYMENT_METHOD_LABELS.get(k, k))
+    text = "\n".join(lines)
     keyboard = [
         [InlineKeyboardButton("🔄 بروزرسانی", callback_data="stats_refresh")],
         [InlineKeyboardButton("\U0001F519 بازگشت", callback_data="admin_main")],
     ]
-    await _safe_edit_text(query.message, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
+    # Plain text: plan and panel names may contain Markdown characters
+    await _safe_edit_text(query.message, text, reply_markup=InlineKeyboardMarkup(keyboard))
     return ADMIN_STATS_MENU
 
 
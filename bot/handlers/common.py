@@ -1,59 +1,96 @@
+import time
+from collections import OrderedDict
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ApplicationHandlerStop
 
-from ..config import ADMIN_ID, CHANNEL_ID, CHANNEL_USERNAME, logger
-from ..db import query_db
+from ..config import (
+	CHANNEL_ID, CHANNEL_USERNAME, logger,
+	FORCE_JOIN_MEMBER_TTL, FORCE_JOIN_NEGATIVE_TTL, FORCE_JOIN_CHANNEL_TTL,
+)
+from ..db import query_db, adb
+from ..settings import get_setting
 from ..utils import register_new_user
 from ..helpers.flow import get_flow
+from ..helpers.tg import is_admin
 
 
-async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE):
-	user = update.effective_user
-	if not user:
-		return
-	# Bypass channel join for any admin (primary or additional)
-	if user.id == ADMIN_ID:
-		logger.debug(f"force_join_checker: admin {user.id} bypassed")
-		return
-	try:
-		extra_admin = query_db("SELECT 1 FROM admins WHERE user_id = ?", (user.id,), one=True)
-		if extra_admin:
-			logger.debug(f"force_join_checker: extra admin {user.id} bypassed")
-			return
-	except Exception:
-		pass
-	# Capture referral payload from /start before blocking join
-	try:
-		if update.message and update.message.text:
-			parts = update.message.text.strip().split()
-			if len(parts) == 2 and parts[0].lower() == '/start':
-				ref_id = int(parts[1])
-				if ref_id != user.id:
-					context.user_data['referrer_id'] = ref_id
-	except Exception:
-		pass
-	# Skip join check during active flows to not block message inputs
-	ud = context.user_data or {}
-	if ud.get('awaiting') or ud.get('awaiting_admin') or ud.get('awaiting_ticket') or get_flow(context):
-		logger.debug(f"force_join_checker: skip join check for user {user.id} due to active flow flags: {list(k for k,v in ud.items() if v)}")
-		return
+# Rendered menus (text + markup) keyed by message/back target/trial flag, LRU-bounded.
+# Only existing messages are stored, so arbitrary callback data can't grow it.
+# Cleared by invalidate_menu_cache() whenever admins edit messages or buttons.
+_MENU_CACHE = OrderedDict()
+_MENU_CACHE_MAX = 256
+_menu_generation = 0
+
+
+def invalidate_menu_cache():
+	global _menu_generation
+	_menu_generation += 1
+	_MENU_CACHE.clear()
+
+
+async def _cached_menu(key, build, *args):
+	menu = _MENU_CACHE.get(key)
+	if menu is not None:
+		_MENU_CACHE.move_to_end(key)
+		return menu
+	generation = _menu_generation
+	menu = await adb.run_read(build, *args)
+	# Skip storing if missing, or if an admin edit invalidated the cache meanwhile
+	if menu is not None and generation == _menu_generation:
+		_MENU_CACHE[key] = menu
+		while len(_MENU_CACHE) > _MENU_CACHE_MAX:
+			_MENU_CACHE.popitem(last=False)
+	return menu
+
+
+def _channel_chat_id():
 	from ..config import CHANNEL_CHAT as _CHAT
-	chat_id = _CHAT if _CHAT is not None else (CHANNEL_ID or CHANNEL_USERNAME)
+	return _CHAT if _CHAT is not None else (CHANNEL_ID or CHANNEL_USERNAME)
+
+
+# Membership verdicts: user_id -> (is_member, expires_at). Members are trusted for
+# FORCE_JOIN_MEMBER_TTL, non-members only briefly so joining takes effect quickly.
+_MEMBER_CACHE = {}
+_MEMBER_CACHE_MAX = 50000
+# (join_url, channel_hint, expires_at)
+_CHANNEL_INFO = None
+
+
+async def is_channel_member(bot, user_id: int, fresh: bool = False) -> bool:
+	now = time.monotonic()
+	cached = _MEMBER_CACHE.get(user_id)
+	if cached and not fresh and cached[1] > now:
+		return cached[0]
 	try:
-		member = await context.bot.get_chat_member(chat_id=chat_id, user_id=user.id)
-		if member.status in ['member', 'administrator', 'creator']:
-			return
+		member = await bot.get_chat_member(chat_id=_channel_chat_id(), user_id=user_id)
 	except TelegramError as e:
 		# If we cannot verify, keep user blocked and show join info instead of allowing silently
-		logger.warning(f"Could not check channel membership for {user.id}: {e}")
-
+		logger.warning(f"Could not check channel membership for {user_id}: {e}")
+		return False
+	is_member = getattr(member, 'status', None) in ['member', 'administrator', 'creator']
+	if len(_MEMBER_CACHE) >= _MEMBER_CACHE_MAX:
+		for uid in [u for u, v in _MEMBER_CACHE.items() if v[1] <= now]:
+			_MEMBER_CACHE.pop(uid, None)
+		if len(_MEMBER_CACHE) >= _MEMBER_CACHE_MAX:
+			_MEMBER_CACHE.clear()
+	_MEMBER_CACHE[user_id] = (is_member, now + (FORCE_JOIN_MEMBER_TTL if is_member else FORCE_JOIN_NEGATIVE_TTL))
+	return is_member
+
+
+async def get_channel_join_info(bot):
+	"""(join_url, channel_hint) for the join gate; the get_chat lookup is cached."""
+	global _CHANNEL_INFO
+	now = time.monotonic()
+	if _CHANNEL_INFO and _CHANNEL_INFO[2] > now:
+		return _CHANNEL_INFO[0], _CHANNEL_INFO[1]
 	# Build a visible channel hint and a reliable join link if possible
 	join_url = None
 	channel_hint = ""
 	try:
-		chat_obj = await context.bot.get_chat(chat_id=chat_id)
+		chat_obj = await bot.get_chat(chat_id=_channel_chat_id())
 		uname = getattr(chat_obj, 'username', None)
 		inv = getattr(chat_obj, 'invite_link', None)
 		if uname:
@@ -63,7 +100,9 @@ async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE)
 		elif inv:
 			join_url = inv
 			channel_hint = "\n\nلینک دعوت کانال در دکمه زیر موجود است."
+		_CHANNEL_INFO = (join_url, channel_hint, now + FORCE_JOIN_CHANNEL_TTL)
 	except Exception:
+		# Not cached, so the real link is picked up as soon as get_chat works again
 		if (CHANNEL_USERNAME or '').strip():
 			handle = (CHANNEL_USERNAME or '').strip()
 			if not handle.startswith('@'):
@@ -72,7 +111,38 @@ async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE)
 			channel_hint = f"\n\nکانال: {handle}"
 		elif CHANNEL_ID:
 			channel_hint = f"\n\nشناسه کانال: `{CHANNEL_ID}`"
+	return join_url, channel_hint
+
+
+async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE):
+	user = update.effective_user
+	if not user:
+		return
+	# Bypass channel join for any admin (primary or additional)
+	if is_admin(user.id):
+		logger.debug(f"force_join_checker: admin {user.id} bypassed")
+		return
+	# Capture referral payload from /start before blocking join
+	try:
+		if update.message and update.message.text:
+			parts = update.message.text.strip().split()
+			if len(parts) == 2 and parts[0].lower() == '/start':
+				ref_id = int(parts[1])
+				if ref_id != user.id:
+					context.user_data['referrer_id'] = ref_id
+	except Exception:
+		pass
+	# Skip join check during active flows to not block message inputs
+	ud = context.user_data or {}
+	if ud.get('awaiting') or ud.get('awaiting_admin') or ud.get('awaiting_ticket') or get_flow(context):
+		logger.debug(f"force_join_checker: skip join check for user {user.id} due to active flow flags: {list(k for k,v in ud.items() if v)}")
+		return
+	# The "joined" button must always see a fresh answer
+	fresh = bool(update.callback_query and update.callback_query.data == 'check_join')
+	if await is_channel_member(context.bot, user.id, fresh=fresh):
+		return
 
+	join_url, channel_hint = await get_channel_join_info(context.bot)
 	keyboard = []
 	if join_url:
 		keyboard.append([InlineKeyboardButton("\U0001F195 عضویت در کانال", url=join_url)])
@@ -91,13 +161,10 @@ async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE)
 	raise ApplicationHandlerStop
 
 
-async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYPE, message_name: str, back_to: str = 'start_main'):
-	query = update.callback_query
-
+def _build_dynamic_menu(message_name: str, back_to: str, trial_enabled: bool):
 	message_data = query_db("SELECT text, file_id, file_type FROM messages WHERE message_name = ?", (message_name,), one=True)
 	if not message_data:
-		await query.answer(f"محتوای '{message_name}' یافت نشد!", show_alert=True)
-		return
+		return None
 
 	text = message_data.get('text')
 	file_id = message_data.get('file_id')
@@ -109,8 +176,7 @@ async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYP
 	)
 
 	if message_name == 'start_main':
-		trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-		if not trial_status or trial_status.get('value') != '1':
+		if not trial_enabled:
 			buttons_data = [b for b in buttons_data if b.get('target') != 'get_free_config']
 
 	keyboard = []
@@ -134,8 +200,7 @@ async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYP
 		top_row = []
 		if missing('buy_config_main'):
 			top_row.append(InlineKeyboardButton("\U0001F4E1 خرید کانفیگ", callback_data='buy_config_main'))
-		trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-		if trial_status and trial_status.get('value') == '1' and missing('get_free_config'):
+		if trial_enabled and missing('get_free_config'):
 			top_row.append(InlineKeyboardButton("\U0001F381 دریافت تست", callback_data='get_free_config'))
 		if top_row:
 			keyboard.append(top_row)
@@ -177,6 +242,24 @@ async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYP
 		keyboard.append([InlineKeyboardButton("\U0001F519 بازگشت", callback_data=back_to)])
 
 	reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+	return text, file_id, file_type, reply_markup
+
+
+async def _get_dynamic_menu(message_name: str, back_to: str = 'start_main'):
+	"""Cached (text, file_id, file_type, reply_markup) for a message, or None if it doesn't exist."""
+	trial_enabled = get_setting('free_trial_status') == '1'
+	key = ('dynamic', message_name, back_to, trial_enabled)
+	return await _cached_menu(key, _build_dynamic_menu, message_name, back_to, trial_enabled)
+
+
+async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYPE, message_name: str, back_to: str = 'start_main'):
+	query = update.callback_query
+
+	menu = await _get_dynamic_menu(message_name, back_to)
+	if not menu:
+		await query.answer(f"محتوای '{message_name}' یافت نشد!", show_alert=True)
+		return
+	text, file_id, file_type, reply_markup = menu
 
 	try:
 		if file_id or (query.message and (query.message.photo or query.message.video or query.message.document)):
@@ -213,20 +296,7 @@ async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYP
 			logger.error(f"Error handling dynamic message: {e}")
 
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-	logger.debug(f"start_command by user {update.effective_user.id}")
-	await register_new_user(update.effective_user, update, referrer_hint=context.user_data.get('referrer_id'))
-	context.user_data.clear()
-
-	sender = None
-	if update.callback_query:
-		sender = None
-	elif update.message:
-		sender = update.message.reply_text
-
-	if not sender:
-		pass
-
+def _build_start_menu(trial_enabled: bool):
 	message_data = query_db("SELECT text FROM messages WHERE message_name = 'start_main'", one=True)
 	text = message_data.get('text') if message_data else "خوش آمدید!"
 
@@ -234,8 +304,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 		"SELECT text, target, is_url, row, col FROM buttons WHERE menu_name = 'start_main' ORDER BY row, col"
 	)
 
-	trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-	if not trial_status or trial_status.get('value') != '1':
+	if not trial_enabled:
 		buttons_data = [b for b in buttons_data if b.get('target') != 'get_free_config']
 
 	keyboard = []
@@ -259,8 +328,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 	top_row = []
 	if missing('buy_config_main'):
 		top_row.append(InlineKeyboardButton("\U0001F4E1 خرید کانفیگ", callback_data='buy_config_main'))
-	trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-	if trial_status and trial_status.get('value') == '1' and missing('get_free_config'):
+	if trial_enabled and missing('get_free_config'):
 		top_row.append(InlineKeyboardButton("\U0001F381 دریافت تست", callback_data='get_free_config'))
 	if top_row:
 		keyboard.append(top_row)
@@ -295,6 +363,29 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 		keyboard.append(row)
 
 	reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+	return text, reply_markup
+
+
+async def _get_start_menu():
+	trial_enabled = get_setting('free_trial_status') == '1'
+	return await _cached_menu(('start', trial_enabled), _build_start_menu, trial_enabled)
+
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+	logger.debug(f"start_command by user {update.effective_user.id}")
+	await register_new_user(update.effective_user, update, referrer_hint=context.user_data.get('referrer_id'))
+	context.user_data.clear()
+
+	sender = None
+	if update.callback_query:
+		sender = None
+	elif update.message:
+		sender = update.message.reply_text
+
+	if not sender:
+		pass
+
+	text, reply_markup = await _get_start_menu()
 	if update.callback_query:
 		try:
 			await update.callback_query.message.delete()
@@ -322,7 +413,7 @@ async def dynamic_button_handler(update: Update, context: ContextTypes.DEFAULT_T
 	await query.answer()
 	message_name = query.data
 
-	if query_db("SELECT 1 FROM messages WHERE message_name = ?", (message_name,), one=True):
+	if await _get_dynamic_menu(message_name, 'start_main'):
 		await send_dynamic_message(update, context, message_name=message_name, back_to='start_main')
 	else:
 		await query.answer("این دکمه در حال حاضر کار نمی‌کند.", show_alert=True)
\ No newline at end of file
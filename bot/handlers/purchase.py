@@ -4,13 +4,15 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import BadRequest
 
-from ..db import query_db, execute_db
+from ..db import adb
+from ..settings import get_setting, get_settings, set_setting
 from ..handlers.common import start_command
 from ..states import SELECT_PLAN, AWAIT_DISCOUNT_CODE, AWAIT_PAYMENT_SCREENSHOT, RENEW_AWAIT_PAYMENT, SELECT_PAYMENT_METHOD
 from ..config import NOBITEX_TOKEN, logger
 import requests
 from ..helpers.tg import safe_edit_text as _safe_edit, ltr_code, notify_admins
 from ..helpers.flow import set_flow, clear_flow
+from ..wallet import debit_wallet
 
 
 def _strike_text(text: str) -> str:
@@ -27,7 +29,7 @@ async def start_purchase_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     # Check reseller status for discount view
     uid = query.from_user.id
-    reseller = query_db("SELECT discount_percent, expires_at, max_purchases, used_purchases, status FROM resellers WHERE user_id = ?", (uid,), one=True) or {}
+    reseller = await adb.query("SELECT discount_percent, expires_at, max_purchases, used_purchases, status FROM resellers WHERE user_id = ?", (uid,), one=True) or {}
     # Only show discount if reseller is active, not expired, and within cap
     r_percent = 0
     try:
@@ -40,7 +42,7 @@ async def start_purchase_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
                 r_percent = int((reseller.get('discount_percent') or 0) or 0)
     except Exception:
         r_percent = 0
-    plans = query_db("SELECT id, name, price FROM plans ORDER BY price")
+    plans = await adb.query("SELECT id, name, price FROM plans ORDER BY price")
     if not plans:
         await _safe_edit(
             query.message,
@@ -61,7 +63,7 @@ async def start_purchase_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
         keyboard.append([InlineKeyboardButton(f"{plan['name']} - {label_price}", callback_data=f"select_plan_{plan['id']}")])
     keyboard.append([InlineKeyboardButton("\U0001F519 بازگشت", callback_data='start_main')])
 
-    message_data = query_db("SELECT text FROM messages WHERE message_name = 'buy_config_main'", one=True)
+    message_data = await adb.query("SELECT text FROM messages WHERE message_name = 'buy_config_main'", one=True)
     text = message_data.get('text') if message_data else "لطفا پلن خود را انتخاب کنید:"
 
     await _safe_edit(query.message, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
@@ -73,7 +75,7 @@ async def show_plan_confirmation(update: Update, context: ContextTypes.DEFAULT_T
     plan_id = int(query.data.replace('select_plan_', ''))
     await query.answer()
 
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
+    plan = await adb.query("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
     if not plan:
         await _safe_edit(
             query.message,
@@ -86,7 +88,7 @@ async def show_plan_confirmation(update: Update, context: ContextTypes.DEFAULT_T
     context.user_data['original_price'] = plan['price']
     # Apply reseller discount if any and within cap (or unlimited cap when max_purchases == 0)
     uid = query.from_user.id
-    reseller = query_db("SELECT discount_percent, expires_at, max_purchases, used_purchases, status FROM resellers WHERE user_id = ?", (uid,), one=True) or {}
+    reseller = await adb.query("SELECT discount_percent, expires_at, max_purchases, used_purchases, status FROM resellers WHERE user_id = ?", (uid,), one=True) or {}
     r_percent = 0
     try:
         if reseller:
@@ -144,7 +146,7 @@ async def receive_and_validate_discount_code(update: Update, context: ContextTyp
         await start_command(update, context)
         return ConversationHandler.END
 
-    code_data = query_db("SELECT * FROM discount_codes WHERE code = ?", (user_code,), one=True)
+    code_data = await adb.query("SELECT * FROM discount_codes WHERE code = ?", (user_code,), one=True)
     error_message = None
     from datetime import datetime as _dt
     if not code_data:
@@ -296,10 +298,9 @@ def _fetch_nobitex_usd_irt() -> float:
 
 def _fetch_usdt_irt_price() -> float:
     # Priority based on mode: manual or api; then cached
-    from ..db import query_db as _q, execute_db as _x
-    mode = ((_q("SELECT value FROM settings WHERE key = 'usd_irt_mode'", one=True) or {}).get('value') or 'manual').lower()
+    mode = (get_setting('usd_irt_mode') or 'manual').lower()
     if mode == 'manual':
-        manual = (_q("SELECT value FROM settings WHERE key = 'usd_irt_manual'", one=True) or {}).get('value') or ''
+        manual = get_setting('usd_irt_manual') or ''
         try:
             rate = float(manual.strip()) if manual.strip() else 0.0
             if rate > 0:
@@ -310,13 +311,13 @@ def _fetch_usdt_irt_price() -> float:
         price = _fetch_nobitex_usd_irt()
         if price > 0:
             try:
-                _x("UPDATE settings SET value = ? WHERE key = 'usd_irt_cached'", (str(int(price)),))
-                _x("UPDATE settings SET value = ? WHERE key = 'usd_irt_cached_ts'", (datetime.now().isoformat(timespec='seconds'),))
+                set_setting('usd_irt_cached', str(int(price)))
+                set_setting('usd_irt_cached_ts', datetime.now().isoformat(timespec='seconds'))
             except Exception:
                 pass
             return price
     # Cached fallback
-    cached = (_q("SELECT value FROM settings WHERE key = 'usd_irt_cached'", one=True) or {}).get('value') or ''
+    cached = get_setting('usd_irt_cached') or ''
     try:
         c = float(cached.strip()) if cached.strip() else 0.0
         if c > 0:
@@ -335,13 +336,13 @@ async def show_payment_method_selection(update: Update, context: ContextTypes.DE
         await update.effective_message.reply_text("خطا! قیمت نهایی مشخص نیست. لطفا از ابتدا شروع کنید.")
         return await cancel_flow(update, context)
 
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     pay_card = settings.get('pay_card_enabled', '1') == '1'
     pay_crypto = settings.get('pay_crypto_enabled', '1') == '1'
     pay_gateway = settings.get('pay_gateway_enabled', '0') == '1'
 
     # User wallet balance
-    bal_row = query_db("SELECT balance FROM user_wallets WHERE user_id = ?", (update.effective_user.id,), one=True)
+    bal_row = await adb.query("SELECT balance FROM user_wallets WHERE user_id = ?", (update.effective_user.id,), one=True)
     balance = bal_row.get('balance') if bal_row else 0
 
     text = "روش پرداخت خود را انتخاب کنید:"
@@ -372,64 +373,70 @@ async def pay_method_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if final_price is None:
         await query.message.edit_text("خطا: قیمت نهایی یافت نشد. از ابتدا شروع کنید.")
         return ConversationHandler.END
-    bal_row = query_db("SELECT balance FROM user_wallets WHERE user_id = ?", (user.id,), one=True)
-    balance = bal_row.get('balance') if bal_row else 0
-    if balance < int(final_price):
-        kb = [
-            [InlineKeyboardButton("\U0001F4B3 شارژ کیف پول", callback_data='wallet_menu')],
-            [InlineKeyboardButton("\U0001F519 بازگشت", callback_data='buy_config_main')],
-        ]
-        await query.message.edit_text(f"\u26A0\uFE0F موجودی کیف پول کافی نیست.\nموجودی: {balance:,} تومان\nمبلغ موردنیاز: {int(final_price):,} تومان", reply_markup=InlineKeyboardMarkup(kb))
-        return SELECT_PAYMENT_METHOD
-
-    # Deduct and log transaction
-    execute_db("INSERT OR IGNORE INTO user_wallets (user_id, balance) VALUES (?, 0)", (user.id,))
-    execute_db("UPDATE user_wallets SET balance = balance - ? WHERE user_id = ?", (int(final_price), user.id))
-    execute_db("INSERT INTO wallet_transactions (user_id, amount, direction, method, status, created_at) VALUES (?, ?, 'debit', 'wallet', 'approved', ?)", (user.id, int(final_price), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
 
     is_renewal = context.user_data.get('renewing_order_id')
+    order = None
     if is_renewal:
         order_id = context.user_data.get('renewing_order_id')
         plan_id = context.user_data.get('selected_renewal_plan_id')
         if not order_id or not plan_id:
             await query.message.edit_text("خطا در فرآیند تمدید. دوباره تلاش کنید.")
             return ConversationHandler.END
-        plan = query_db("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
-        await notify_admins(context.bot,
+    else:
+        plan_id = context.user_data.get('selected_plan_id')
+        if not plan_id:
+            await query.message.edit_text("خطا: پلن انتخابی یافت نشد.")
+            return ConversationHandler.END
+        order = {
+            'user_id': user.id,
+            'plan_id': plan_id,
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'final_price': int(final_price),
+            'discount_code': context.user_data.get('discount_code'),
+            'payment_method': 'wallet',
+        }
+
+    # Debit, ledger row and (for purchases) the order commit in one transaction
+    ok, new_bal, new_order_id = await debit_wallet(user.id, int(final_price), order=order)
+    if not ok:
+        if new_bal is None:
+            await query.message.edit_text("خطا در پرداخت از کیف پول. لطفا دوباره تلاش کنید.")
+            return SELECT_PAYMENT_METHOD
+        kb = [
+            [InlineKeyboardButton("\U0001F4B3 شارژ کیف پول", callback_data='wallet_menu')],
+            [InlineKeyboardButton("\U0001F519 بازگشت", callback_data='buy_config_main')],
+        ]
+        await query.message.edit_text(f"\u26A0\uFE0F موجودی کیف پول کافی نیست.\nموجودی: {new_bal:,} تومان\nمبلغ موردنیاز: {int(final_price):,} تومان", reply_markup=InlineKeyboardMarkup(kb))
+        return SELECT_PAYMENT_METHOD
+
+    if is_renewal:
+        plan = await adb.query("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
+        await notify_admins(context.bot, background=True,
             text=(f"\u2757 **درخواست تمدید** (برای سفارش #{order_id})\n\n**پلن تمدید:** {plan['name']}\n\U0001F4B0 **مبلغ:** {int(final_price):,} تومان\n\U0001F4B3 **روش:** کیف پول\n\nلطفا پس از بررسی، تمدید را تایید کنید:"),
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید و تمدید سرویس", callback_data=f"approve_renewal_{order_id}_{plan_id}")]]),
         )
         # Show remaining balance
-        new_bal = (balance - int(final_price))
         await query.message.edit_text(f"\u2705 پرداخت از کیف پول ثبت شد و برای تایید به ادمین ارسال شد.\nموجودی فعلی: {new_bal:,} تومان")
         context.user_data.clear()
         await start_command(update, context)
         return ConversationHandler.END
 
     # Purchase flow
-    plan_id = context.user_data.get('selected_plan_id')
-    discount_code = context.user_data.get('discount_code')
-    if not plan_id:
-        await query.message.edit_text("خطا: پلن انتخابی یافت نشد.")
-        return ConversationHandler.END
-    order_id = execute_db(
-        "INSERT INTO orders (user_id, plan_id, timestamp, final_price, discount_code) VALUES (?, ?, ?, ?, ?)",
-        (user.id, plan_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), int(final_price), discount_code),
-    )
+    order_id = new_order_id
     # Increment reseller usage if applicable
     try:
-        r = query_db("SELECT max_purchases, used_purchases FROM resellers WHERE user_id = ?", (user.id,), one=True)
+        r = await adb.query("SELECT max_purchases, used_purchases FROM resellers WHERE user_id = ?", (user.id,), one=True)
         if r and int(r.get('used_purchases') or 0) < int(r.get('max_purchases') or 0):
-            execute_db("UPDATE resellers SET used_purchases = used_purchases + 1 WHERE user_id = ?", (user.id,))
-            execute_db("UPDATE orders SET reseller_applied = 1 WHERE id = ?", (order_id,))
+            await adb.execute("UPDATE resellers SET used_purchases = used_purchases + 1 WHERE user_id = ?", (user.id,))
+            await adb.execute("UPDATE orders SET reseller_applied = 1 WHERE id = ?", (order_id,))
     except Exception:
         pass
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
+    plan = await adb.query("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
     user_info = f"\U0001F464 **کاربر:** {user.mention_html()}\n\U0001F194 **آیدی:** `{user.id}`"
     plan_info = f"\U0001F4CB **پلن:** {plan['name']}"
     price_info = f"\U0001F4B0 **مبلغ پرداختی:** {int(final_price):,} تومان\n\U0001F4B3 **روش:** کیف پول"
-    await notify_admins(context.bot,
+    await notify_admins(context.bot, background=True,
         text=(f"\U0001F514 **درخواست خرید جدید** (سفارش #{order_id})\n\n{user_info}\n\n{plan_info}\n{price_info}\n\nلطفا نتیجه را اعلام کنید:"),
         parse_mode=ParseMode.HTML,
         reply_markup=InlineKeyboardMarkup([
@@ -444,7 +451,6 @@ async def pay_method_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await _apply_referral_bonus(order_id, context)
     except Exception:
         pass
-    new_bal = (balance - int(final_price))
     await query.message.edit_text(f"\u2705 پرداخت از کیف پول ثبت شد و برای تایید به ادمین ارسال شد.\nموجودی فعلی: {new_bal:,} تومان")
     context.user_data.clear()
     await start_command(update, context)
@@ -460,9 +466,10 @@ async def show_payment_info_card(update: Update, context: ContextTypes.DEFAULT_T
     if final_price is None:
         await update.effective_message.reply_text("خطا! قیمت نهایی مشخص نیست. لطفا از ابتدا شروع کنید.")
         return await cancel_flow(update, context)
+    context.user_data['payment_method'] = 'card'
 
-    cards = query_db("SELECT card_number, holder_name FROM cards")
-    payment_message_data = query_db("SELECT text FROM messages WHERE message_name = 'payment_info_text'", one=True)
+    cards = await adb.query("SELECT card_number, holder_name FROM cards")
+    payment_message_data = await adb.query("SELECT text FROM messages WHERE message_name = 'payment_info_text'", one=True)
 
     is_renewal = context.user_data.get('renewing_order_id')
     if is_renewal:
@@ -509,8 +516,9 @@ async def show_payment_info_crypto(update: Update, context: ContextTypes.DEFAULT
     if final_price is None:
         await update.effective_message.reply_text("خطا! قیمت نهایی مشخص نیست. لطفا از ابتدا شروع کنید.")
         return await cancel_flow(update, context)
+    context.user_data['payment_method'] = 'crypto'
 
-    wallets = query_db("SELECT asset, chain, address, COALESCE(memo,'') AS memo FROM wallets")
+    wallets = await adb.query("SELECT asset, chain, address, COALESCE(memo,'') AS memo FROM wallets")
     if not wallets:
         text_to_send = "خطا: هیچ ولتی ثبت نشده است."
         kb = [[InlineKeyboardButton("\U0001F519 بازگشت", callback_data='buy_config_main')]]
@@ -574,7 +582,7 @@ async def show_payment_info_gateway(update: Update, context: ContextTypes.DEFAUL
         await update.effective_message.reply_text("خطا! قیمت نهایی مشخص نیست. لطفا از ابتدا شروع کنید.")
         return await cancel_flow(update, context)
 
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     callback_url = (settings.get('gateway_callback_url') or '').strip()
 
@@ -673,10 +681,10 @@ async def receive_payment_screenshot(update: Update, context: ContextTypes.DEFAU
         await start_command(update, context)
         return ConversationHandler.END
 
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
-    order_id = execute_db(
-        "INSERT INTO orders (user_id, plan_id, screenshot_file_id, timestamp, final_price, discount_code) VALUES (?, ?, ?, ?, ?, ?)",
-        (user.id, plan_id, (photo_file_id or document_file_id or None), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), final_price, discount_code),
+    plan = await adb.query("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
+    order_id = await adb.execute(
+        "INSERT INTO orders (user_id, plan_id, screenshot_file_id, timestamp, final_price, discount_code, payment_method) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (user.id, plan_id, (photo_file_id or document_file_id or None), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), final_price, discount_code, context.user_data.get('payment_method') or 'card'),
     )
 
     user_info = f"\U0001F464 **کاربر:** {user.mention_html()}\n\U0001F194 **آیدی:** `{user.id}`"
@@ -694,11 +702,11 @@ async def receive_payment_screenshot(update: Update, context: ContextTypes.DEFAU
         [InlineKeyboardButton("\u274C رد درخواست", callback_data=f"reject_order_{order_id}")],
     ])
     if photo_file_id:
-        await notify_admins(context.bot, photo=photo_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
+        await notify_admins(context.bot, background=True, photo=photo_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
     elif document_file_id:
-        await notify_admins(context.bot, document=document_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
+        await notify_admins(context.bot, background=True, document=document_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
     else:
-        await notify_admins(context.bot, text=f"{caption}\n\n{caption_extra}", parse_mode=ParseMode.HTML, reply_markup=kb)
+        await notify_admins(context.bot, background=True, text=f"{caption}\n\n{caption_extra}", parse_mode=ParseMode.HTML, reply_markup=kb)
     await update.message.reply_text("\u2705 رسید شما برای ادمین ارسال شد. لطفا تا زمان تایید و دریافت کانفیگ صبور باشید.")
     context.user_data.pop('awaiting', None)
     context.user_data.pop('renewing_order_id', None)
@@ -825,14 +833,14 @@ async def gateway_verify_purchase(update: Update, context: ContextTypes.DEFAULT_
         await query.message.edit_text("خطا: اطلاعات پرداخت یافت نشد.")
         return SELECT_PAYMENT_METHOD
     if gw.get('type') == 'zarinpal':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = get_settings()
         merchant_id = settings.get('zarinpal_merchant_id') or ''
         ok, ref_id = _zarinpal_verify(merchant_id, gw.get('amount_rial', 0), gw.get('authority', ''))
         if not ok:
             await query.message.edit_text("پرداخت تایید نشد. اگر پرداخت کرده‌اید چند لحظه دیگر دوباره بررسی کنید یا از روش‌های دیگر استفاده کنید.")
             return SELECT_PAYMENT_METHOD
     elif gw.get('type') == 'aghapay':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = get_settings()
         pin = settings.get('aghapay_pin') or ''
         ok = _aghapay_verify(pin, int(context.user_data.get('final_price', 0)), gw.get('transid', ''))
         if not ok:
@@ -848,23 +856,23 @@ async def gateway_verify_purchase(update: Update, context: ContextTypes.DEFAULT_
         await query.message.edit_text("خطا: اطلاعات خرید یافت نشد. لطفا مجددا خرید کنید.")
         await start_command(update, context)
         return ConversationHandler.END
-    order_id = execute_db(
-        "INSERT INTO orders (user_id, plan_id, timestamp, final_price, discount_code) VALUES (?, ?, ?, ?, ?)",
+    order_id = await adb.execute(
+        "INSERT INTO orders (user_id, plan_id, timestamp, final_price, discount_code, payment_method) VALUES (?, ?, ?, ?, ?, 'gateway')",
         (user.id, plan_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), final_price, discount_code),
     )
     # Increment reseller usage if applicable
     try:
-        r = query_db("SELECT max_purchases, used_purchases FROM resellers WHERE user_id = ?", (user.id,), one=True)
+        r = await adb.query("SELECT max_purchases, used_purchases FROM resellers WHERE user_id = ?", (user.id,), one=True)
         if r and int(r.get('used_purchases') or 0) < int(r.get('max_purchases') or 0):
-            execute_db("UPDATE resellers SET used_purchases = used_purchases + 1 WHERE user_id = ?", (user.id,))
-            execute_db("UPDATE orders SET reseller_applied = 1 WHERE id = ?", (order_id,))
+            await adb.execute("UPDATE resellers SET used_purchases = used_purchases + 1 WHERE user_id = ?", (user.id,))
+            await adb.execute("UPDATE orders SET reseller_applied = 1 WHERE id = ?", (order_id,))
     except Exception:
         pass
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
+    plan = await adb.query("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
     user_info = f"\U0001F464 **کاربر:** {user.mention_html()}\n\U0001F194 **آیدی:** `{user.id}`"
     plan_info = f"\U0001F4CB **پلن:** {plan['name']}"
     price_info = f"\U0001F4B0 **مبلغ پرداختی:** {final_price:,} تومان\n\U0001F6E0\uFE0F **روش:** درگاه پرداخت ({gw.get('type','')})"
-    await notify_admins(context.bot,
+    await notify_admins(context.bot, background=True,
         text=(f"\U0001F514 **درخواست خرید جدید** (سفارش #{order_id})\n\n{user_info}\n\n{plan_info}\n{price_info}\n\nلطفا نتیجه را اعلام کنید:"),
         parse_mode=ParseMode.HTML,
         reply_markup=InlineKeyboardMarkup([
@@ -892,14 +900,14 @@ async def gateway_verify_renewal(update: Update, context: ContextTypes.DEFAULT_T
         await query.message.edit_text("خطا: اطلاعات پرداخت یافت نشد.")
         return RENEW_AWAIT_PAYMENT
     if gw.get('type') == 'zarinpal':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = get_settings()
         merchant_id = settings.get('zarinpal_merchant_id') or ''
         ok, ref_id = _zarinpal_verify(merchant_id, gw.get('amount_rial', 0), gw.get('authority', ''))
         if not ok:
             await query.message.edit_text("پرداخت تایید نشد. اگر پرداخت کرده‌اید کمی بعد دوباره بررسی کنید.")
             return RENEW_AWAIT_PAYMENT
     elif gw.get('type') == 'aghapay':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = get_settings()
         pin = settings.get('aghapay_pin') or ''
         ok = _aghapay_verify(pin, int(context.user_data.get('final_price', 0)), gw.get('transid', ''))
         if not ok:
@@ -912,8 +920,8 @@ async def gateway_verify_renewal(update: Update, context: ContextTypes.DEFAULT_T
     if not order_id or not plan_id or final_price is None:
         await query.message.edit_text("خطا در فرآیند تمدید. لطفا مجددا تلاش کنید.")
         return ConversationHandler.END
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
-    await notify_admins(context.bot,
+    plan = await adb.query("SELECT * FROM plans WHERE id = ?", (plan_id,), one=True)
+    await notify_admins(context.bot, background=True,
         text=(f"\u2757 **درخواست تمدید** (برای سفارش #{order_id})\n\n**پلن تمدید:** {plan['name']}\n\U0001F4B0 **مبلغ:** {final_price:,} تومان\n\U0001F6E0\uFE0F **روش:** درگاه پرداخت ({gw.get('type','')})\n\nلطفا پس از بررسی، تمدید را تایید کنید:"),
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید و تمدید سرویس", callback_data=f"approve_renewal_{order_id}_{plan_id}")]]),
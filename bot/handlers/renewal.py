@@ -9,7 +9,7 @@ from ..states import (
     RENEW_AWAIT_DISCOUNT_CODE,
     RENEW_AWAIT_PAYMENT,
 )
-from ..panel import VpnPanelAPI
+from ..panel import VpnPanelAPI, run_panel_io
 from ..helpers.flow import set_flow, clear_flow
 from ..helpers.tg import notify_admins
 
@@ -115,7 +115,7 @@ async def receive_renewal_payment(update: Update, context: ContextTypes.DEFAULT_
         f"لطفا پس از بررسی، تمدید را تایید کنید:"
     )
 
-    await notify_admins(context.bot, photo=photo_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید و تمدید سرویس", callback_data=f"approve_renewal_{order_id}_{plan_id}")]]))
+    await notify_admins(context.bot, background=True, photo=photo_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید و تمدید سرویس", callback_data=f"approve_renewal_{order_id}_{plan_id}")]]))
     await update.message.reply_text("✅ رسید شما برای تمدید ارسال شد. لطفا تا زمان تایید نهایی صبور باشید.")
     context.user_data.pop('awaiting', None)
     clear_flow(context)
@@ -152,11 +152,11 @@ async def process_renewal_for_order(order_id: int, plan_id: int, context: Contex
                 add_days = 0
             # Prefer recreate strategy first for 3x-UI for maximum compatibility
             if hasattr(api, 'renew_by_recreate_on_inbound'):
-                renewed_user, message = api.renew_by_recreate_on_inbound(inbound_id, marz_username, add_gb, add_days)
+                renewed_user, message = await run_panel_io(api.renew_by_recreate_on_inbound, inbound_id, marz_username, add_gb, add_days)
                 if not renewed_user and hasattr(api, 'renew_user_on_inbound'):
-                    renewed_user, message = api.renew_user_on_inbound(inbound_id, marz_username, add_gb, add_days)
+                    renewed_user, message = await run_panel_io(api.renew_user_on_inbound, inbound_id, marz_username, add_gb, add_days)
             elif hasattr(api, 'renew_user_on_inbound'):
-                renewed_user, message = api.renew_user_on_inbound(inbound_id, marz_username, add_gb, add_days)
+                renewed_user, message = await run_panel_io(api.renew_user_on_inbound, inbound_id, marz_username, add_gb, add_days)
             else:
                 renewed_user, message = await api.renew_user_in_panel(marz_username, plan)
         else:
@@ -176,10 +176,10 @@ async def process_renewal_for_order(order_id: int, plan_id: int, context: Contex
                 add_days = 0
             # Try updateClient/{uuid} first
             if hasattr(api, 'renew_user_on_inbound'):
-                renewed_user, message = api.renew_user_on_inbound(inbound_id, marz_username, add_gb, add_days)
+                renewed_user, message = await run_panel_io(api.renew_user_on_inbound, inbound_id, marz_username, add_gb, add_days)
             # Fallback to recreate strategy
             if not renewed_user and hasattr(api, 'renew_by_recreate_on_inbound'):
-                renewed_user, message = api.renew_by_recreate_on_inbound(inbound_id, marz_username, add_gb, add_days)
+                renewed_user, message = await run_panel_io(api.renew_by_recreate_on_inbound, inbound_id, marz_username, add_gb, add_days)
         else:
             renewed_user, message = await api.renew_user_in_panel(marz_username, plan)
     else:
@@ -1,24 +1,21 @@
 from datetime import datetime
-import requests, base64
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
 
-from ..db import query_db, execute_db
-from ..panel import VpnPanelAPI
+from ..db import query_db, execute_db, adb, write_behind
+from ..settings import get_setting, get_settings
+from ..panel import VpnPanelAPI, run_panel_io
 from ..utils import bytes_to_gb
 from ..states import WALLET_AWAIT_AMOUNT_GATEWAY, WALLET_AWAIT_AMOUNT_CARD, WALLET_AWAIT_CARD_SCREENSHOT, WALLET_AWAIT_AMOUNT_CRYPTO, WALLET_AWAIT_CRYPTO_SCREENSHOT, RESELLER_AWAIT_UPLOAD
 from ..states import SUPPORT_AWAIT_TICKET
 from ..config import ADMIN_ID
 from ..helpers.tg import ltr_code, notify_admins
 from ..helpers.flow import set_flow, clear_flow
-import io
-try:
-    import qrcode
-except Exception:
-    qrcode = None
-import time
+from ..helpers.qr import send_qr_photo
+from ..subscription import fetch_subscription_configs
+import asyncio
 
 # Normalize Persian/Arabic digits to ASCII
 _DIGIT_MAP = str.maketrans({
@@ -35,33 +32,6 @@ def _normalize_amount_text(text: str) -> str:
     return t
 
 
-def _fetch_subscription_configs(sub_url: str, timeout_seconds: int = 15) -> list[str]:
-    try:
-        headers = {
-            'Accept': 'text/plain, application/octet-stream, */*',
-            'User-Agent': 'Mozilla/5.0',
-        }
-        r = requests.get(sub_url, headers=headers, timeout=timeout_seconds)
-        r.raise_for_status()
-        raw = (r.text or '').strip()
-        if any(proto in raw for proto in ("vmess://","vless://","trojan://","ss://","hy2://")):
-            text = raw
-        else:
-            compact = "".join(raw.split())
-            pad = len(compact) % 4
-            if pad:
-                compact += "=" * (4 - pad)
-            try:
-                decoded = base64.b64decode(compact, validate=False)
-                text = decoded.decode('utf-8', errors='ignore')
-            except Exception:
-                text = raw
-        lines = [ln.strip() for ln in (text or '').splitlines()]
-        return [ln for ln in lines if ln and (ln.startswith('vmess://') or ln.startswith('vless://') or ln.startswith('trojan://') or ln.startswith('ss://') or ln.startswith('hy2://'))]
-    except Exception:
-        return []
-
-
 async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -85,8 +55,7 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
         return
 
     # Use admin-selected panel for free trials if set; fallback to first
-    cfg = query_db("SELECT value FROM settings WHERE key = 'free_trial_panel_id'", one=True)
-    sel_id = (cfg.get('value') if cfg else '') or ''
+    sel_id = str(get_setting('free_trial_panel_id') or '')
     first_panel = None
     if sel_id.isdigit():
         first_panel = query_db("SELECT id FROM panels WHERE id = ?", (int(sel_id),), one=True)
@@ -104,7 +73,7 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
     except Exception:
         pass
 
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings WHERE key LIKE 'free_trial_%'")}
+    settings = get_settings()
     trial_plan = {'traffic_gb': settings.get('free_trial_gb', '0.2'), 'duration_days': settings.get('free_trial_days', '1')}
 
     panel_api = VpnPanelAPI(panel_id=first_panel['id'])
@@ -126,10 +95,10 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
         # For XUI-like panels, if a trial inbound is set, create on that inbound directly
         prow = query_db("SELECT panel_type FROM panels WHERE id = ?", (first_panel['id'],), one=True) or {}
         ptype = (prow.get('panel_type') or '').lower()
-        trial_inb_row = query_db("SELECT value FROM settings WHERE key='free_trial_inbound_id'", one=True)
-        trial_inb = int(trial_inb_row.get('value')) if (trial_inb_row and str(trial_inb_row.get('value') or '').isdigit()) else None
+        trial_inb_val = str(get_setting('free_trial_inbound_id') or '')
+        trial_inb = int(trial_inb_val) if trial_inb_val.isdigit() else None
         if ptype in ('xui','x-ui','3xui','3x-ui','alireza','txui','tx-ui','tx ui') and trial_inb is not None and hasattr(panel_api, 'create_user_on_inbound'):
-            username_created, sub_link, _msg = panel_api.create_user_on_inbound(trial_inb, user_id, trial_plan)
+            username_created, sub_link, _msg = await run_panel_io(panel_api.create_user_on_inbound, trial_inb, user_id, trial_plan)
             marzban_username, config_link, message = username_created, sub_link, _msg
         else:
             marzban_username, config_link, message = await panel_api.create_user(user_id, trial_plan)
@@ -150,19 +119,19 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
             prow = query_db("SELECT panel_type FROM panels WHERE id = ?", (first_panel['id'],), one=True) or {}
             ptype = (prow.get('panel_type') or '').lower()
             if ptype in ('xui','x-ui','3xui','3x-ui','alireza','txui','tx-ui','tx ui'):
-                trial_inb_row = query_db("SELECT value FROM settings WHERE key='free_trial_inbound_id'", one=True)
-                if trial_inb_row and str(trial_inb_row.get('value') or '').isdigit():
-                    xui_inb = int(trial_inb_row.get('value'))
+                trial_inb_val = str(get_setting('free_trial_inbound_id') or '')
+                if trial_inb_val.isdigit():
+                    xui_inb = int(trial_inb_val)
         except Exception:
             xui_inb = None
         if xui_inb is not None:
             execute_db(
-                "INSERT INTO orders (user_id, plan_id, panel_id, status, marzban_username, timestamp, xui_inbound_id, panel_type, is_trial) VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT panel_type FROM panels WHERE id=?), 1)",
+                "INSERT INTO orders (user_id, plan_id, panel_id, status, marzban_username, timestamp, xui_inbound_id, panel_type, is_trial, payment_method) VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT panel_type FROM panels WHERE id=?), 1, 'trial')",
                 (user_id, plan_id, first_panel['id'], 'approved', marzban_username, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), xui_inb, first_panel['id']),
             )
         else:
             execute_db(
-                "INSERT INTO orders (user_id, plan_id, panel_id, status, marzban_username, timestamp, panel_type, is_trial) VALUES (?, ?, ?, ?, ?, ?, (SELECT panel_type FROM panels WHERE id=?), 1)",
+                "INSERT INTO orders (user_id, plan_id, panel_id, status, marzban_username, timestamp, panel_type, is_trial, payment_method) VALUES (?, ?, ?, ?, ?, ?, (SELECT panel_type FROM panels WHERE id=?), 1, 'trial')",
                 (user_id, plan_id, first_panel['id'], 'approved', marzban_username, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), first_panel['id']),
             )
         execute_db("INSERT INTO free_trials (user_id, timestamp) VALUES (?, ?)", (user_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
@@ -189,18 +158,18 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
                     ib_id = None
             if ib_id is not None and hasattr(panel_api, 'get_configs_for_user_on_inbound'):
                 try:
-                    confs = panel_api.get_configs_for_user_on_inbound(int(ib_id), marzban_username) or []
+                    confs = await run_panel_io(panel_api.get_configs_for_user_on_inbound, int(ib_id), marzban_username) or []
                 except Exception:
                     confs = []
             if not confs and isinstance(config_link, str) and config_link.startswith('http'):
                 # Decode subscription content as a fallback
                 try:
-                    confs = _fetch_subscription_configs(config_link)
+                    confs = await fetch_subscription_configs(config_link)
                 except Exception:
                     confs = []
             if confs:
                 cfg_text = "\n".join(f"<code>{c}</code>" for c in confs)
-                footer = ((query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True) or {}).get('value') or '')
+                footer = (get_setting('config_footer_text') or '')
                 text = (
                     f"✅ کانفیگ تست رایگان شما با موفقیت ساخته شد!\n\n"
                     f"<b>حجم:</b> {trial_plan['traffic_gb']} گیگابایت\n"
@@ -255,7 +224,7 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
     user_id = query.from_user.id
 
-    orders = query_db(
+    orders = await adb.query(
         "SELECT id, marzban_username, plan_id, COALESCE(is_trial, 0) AS is_trial FROM orders WHERE user_id = ? AND status = 'approved' AND marzban_username IS NOT NULL ORDER BY id DESC",
         (user_id,),
     )
@@ -273,7 +242,7 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         text = "سرویس فعال شما:"
 
     for order in orders:
-        plan = query_db("SELECT name FROM plans WHERE id = ?", (order['plan_id'],), one=True)
+        plan = await adb.query("SELECT name FROM plans WHERE id = ?", (order['plan_id'],), one=True)
         if int(order.get('is_trial') or 0) == 1:
             plan_name = "سرویس تست"
         else:
@@ -312,7 +281,7 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
 
     marzban_username = order['marzban_username']
     panel_api = VpnPanelAPI(panel_id=order['panel_id'])
-    user_info, message = await panel_api.get_user(marzban_username)
+    user_info, message = await panel_api.get_user(marzban_username, order.get('xui_inbound_id'))
 
     if not user_info:
         await query.message.edit_text(
@@ -362,13 +331,13 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
                 if order.get('xui_inbound_id'):
                     ib_id = int(order['xui_inbound_id'])
                 else:
-                    inbounds, _m = panel_api.list_inbounds()
+                    inbounds, _m = await run_panel_io(panel_api.list_inbounds)
                     if inbounds:
                         ib_id = inbounds[0].get('id')
                 if ib_id is not None:
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, marzban_username) or []
+                    confs = await run_panel_io(panel_api.get_configs_for_user_on_inbound, ib_id, marzban_username) or []
             if not confs and sub_link and isinstance(sub_link, str) and sub_link.startswith('http'):
-                confs = _fetch_subscription_configs(sub_link)
+                confs = await fetch_subscription_configs(sub_link)
             if confs:
                 cfgs = "\n".join(f"<code>{c}</code>" for c in confs[:1])
                 # Try to also show subscription link under configs
@@ -382,7 +351,7 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
         except Exception:
             pass
     try:
-        execute_db("UPDATE orders SET last_link = ? WHERE id = ?", (sub_link or '', order_id))
+        write_behind.put("UPDATE orders SET last_link = ? WHERE id = ?", (sub_link or '', order_id), key=('last_link', order_id))
     except Exception:
         pass
 
@@ -431,7 +400,7 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
             # ensure login for 3x-UI
             if hasattr(panel_api, 'get_token'):
                 try:
-                    panel_api.get_token()
+                    await run_panel_io(panel_api.get_token)
                 except Exception:
                     pass
             ib_id = None
@@ -439,7 +408,7 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
                 ib_id = int(order['xui_inbound_id'])
             else:
                 if hasattr(panel_api, 'list_inbounds'):
-                    inbounds, _m = panel_api.list_inbounds()
+                    inbounds, _m = await run_panel_io(panel_api.list_inbounds)
                     if inbounds:
                         ib_id = inbounds[0].get('id')
             if ib_id is None:
@@ -453,19 +422,19 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
             if hasattr(panel_api, 'get_configs_for_user_on_inbound'):
                 for _ in range(4):
                     pref_id = (order.get('xui_client_id') or None)
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, order['marzban_username'], preferred_id=pref_id) or []
+                    confs = await run_panel_io(panel_api.get_configs_for_user_on_inbound, ib_id, order['marzban_username'], preferred_id=pref_id) or []
                     if confs:
                         break
-                    time.sleep(1.0)
+                    await asyncio.sleep(1.0)
             if not confs:
                 # decode subscription as fallback for display
-                user_info, message = await panel_api.get_user(order['marzban_username'])
+                user_info, message = await panel_api.get_user(order['marzban_username'], order.get('xui_inbound_id'))
                 if user_info:
                     sub = (
                         f"{panel_api.base_url}{user_info['subscription_url']}" if user_info.get('subscription_url') and not user_info['subscription_url'].startswith('http') else user_info.get('subscription_url', '')
                     )
                     if sub:
-                        confs = _fetch_subscription_configs(sub)
+                        confs = await fetch_subscription_configs(sub, fresh=True)
             if not confs:
                 try:
                     await context.bot.send_message(chat_id=query.message.chat_id, text="ساخت کانفیگ ناموفق بود - کمی بعد دوباره تلاش کنید.")
@@ -473,16 +442,7 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
                     pass
                 return ConversationHandler.END
             cfg_text = "\n".join(f"<code>{c}</code>" for c in confs)
-            sent = False
-            if qrcode:
-                try:
-                    buf = io.BytesIO()
-                    qrcode.make(confs[0]).save(buf, format='PNG')
-                    buf.seek(0)
-                    await context.bot.send_photo(chat_id=query.message.chat_id, photo=buf, caption=("\U0001F517 کانفیگ‌های جدید:\n" + cfg_text), parse_mode=ParseMode.HTML)
-                    sent = True
-                except Exception:
-                    sent = False
+            sent = await send_qr_photo(context.bot, query.message.chat_id, confs[0], caption=("\U0001F517 کانفیگ‌های جدید:\n" + cfg_text), parse_mode=ParseMode.HTML)
             if not sent:
                 await context.bot.send_message(chat_id=query.message.chat_id, text=("\U0001F517 کانفیگ‌های جدید:\n" + cfg_text), parse_mode=ParseMode.HTML)
         except Exception:
@@ -492,7 +452,7 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
                 pass
         return ConversationHandler.END
     # Default: fetch fresh link from panel
-    user_info, message = await panel_api.get_user(order['marzban_username'])
+    user_info, message = await panel_api.get_user(order['marzban_username'], order.get('xui_inbound_id'))
     if not user_info:
         await query.answer("دریافت لینک از پنل ناموفق بود", show_alert=True)
         return ConversationHandler.END
@@ -530,7 +490,7 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         # Try to ensure token if available
         if hasattr(panel_api, '_ensure_token'):
             try:
-                panel_api._ensure_token()
+                await run_panel_io(panel_api._ensure_token)
             except Exception:
                 pass
         ok = False
@@ -540,7 +500,7 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             headers = {"Accept": "application/json"}
             if getattr(panel_api, 'token', None):
                 headers["Authorization"] = f"Bearer {panel_api.token}"
-            r = panel_api.session.post(url, headers=headers, timeout=12)
+            r = await run_panel_io(panel_api.session.post, url, headers=headers, timeout=12)
             ok = (r.status_code in (200, 201, 202, 204))
         except Exception:
             ok = False
@@ -548,24 +508,24 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if not ok and (order.get('xui_inbound_id') and hasattr(panel_api, 'rotate_user_key_on_inbound')):
             if hasattr(panel_api, 'get_token'):
                 try:
-                    panel_api.get_token()
+                    await run_panel_io(panel_api.get_token)
                 except Exception:
                     pass
             try:
-                updated = panel_api.rotate_user_key_on_inbound(int(order['xui_inbound_id']), order['marzban_username'])
+                updated = await run_panel_io(panel_api.rotate_user_key_on_inbound, int(order['xui_inbound_id']), order['marzban_username'])
                 ok = bool(updated)
             except Exception:
                 ok = False
         # 3x-UI rotate across inbounds as fallback
         if not ok and hasattr(panel_api, 'rotate_user_key'):
             try:
-                ok = bool(panel_api.rotate_user_key(order['marzban_username']))
+                ok = bool(await run_panel_io(panel_api.rotate_user_key, order['marzban_username']))
             except Exception:
                 ok = False
         # Marzban fallback
         if not ok and hasattr(panel_api, 'revoke_subscription'):
             try:
-                ok, _msg = panel_api.revoke_subscription(order['marzban_username'])
+                ok, _msg = await run_panel_io(panel_api.revoke_subscription, order['marzban_username'])
             except Exception:
                 ok = False
         if not ok:
@@ -590,7 +550,7 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 ib_id = int(order['xui_inbound_id'])
             else:
                 try:
-                    inbounds, _m = panel_api.list_inbounds()
+                    inbounds, _m = await run_panel_io(panel_api.list_inbounds)
                     if inbounds:
                         ib_id = inbounds[0].get('id')
                 except Exception:
@@ -598,7 +558,7 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             if ib_id is None:
                 await query.answer("اینباندی یافت نشد", show_alert=True)
                 return ConversationHandler.END
-            new_client = panel_api.recreate_user_key_on_inbound(ib_id, order['marzban_username'])
+            new_client = await run_panel_io(panel_api.recreate_user_key_on_inbound, ib_id, order['marzban_username'])
             if not new_client:
                 await query.answer("خطا در تغییر کلید", show_alert=True)
                 return ConversationHandler.END
@@ -612,37 +572,25 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             try:
                 # Try to reuse X-UI/3x-UI config builder with preferred new id
                 if hasattr(panel_api, 'get_configs_for_user_on_inbound'):
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, order['marzban_username'], preferred_id=(new_client.get('id') or new_client.get('uuid'))) or []
+                    confs = await run_panel_io(panel_api.get_configs_for_user_on_inbound, ib_id, order['marzban_username'], preferred_id=(new_client.get('id') or new_client.get('uuid'))) or []
                 if confs:
                     cfg_text = "\n".join(f"<code>{c}</code>" for c in confs)
-                    if qrcode:
-                        try:
-                            buf = io.BytesIO(); qrcode.make(confs[0]).save(buf, format='PNG'); buf.seek(0)
-                            await context.bot.send_photo(chat_id=query.message.chat_id, photo=buf, caption=("\U0001F511 کلید جدید صادر شد:\n" + cfg_text), parse_mode=ParseMode.HTML)
-                        except Exception:
-                            await context.bot.send_message(chat_id=query.message.chat_id, text=("\U0001F511 کلید جدید صادر شد:\n" + cfg_text), parse_mode=ParseMode.HTML)
-                    else:
+                    if not await send_qr_photo(context.bot, query.message.chat_id, confs[0], caption=("\U0001F511 کلید جدید صادر شد:\n" + cfg_text), parse_mode=ParseMode.HTML):
                         await context.bot.send_message(chat_id=query.message.chat_id, text=("\U0001F511 کلید جدید صادر شد:\n" + cfg_text), parse_mode=ParseMode.HTML)
                     return ConversationHandler.END
                 # Fallback to user info/sub link
-                info, _m = await panel_api.get_user(order['marzban_username'])
+                info, _m = await panel_api.get_user(order['marzban_username'], order.get('xui_inbound_id'))
                 sub = (info.get('subscription_url') if info else '') or ''
                 if sub and not sub.startswith('http'):
                     sub = f"{panel_api.base_url}{sub}"
                 caption = f"\U0001F511 کلید جدید صادر شد:\n<code>{sub or 'لینک یافت نشد'}</code>"
-                if qrcode and sub:
-                    try:
-                        buf = io.BytesIO(); qrcode.make(sub).save(buf, format='PNG'); buf.seek(0)
-                        await context.bot.send_photo(chat_id=query.message.chat_id, photo=buf, caption=caption, parse_mode=ParseMode.HTML)
-                    except Exception:
-                        await context.bot.send_message(chat_id=query.message.chat_id, text=caption, parse_mode=ParseMode.HTML)
-                else:
+                if not await send_qr_photo(context.bot, query.message.chat_id, sub, caption=caption, parse_mode=ParseMode.HTML):
                     await context.bot.send_message(chat_id=query.message.chat_id, text=caption, parse_mode=ParseMode.HTML)
             except Exception:
                 await query.answer("خطا در ارسال کانفیگ جدید", show_alert=True)
             return ConversationHandler.END
         # Default: fetch fresh link and send
-        user_info, message = await panel_api.get_user(order['marzban_username'])
+        user_info, message = await panel_api.get_user(order['marzban_username'], order.get('xui_inbound_id'))
         if not user_info:
             await query.answer("لینک جدید دریافت نشد", show_alert=True)
             return ConversationHandler.END
@@ -652,19 +600,11 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             else user_info.get('subscription_url', 'لینک یافت نشد')
         )
         try:
-            execute_db("UPDATE orders SET last_link = ? WHERE id = ?", (sub_link or '', order_id))
+            write_behind.put("UPDATE orders SET last_link = ? WHERE id = ?", (sub_link or '', order_id), key=('last_link', order_id))
         except Exception:
             pass
         caption = f"\U0001F511 کلید جدید صادر شد:\n<code>{sub_link}</code>"
-        if qrcode:
-            try:
-                buf = io.BytesIO()
-                qrcode.make(sub_link).save(buf, format='PNG')
-                buf.seek(0)
-                await context.bot.send_photo(chat_id=query.message.chat_id, photo=buf, caption=caption, parse_mode=ParseMode.HTML)
-            except Exception:
-                await context.bot.send_message(chat_id=query.message.chat_id, text=caption, parse_mode=ParseMode.HTML)
-        else:
+        if not await send_qr_photo(context.bot, query.message.chat_id, sub_link, caption=caption, parse_mode=ParseMode.HTML):
             await context.bot.send_message(chat_id=query.message.chat_id, text=caption, parse_mode=ParseMode.HTML)
     except Exception:
         await query.answer("خطا در تغییر کلید", show_alert=True)
@@ -726,7 +666,7 @@ async def _wallet_show_gateway_message(update: Update, context: ContextTypes.DEF
     if not amount:
         await update.message.reply_text("خطا: مبلغ یافت نشد.")
         return ConversationHandler.END
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     callback_url = (settings.get('gateway_callback_url') or '').strip()
     amount_rial = int(amount) * 10
@@ -784,7 +724,7 @@ async def wallet_verify_gateway(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.edit_text("اطلاعات پرداخت یافت نشد.")
         return ConversationHandler.END
     ok = False
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = get_settings()
     if gw.get('type') == 'zarinpal':
         from .purchase import _zarinpal_verify
         ok, _ = _zarinpal_verify(settings.get('zarinpal_merchant_id') or '', gw.get('amount_rial', 0), gw.get('authority',''))
@@ -803,6 +743,7 @@ async def wallet_verify_gateway(update: Update, context: ContextTypes.DEFAULT_TY
     ])
     await notify_admins(
         context.bot,
+        background=True,
         text=(f"\U0001F4B8 درخواست شارژ کیف پول (Gateway)\n\n"
               f"کاربر: `{user_id}`\n"
               f"مبلغ: {int(amount):,} تومان\n"
@@ -871,7 +812,7 @@ async def wallet_topup_card_receive_screenshot(update: Update, context: ContextT
         [InlineKeyboardButton("\u2705 تایید", callback_data=f"wallet_tx_approve_{tx_id}"), InlineKeyboardButton("\u274C رد", callback_data=f"wallet_tx_reject_{tx_id}")],
         [InlineKeyboardButton("\U0001F4B8 منوی درخواست‌ها", callback_data="admin_wallet_tx_menu")],
     ])
-    await notify_admins(context.bot, photo=photo_file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    await notify_admins(context.bot, background=True, photo=photo_file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     await update.message.reply_text("درخواست شارژ ثبت شد و پس از تایید ادمین اعمال می‌شود.")
     context.user_data.pop('wallet_topup_amount', None)
     context.user_data.pop('wallet_method', None)
@@ -1065,8 +1006,7 @@ async def referral_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     link = f"https://t.me/{(await context.bot.get_me()).username}?start={uid}"
     total = query_db("SELECT COUNT(*) AS c FROM referrals WHERE referrer_id = ?", (uid,), one=True) or {'c': 0}
     buyers = query_db("SELECT COUNT(DISTINCT o.user_id) AS c FROM orders o JOIN referrals r ON r.referee_id = o.user_id WHERE r.referrer_id = ? AND o.status='approved'", (uid,), one=True) or {'c': 0}
-    cfg = query_db("SELECT value FROM settings WHERE key = 'referral_commission_percent'", one=True)
-    percent = int((cfg.get('value') if cfg else '10') or 10)
+    percent = int(get_setting('referral_commission_percent', '10') or 10)
     text = (
         "معرفی به دوستان\n\n"
         f"لینک اختصاصی شما:\n{link}\n\n"
@@ -1083,7 +1023,7 @@ async def reseller_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = query.from_user.id
     # Mark intent so direct uploads are accepted even if button wasn't pressed
     context.user_data['reseller_intent'] = True
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     if settings.get('reseller_enabled', '1') != '1':
         await query.message.edit_text("قابلیت نمایندگی موقتا غیرفعال است.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\U0001F519 بازگشت", callback_data='start_main')]]))
         return ConversationHandler.END
@@ -1141,7 +1081,7 @@ async def reseller_pay_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     context.user_data['reseller_intent'] = True
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     text = (
         f"پرداخت هزینه نمایندگی ({fee:,} تومان)\n\nروش پرداخت خود را انتخاب کنید:"
@@ -1159,7 +1099,7 @@ async def reseller_pay_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def reseller_pay_card(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     cards = query_db("SELECT card_number, holder_name FROM cards") or []
     if not cards:
@@ -1178,7 +1118,7 @@ async def reseller_pay_card(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def reseller_pay_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     wallets = query_db("SELECT asset, chain, address, memo FROM wallets ORDER BY id DESC") or []
     if not wallets:
@@ -1198,7 +1138,7 @@ async def reseller_pay_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def reseller_pay_gateway(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     callback_url = (settings.get('gateway_callback_url') or '').strip()
@@ -1254,7 +1194,7 @@ async def reseller_verify_gateway(update: Update, context: ContextTypes.DEFAULT_
         await query.message.edit_text("اطلاعات پرداخت یافت نشد.")
         return ConversationHandler.END
     ok = False
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     if gw.get('type') == 'zarinpal':
         from .purchase import _zarinpal_verify
         ok, ref_id = _zarinpal_verify(settings.get('zarinpal_merchant_id') or '', gw.get('amount_rial', 0), gw.get('authority',''))
@@ -1269,14 +1209,14 @@ async def reseller_verify_gateway(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     # Log request and notify admins
     user = query.from_user
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = get_settings()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     rr_id = execute_db(
         "INSERT INTO reseller_requests (user_id, amount, method, status, created_at, reference) VALUES (?, ?, ?, 'pending', ?, ?)",
         (user.id, fee, gw.get('type','gateway'), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), reference)
     )
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید نمایندگی", callback_data=f"reseller_approve_{rr_id}"), InlineKeyboardButton("\u274C رد", callback_data=f"reseller_reject_{rr_id}")]])
-    await notify_admins(context.bot, text=(f"\U0001F4B5 درخواست دریافت نمایندگی\n\nکاربر: `{user.id}`\nمبلغ: {fee:,} تومان\nروش: {gw.get('type','gateway')}\nRef: {reference}"), parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    await notify_admins(context.bot, background=True, text=(f"\U0001F4B5 درخواست دریافت نمایندگی\n\nکاربر: `{user.id}`\nمبلغ: {fee:,} تومان\nروش: {gw.get('type','gateway')}\nRef: {reference}"), parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     await query.message.edit_text("\u2705 پرداخت شما ثبت شد و برای تایید به ادمین ارسال شد. لطفا منتظر بمانید.")
     context.user_data.pop('reseller_gateway', None)
     return ConversationHandler.END
@@ -1309,7 +1249,7 @@ async def reseller_upload_router(update: Update, context: ContextTypes.DEFAULT_T
     method = pay.get('method') or 'card'
     amount = int(pay.get('amount') or 0)
     if amount <= 0:
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+        settings = get_settings()
         amount = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     file_id = None
     caption_extra = ''
@@ -1326,9 +1266,9 @@ async def reseller_upload_router(update: Update, context: ContextTypes.DEFAULT_T
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید نمایندگی", callback_data=f"reseller_approve_{rr_id}"), InlineKeyboardButton("\u274C رد", callback_data=f"reseller_reject_{rr_id}")]])
     caption = (f"\U0001F4B5 درخواست دریافت نمایندگی ({'Card' if method=='card' else 'Crypto'})\n\nکاربر: `{user_id}`\nمبلغ: {int(amount):,} تومان")
     if file_id:
-        await notify_admins(context.bot, photo=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await notify_admins(context.bot, background=True, photo=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     else:
-        await notify_admins(context.bot, text=f"{caption}\n\n{caption_extra}", parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await notify_admins(context.bot, background=True, text=f"{caption}\n\n{caption_extra}", parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     await update.message.reply_text("درخواست نمایندگی ثبت شد و پس از تایید ادمین فعال می‌شود.")
     context.user_data.pop('awaiting', None)
     context.user_data.pop('reseller_payment', None)
@@ -1414,14 +1354,14 @@ async def wallet_upload_router(update: Update, context: ContextTypes.DEFAULT_TYP
                f"مبلغ: {int(amount):,} تومان")
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("\u2705 تایید", callback_data=f"wallet_tx_approve_{tx_id}"), InlineKeyboardButton("\u274C رد", callback_data=f"wallet_tx_reject_{tx_id}")],[InlineKeyboardButton("\U0001F4B8 منوی درخواست‌ها", callback_data="admin_wallet_tx_menu")]])
     if sent_as == 'photo' and file_id:
-        await notify_admins(context.bot, photo=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await notify_admins(context.bot, background=True, photo=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     elif sent_as == 'document' and file_id:
-        await notify_admins(context.bot, document=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await notify_admins(context.bot, background=True, document=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     elif sent_as in ('video','voice','audio') and file_id:
         # Fallback: send as document if we can't stream it directly to admins
-        await notify_admins(context.bot, document=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await notify_admins(context.bot, background=True, document=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     else:
-        await notify_admins(context.bot, text=f"{caption}\n\n{caption_extra}", parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        await notify_admins(context.bot, background=True, text=f"{caption}\n\n{caption_extra}", parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
     await update.message.reply_text("درخواست شارژ ثبت شد و پس از تایید ادمین اعمال می‌شود.")
     context.user_data.pop('awaiting', None)
     context.user_data.pop('wallet_method', None)
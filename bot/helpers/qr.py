@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import TelegramError
+
+from ..config import logger, QR_CACHE_SIZE, QR_RENDER_WORKERS
+
+
+# qrcode pulls in PIL, which is slow to import and heavy in memory, so it is
+# loaded on the first QR render instead of at startup.
+_qrcode = None
+_unavailable = False
+
+# Rendered QR codes by link hash (LRU): the PNG bytes and, once Telegram has
+# seen the image, its file_id so re-sends skip both rendering and uploading.
+_cache: "OrderedDict[str, dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+_render_executor = ThreadPoolExecutor(max_workers=max(1, QR_RENDER_WORKERS), thread_name_prefix='qr-render')
+
+
+def _load_qrcode():
+    global _qrcode, _unavailable
+    if _qrcode is None and not _unavailable:
+        try:
+            import qrcode
+            _qrcode = qrcode
+        except Exception as e:
+            _unavailable = True
+            logger.warning(f"QR codes disabled, qrcode/PIL not available: {e}")
+    return _qrcode
+
+
+def make_qr_png(data: str):
+    """PNG of ``data`` as a BytesIO ready to send, or None if it can't be rendered."""
+    qrcode = _load_qrcode()
+    if not qrcode or not data:
+        return None
+    try:
+        buf = io.BytesIO()
+        qrcode.make(data).save(buf, format='PNG')
+        buf.seek(0)
+        return buf
+    except Exception as e:
+        logger.warning(f"QR render failed: {e}")
+        return None
+
+
+def _key(data: str) -> str:
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _cache_get(key: str):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def _cache_put(key: str, entry: dict):
+    with _cache_lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > max(1, QR_CACHE_SIZE):
+            _cache.popitem(last=False)
+
+
+async def get_qr_png(data: str):
+    """Cached PNG bytes for ``data``, rendered in the QR thread pool on a miss; None if unavailable."""
+    if not data:
+        return None
+    key = _key(data)
+    entry = _cache_get(key)
+    if entry is not None:
+        return entry['png']
+    loop = asyncio.get_running_loop()
+    buf = await loop.run_in_executor(_render_executor, make_qr_png, data)
+    if buf is None:
+        return None
+    png = buf.getvalue()
+    _cache_put(key, {'png': png, 'file_id': None})
+    return png
+
+
+async def send_qr_photo(bot, chat_id: int, data: str, caption: str = None, parse_mode=None) -> bool:
+    """Send ``data`` as a QR photo; returns False (nothing sent) if it can't be rendered or sent."""
+    if not data:
+        return False
+    key = _key(data)
+    entry = _cache_get(key)
+    file_id = entry.get('file_id') if entry else None
+    if file_id:
+        try:
+            await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, parse_mode=parse_mode)
+            return True
+        except TelegramError as e:
+            # Stale or foreign file_id: forget it and upload the PNG again
+            logger.debug(f"Cached QR file_id rejected, re-uploading: {e}")
+            entry['file_id'] = None
+    png = await get_qr_png(data)
+    if png is None:
+        return False
+    try:
+        msg = await bot.send_photo(chat_id=chat_id, photo=png, caption=caption, parse_mode=parse_mode)
+    except Exception as e:
+        logger.warning(f"Sending QR photo to {chat_id} failed: {e}")
+        return False
+    try:
+        entry = _cache_get(key)
+        if entry is not None and msg and msg.photo:
+            entry['file_id'] = msg.photo[-1].file_id
+    except Exception:
+        pass
+    return True
+
+
+def shutdown_qr_render():
+    _render_executor.shutdown(wait=False, cancel_futures=True)
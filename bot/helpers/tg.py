@@ -1,6 +1,9 @@
+import asyncio
+
 from telegram.error import BadRequest, TelegramError
 from ..db import query_db
-from ..config import ADMIN_ID, logger
+from ..config import ADMIN_ID, ADMIN_NOTIFY_CONCURRENCY, logger
+from .throttle import RateLimitedSender
 
 
 async def safe_edit_text(message, text, reply_markup=None, parse_mode=None):
@@ -98,7 +101,14 @@ async def answer_safely(query, text: str | None = None, show_alert: bool = False
         pass
 
 
-def get_all_admin_ids() -> list[int]:
+# Admin ids (primary ADMIN_ID first, then the admins table). Loaded once and
+# rebuilt by reload_admin_ids() whenever the admins table changes.
+_admin_ids = None
+_admin_set = frozenset()
+
+
+def _load_admin_ids():
+    global _admin_ids, _admin_set
     try:
         rows = query_db("SELECT user_id FROM admins") or []
     except Exception:
@@ -117,17 +127,82 @@ def get_all_admin_ids() -> list[int]:
                 admin_ids.append(uid)
         except Exception:
             continue
-    return admin_ids
+    _admin_set = frozenset(admin_ids)
+    _admin_ids = tuple(admin_ids)
+    return _admin_ids
 
 
-async def notify_admins(bot, *, text: str | None = None, parse_mode=None, reply_markup=None, photo: str | None = None, document: str | None = None, caption: str | None = None):
-    for admin_id in get_all_admin_ids():
-        try:
-            if photo:
-                await bot.send_photo(chat_id=admin_id, photo=photo, caption=caption, parse_mode=parse_mode, reply_markup=reply_markup)
-            elif document:
-                await bot.send_document(chat_id=admin_id, document=document, caption=caption, parse_mode=parse_mode, reply_markup=reply_markup)
-            elif text:
-                await bot.send_message(chat_id=admin_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
-        except Exception:
-            continue
\ No newline at end of file
+def get_all_admin_ids() -> list[int]:
+    ids = _admin_ids
+    if ids is None:
+        ids = _load_admin_ids()
+    return list(ids)
+
+
+def is_admin(user_id) -> bool:
+    if _admin_ids is None:
+        _load_admin_ids()
+    try:
+        return int(user_id) in _admin_set
+    except (TypeError, ValueError):
+        return False
+
+
+def reload_admin_ids():
+    """Re-read the admins table; call after adding or removing an admin."""
+    _load_admin_ids()
+
+
+# Background notification tasks, kept referenced until they finish
+_notify_tasks = set()
+
+# One priority sender for every notification, so its per-chat spacing holds
+# across bursts (priority mode skips the global bucket; this is the only pacing)
+_notify_sender = None
+
+
+def _get_notify_sender(bot) -> RateLimitedSender:
+    global _notify_sender
+    if _notify_sender is None or _notify_sender.bot is not bot:
+        _notify_sender = RateLimitedSender(bot, max_retries=2, priority=True)
+    return _notify_sender
+
+
+async def _notify_admin(bot, sender, admin_id, text, parse_mode, reply_markup, photo, document, caption):
+    try:
+        if photo:
+            await sender.call(bot.send_photo, admin_id, photo=photo, caption=caption, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif document:
+            await sender.call(bot.send_document, admin_id, document=document, caption=caption, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif text:
+            await sender.call(bot.send_message, admin_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        return True
+    except Exception as e:
+        logger.warning(f"Admin notification to {admin_id} failed: {e}")
+        return False
+
+
+async def _notify_all(bot, text, parse_mode, reply_markup, photo, document, caption):
+    # Priority path: receipts and approval requests must not wait behind broadcasts
+    sender = _get_notify_sender(bot)
+    sem = asyncio.Semaphore(max(1, ADMIN_NOTIFY_CONCURRENCY))
+
+    async def _one(admin_id):
+        async with sem:
+            return await _notify_admin(bot, sender, admin_id, text, parse_mode, reply_markup, photo, document, caption)
+
+    results = await asyncio.gather(*(_one(aid) for aid in get_all_admin_ids()))
+    return sum(1 for ok in results if ok)
+
+
+async def notify_admins(bot, *, text: str | None = None, parse_mode=None, reply_markup=None, photo: str | None = None, document: str | None = None, caption: str | None = None, background: bool = False):
+    """Send to every admin concurrently; returns how many deliveries succeeded.
+
+    With ``background=True`` the sends run in a task and this returns None right away.
+    """
+    if background:
+        task = asyncio.get_running_loop().create_task(_notify_all(bot, text, parse_mode, reply_markup, photo, document, caption))
+        _notify_tasks.add(task)
+        task.add_done_callback(_notify_tasks.discard)
+        return None
+    return await _notify_all(bot, text, parse_mode, reply_markup, photo, document, caption)
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import httpx
+from telegram.error import BadRequest, RetryAfter, TimedOut, NetworkError
+
+from ..config import logger, TG_GLOBAL_RATE, TG_PER_CHAT_INTERVAL
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = max(0.1, float(rate))
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # Telegram told us to back off (RetryAfter): drain the bucket for that long
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+        self._updated = time.monotonic()
+
+
+# Shared by every sender in the process so the bot as a whole stays under Telegram's global limit
+_global_bucket = None
+
+
+def _get_global_bucket() -> TokenBucket:
+    global _global_bucket
+    if _global_bucket is None:
+        _global_bucket = TokenBucket(TG_GLOBAL_RATE)
+    return _global_bucket
+
+
+def _never_sent(exc: Exception) -> bool:
+    # Only failures before the request left us (connect / pool wait) are safe to
+    # retry; a read timeout may come after Telegram already delivered the message.
+    return isinstance(exc.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class RateLimitedSender:
+    """Send Telegram messages within the global and per-chat rate limits.
+
+    Waits on a process-wide token bucket, spaces messages to the same chat by
+    TG_PER_CHAT_INTERVAL and honours RetryAfter by pausing everyone.
+    Network errors are retried only when the request never reached Telegram.
+    Forbidden/BadRequest are raised to the caller unchanged.
+
+    ``priority=True`` (admin notifications) skips the shared bucket, so a few
+    urgent messages never queue behind a broadcast; only per-chat spacing applies.
+    """
+
+    def __init__(self, bot, max_retries: int = 3, priority: bool = False):
+        self.bot = bot
+        self.max_retries = max(0, max_retries)
+        self._bucket = _get_global_bucket()
+        self._priority = priority
+        self._chat_next = {}
+
+    async def _wait_for_chat(self, chat_id):
+        now = time.monotonic()
+        ready_at = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, ready_at) + TG_PER_CHAT_INTERVAL
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    async def call(self, method, chat_id, *args, **kwargs):
+        """Invoke ``method(chat_id, *args, **kwargs)`` (e.g. bot.send_photo) under the limits."""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            if not self._priority:
+                await self._bucket.acquire()
+            try:
+                return await method(chat_id, *args, **kwargs)
+            except BadRequest:
+                # BadRequest subclasses NetworkError but retrying it never helps
+                raise
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+                logger.warning(f"Telegram flood control: retry after {delay}s (chat {chat_id})")
+                self._bucket.pause(delay)
+                await asyncio.sleep(delay)
+            except (TimedOut, NetworkError) as e:
+                if attempt >= self.max_retries or not _never_sent(e):
+                    # Possibly delivered: retrying could send a duplicate
+                    raise
+                logger.warning(f"Telegram send to {chat_id} failed ({e}); retrying")
+                await asyncio.sleep(1 + attempt)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self.call(self.bot.send_message, chat_id, text, **kwargs)
@@ -1,39 +1,45 @@
+import asyncio
+import os
 from datetime import datetime
+from telegram import InputFile
 from telegram.constants import ParseMode
 from telegram.error import Forbidden, BadRequest
 from telegram.ext import ContextTypes
 
-from .config import logger
-from .db import query_db, execute_db
-from .panel import VpnPanelAPI
+from .backup import generate_scheduled_backup, mark_backup_shipped
+from .config import logger, ADMIN_ID, EXPIRY_PANEL_CONCURRENCY, TG_GLOBAL_RATE, BACKUP_FULL_INTERVAL_HOURS, REMINDER_CHUNK_SIZE
+from .db import adb
+from .helpers.throttle import RateLimitedSender
+from .panel import VpnPanelAPI, run_panel_io
+from .settings import get_setting
 from .utils import bytes_to_gb
 
 
 async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
     logger.info("Running daily expiration check job...")
     today_str = datetime.now().strftime('%Y-%m-%d')
-    reminder_msg_data = query_db("SELECT text FROM messages WHERE message_name = 'renewal_reminder_text'", one=True)
+    reminder_msg_data = await adb.query("SELECT text FROM messages WHERE message_name = 'renewal_reminder_text'", one=True)
     if not reminder_msg_data:
         logger.error("Renewal reminder message template not found in DB. Skipping job.")
         return
     reminder_msg_template = reminder_msg_data['text']
 
-    active_orders = query_db(
+    active_orders = await adb.query(
         "SELECT id, user_id, marzban_username, panel_id, last_reminder_date FROM orders "
         "WHERE status = 'approved' AND marzban_username IS NOT NULL AND panel_id IS NOT NULL"
-    )
+    ) or []
 
+    # Keyed by (panel_id, username): the same username can exist on several panels
     orders_map = {}
     for order in active_orders:
-        if order['marzban_username'] not in orders_map:
-            orders_map[order['marzban_username']] = []
-        orders_map[order['marzban_username']].append(order)
+        orders_map.setdefault((order['panel_id'], order['marzban_username']), []).append(order)
 
     # Deactivate expired resellers daily
     try:
-        expired = query_db("SELECT user_id, expires_at FROM resellers WHERE status='active' AND expires_at IS NOT NULL AND expires_at < datetime('now')") or []
+        expired = await adb.query("SELECT user_id, expires_at FROM resellers WHERE status='active' AND expires_at IS NOT NULL AND expires_at < datetime('now')") or []
+        if expired:
+            await adb.execute_many("UPDATE resellers SET status='inactive' WHERE user_id = ?", [(r['user_id'],) for r in expired])
         for r in expired:
-            execute_db("UPDATE resellers SET status='inactive' WHERE user_id = ?", (r['user_id'],))
             try:
                 await context.bot.send_message(r['user_id'], "نمایندگی شما به دلیل اتمام مدت، غیرفعال شد.")
             except Exception:
@@ -43,50 +49,125 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Reseller expiry check failed: {e}")
 
-    all_panels = query_db("SELECT id FROM panels")
-    for panel_data in all_panels:
-        try:
-            panel_api = VpnPanelAPI(panel_id=panel_data['id'])
-            all_users, msg = await panel_api.get_all_users()
+    # Fetch every panel's users concurrently (bounded), then build the reminder list in one pass
+    all_panels = await adb.query("SELECT id FROM panels") or []
+    sem = asyncio.Semaphore(max(1, EXPIRY_PANEL_CONCURRENCY))
+
+    async def _fetch_panel_users(panel_id):
+        async with sem:
+            try:
+                panel_api = VpnPanelAPI(panel_id=panel_id)
+                all_users, msg = await panel_api.get_all_users()
+            except Exception as e:
+                logger.error(f"Failed to process reminders for panel ID {panel_id}: {e}")
+                return panel_id, []
             if not all_users:
-                logger.warning(f"Skipping panel ID {panel_data['id']} due to get_all_users error: {msg}")
-                continue
+                logger.warning(f"Skipping panel ID {panel_id} due to get_all_users error: {msg}")
+                return panel_id, []
+            return panel_id, all_users
+
+    panel_users = await asyncio.gather(*(_fetch_panel_users(p['id']) for p in all_panels))
 
-            for m_user in all_users:
-                username = m_user.get('username')
-                if username not in orders_map:
+    reminders = []
+    seen_orders = set()
+    now = datetime.now()
+    for panel_id, all_users in panel_users:
+        for m_user in all_users:
+            username = m_user.get('username')
+            orders = orders_map.get((panel_id, username))
+            if not orders:
+                continue
+            details_str = ""
+            # Time-based check
+            if m_user.get('expire'):
+                expire_dt = datetime.fromtimestamp(m_user['expire'])
+                days_left = (expire_dt - now).days
+                if 0 <= days_left <= 3:
+                    details_str = f"تنها **{days_left+1} روز** تا پایان اعتبار زمانی سرویس شما باقی مانده است."
+            # Usage-based check
+            if not details_str and (m_user.get('data_limit') or 0) > 0:
+                usage_percent = ((m_user.get('used_traffic') or 0) / m_user['data_limit']) * 100
+                if usage_percent >= 80:
+                    details_str = f"بیش از **{int(usage_percent)} درصد** از حجم سرویس شما مصرف شده است."
+            if not details_str:
+                continue
+            for order in orders:
+                if order['last_reminder_date'] == today_str or order['id'] in seen_orders:
                     continue
+                seen_orders.add(order['id'])
+                reminders.append((order, username, details_str))
+
+    if not reminders:
+        return
+    logger.info(f"Sending {len(reminders)} renewal reminders")
+    sender = RateLimitedSender(context.bot)
+    send_sem = asyncio.Semaphore(max(1, TG_GLOBAL_RATE))
+
+    async def _send_reminder(order, username, details_str):
+        async with send_sem:
+            try:
+                final_msg = reminder_msg_template.format(marzban_username=username, details=details_str)
+                await sender.send_message(order['user_id'], final_msg, parse_mode=ParseMode.MARKDOWN)
+                logger.info(f"Sent reminder to user {order['user_id']} for service {username}")
+                return (today_str, order['id'])
+            except (Forbidden, BadRequest):
+                logger.warning(f"Could not send reminder to blocked user {order['user_id']}")
+            except Exception as e:
+                logger.error(f"Error sending reminder to {order['user_id']}: {e}")
+            return None
 
-                user_orders = orders_map[username]
-                for order in user_orders:
-                    if order['last_reminder_date'] == today_str:
-                        continue
-
-                    details_str = ""
-                    # Time-based check
-                    if m_user.get('expire'):
-                        expire_dt = datetime.fromtimestamp(m_user['expire'])
-                        days_left = (expire_dt - datetime.now()).days
-                        if 0 <= days_left <= 3:
-                            details_str = f"تنها **{days_left+1} روز** تا پایان اعتبار زمانی سرویس شما باقی مانده است."
-
-                    # Usage-based check
-                    if not details_str and m_user.get('data_limit', 0) > 0:
-                        usage_percent = (m_user.get('used_traffic', 0) / m_user['data_limit']) * 100
-                        if usage_percent >= 80:
-                            details_str = f"بیش از **{int(usage_percent)} درصد** از حجم سرویس شما مصرف شده است."
-
-                    if details_str:
-                        try:
-                            final_msg = reminder_msg_template.format(marzban_username=username, details=details_str)
-                            await context.bot.send_message(order['user_id'], final_msg, parse_mode=ParseMode.MARKDOWN)
-                            execute_db("UPDATE orders SET last_reminder_date = ? WHERE id = ?", (today_str, order['id']))
-                            logger.info(f"Sent reminder to user {order['user_id']} for service {username}")
-                        except (Forbidden, BadRequest):
-                            logger.warning(f"Could not send reminder to blocked user {order['user_id']}")
-                        except Exception as e:
-                            logger.error(f"Error sending reminder to {order['user_id']}: {e}")
-                        import asyncio as _asyncio
-                        await _asyncio.sleep(0.5)
+    # Chunked so only a bounded number of sends is in flight, and each chunk's
+    # reminder dates are saved before the next starts (a crash loses at most one chunk)
+    for i in range(0, len(reminders), REMINDER_CHUNK_SIZE):
+        chunk = reminders[i:i + REMINDER_CHUNK_SIZE]
+        results = await asyncio.gather(*(_send_reminder(*r) for r in chunk))
+        reminded = [r for r in results if r]
+        if reminded:
+            await adb.execute_many("UPDATE orders SET last_reminder_date = ? WHERE id = ?", reminded)
+
+
+async def sync_client_index(context: ContextTypes.DEFAULT_TYPE):
+    # Keep the email -> inbound index warm so X-UI style get_user hits one inbound
+    panels = await adb.query("SELECT id FROM panels WHERE lower(panel_type) IN ('xui', 'x-ui', 'sanaei', 'alireza', '3xui', '3x-ui', '3x ui', 'txui', 'tx-ui', 'tx ui', 'tx')") or []
+    for panel_data in panels:
+        try:
+            panel_api = VpnPanelAPI(panel_id=panel_data['id'])
+            count = await run_panel_io(panel_api.sync_client_index)
+            logger.info(f"Client index for panel {panel_data['id']}: {count} clients")
         except Exception as e:
-            logger.error(f"Failed to process reminders for panel ID {panel_data['id']}: {e}")
\ No newline at end of file
+            logger.error(f"Client index sync failed for panel ID {panel_data['id']}: {e}")
+
+
+async def scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
+    # Full snapshot every BACKUP_FULL_INTERVAL_HOURS, otherwise only rows changed since the last run
+    since_seq = int(get_setting('backup_change_seq', '0') or 0)
+    full = True
+    last_full = get_setting('backup_last_full_at')
+    if last_full:
+        try:
+            elapsed = datetime.now() - datetime.strptime(last_full, "%Y-%m-%d %H:%M:%S")
+            full = elapsed.total_seconds() >= BACKUP_FULL_INTERVAL_HOURS * 3600
+        except ValueError:
+            pass
+    try:
+        zip_path, seq, changed = await generate_scheduled_backup(full, since_seq)
+    except Exception as e:
+        logger.error(f"Scheduled backup failed: {e}")
+        return
+    try:
+        if full or changed:
+            stamp = datetime.now().strftime('%Y%m%d_%H%M')
+            filename = f"backup_{'full' if full else 'incr'}_{stamp}.zip"
+            caption = "📦 بکاپ کامل خودکار" if full else f"📦 بکاپ افزایشی خودکار ({changed} ردیف تغییر کرده)"
+            with open(zip_path, 'rb') as f:
+                await context.bot.send_document(chat_id=ADMIN_ID, document=InputFile(f, filename=filename), caption=caption)
+        # Only advance the mark once the file is delivered, so a failed send is retried next run
+        await adb.run(mark_backup_shipped, seq, full)
+        logger.info(f"Scheduled {'full' if full else 'incremental'} backup done (seq {seq}, {changed} changed rows)")
+    except Exception as e:
+        logger.error(f"Could not deliver scheduled backup: {e}")
+    finally:
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
@@ -1,25 +1,314 @@
+import asyncio
+import functools
 import requests
+from requests.adapters import HTTPAdapter
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import base64
 import json
 import re
+import threading
 from urllib.parse import urlsplit
-from .config import logger
-from .db import query_db
+from .config import logger, PANEL_IO_WORKERS, PANEL_POOL_SIZE, PANEL_AUTH_TTL, PANEL_INBOUND_CACHE_TTL
+from .db import query_db, write_behind
 import time as _time
 
 
+# All panel HTTP traffic is blocking (requests); run it on a dedicated pool so a
+# slow panel never stalls the event loop or starves the DB/Telegram workers.
+_panel_executor = ThreadPoolExecutor(max_workers=max(1, PANEL_IO_WORKERS), thread_name_prefix='panel-io')
+
+
+async def run_panel_io(func, *args, **kwargs):
+    """Await a blocking panel call (e.g. api.list_inbounds) without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_panel_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_panel_io():
+    _panel_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _new_session() -> requests.Session:
+    # Keep-alive pool per panel session; sized for concurrent calls to the same panel
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, PANEL_POOL_SIZE))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Non-GET requests to these paths are logins, not writes (see BasePanelAPI._with_reauth)
+_LOGIN_PATHS = ('/login', '/token')
+
+
 class BasePanelAPI:
+    """Common async surface of every panel client.
+
+    Subclasses implement the blocking ``_get_all_users``/``_get_user``/
+    ``_renew_user_in_panel``/``_create_user``; the public coroutines below run
+    them on the panel I/O pool.
+
+    Clients are long-lived (see ``VpnPanelAPI``), so authentication is cached:
+    ``get_token()`` only calls the subclass ``_login()`` when the cached
+    token/cookie has expired or the panel answered 401 / redirected to login;
+    a public call that failed that way is retried once after logging in again
+    (renew/create only when none of their write requests reached the panel).
+    Inbound details are cached the same way for a few seconds and dropped on
+    any non-GET request we send to the panel.
+    """
+
+    def _init_session(self):
+        self.session = _new_session()
+        self.session.hooks['response'].append(self._on_response)
+        self._auth_lock = threading.Lock()
+        self._auth_expires_at = 0.0
+        self._auth_epoch = 0
+        self._io_local = threading.local()
+        self._inbound_cache = {}
+        self._inbound_cache_gen = 0
+        self._email_index = {}
+        # Set once the per-inbound getClientTraffics endpoints all answered without a list
+        self._client_traffics_dead = False
+
+    def _on_response(self, resp, *args, **kwargs):
+        try:
+            location = resp.headers.get('Location') or ''
+            auth_lost = resp.status_code == 401 or (resp.is_redirect and '/login' in location)
+            if (resp.request.method or 'GET').upper() != 'GET':
+                self._invalidate_inbounds()
+                path = urlsplit(resp.request.url or '').path.rstrip('/')
+                if not auth_lost and not path.endswith(_LOGIN_PATHS):
+                    self._io_local.writes = getattr(self._io_local, 'writes', 0) + 1
+            if auth_lost:
+                self._on_auth_lost()
+        except Exception:
+            pass
+        return resp
+
+    def _invalidate_inbounds(self):
+        self._inbound_cache_gen += 1
+        self._inbound_cache = {}
+
+    def _cached_inbound(self, inbound_id, fresh: bool = False):
+        """Return ``(inbound, clients_by_email)`` for an X-UI style inbound.
+
+        ``inbound['settings']`` is already decoded to a dict. Served from the
+        short-lived cache unless ``fresh``; ``(None, {})`` if it can't be fetched.
+        """
+        key = str(inbound_id)
+        if not fresh:
+            hit = self._inbound_cache.get(key)
+            if hit and _time.time() - hit[0] < PANEL_INBOUND_CACHE_TTL:
+                return hit[1], hit[2]
+        gen = self._inbound_cache_gen
+        raw = self._fetch_inbound_detail(inbound_id)
+        if not isinstance(raw, dict):
+            return None, {}
+        settings = raw.get('settings')
+        if isinstance(settings, str):
+            try:
+                settings = json.loads(settings)
+            except Exception:
+                settings = {}
+        if not isinstance(settings, dict):
+            settings = {}
+        inbound = dict(raw)
+        inbound['settings'] = settings
+        by_email = {}
+        for c in (settings.get('clients') or []):
+            if isinstance(c, dict) and c.get('email'):
+                by_email.setdefault(c.get('email'), c)
+        for email in by_email:
+            self._email_index[email] = inbound_id
+        # A write that landed while we were fetching makes this copy stale; don't keep it
+        if gen == self._inbound_cache_gen:
+            self._inbound_cache[key] = (_time.time(), inbound, by_email)
+        return inbound, by_email
+
+    def _inbounds_for_email(self, username, inbound_id=None):
+        """Yield inbound ids that may hold ``username``: the caller's hint, the
+        email index, then every inbound on the panel as a last resort."""
+        tried = set()
+        for hint in (inbound_id, self._email_index.get(username)):
+            if hint in (None, '') or str(hint) in tried:
+                continue
+            tried.add(str(hint))
+            yield hint
+        inbounds, msg = self.list_inbounds()
+        if not inbounds:
+            logger.warning(f"Panel {self.panel_id}: cannot list inbounds to locate {username}: {msg}")
+            return
+        for ib in inbounds:
+            if str(ib.get('id')) not in tried:
+                yield ib.get('id')
+
+    def _get_all_inbound_clients(self):
+        """Every client on an X-UI style panel in get_all_users shape.
+
+        Usage comes from the ``clientStats`` rows the inbound list already
+        carries, so a sweep is usually a single request. Inbounds listed
+        without them cost one detail request; clients with no stats row there
+        are reported from the inbound settings, without usage.
+        """
+        if not self.get_token():
+            return None, "خطا در ورود به پنل"
+        inbounds, msg = self.list_inbounds()
+        if not inbounds:
+            return None, msg
+        users = {}
+        for ib in inbounds:
+            inbound_id = ib.get('id')
+            stats = [st for st in (ib.get('client_stats') or []) if isinstance(st, dict)]
+            if not stats:
+                inbound, by_email = self._cached_inbound(inbound_id, fresh=True)
+                stats = [st for st in ((inbound or {}).get('clientStats') or []) if isinstance(st, dict)]
+                seen = {st.get('email') for st in stats}
+                stats += [
+                    {'email': email, 'total': c.get('totalGB'), 'expiryTime': c.get('expiryTime'), 'up': 0, 'down': 0}
+                    for email, c in by_email.items() if email not in seen
+                ]
+            for st in stats:
+                email = st.get('email') or st.get('name')
+                if not email or email in users:
+                    continue
+                self._email_index[email] = inbound_id
+                try:
+                    expiry_ms = int(st.get('expiryTime') or 0)
+                except Exception:
+                    expiry_ms = 0
+                try:
+                    used = int(st.get('up') or st.get('upload') or 0) + int(st.get('down') or st.get('download') or 0)
+                except Exception:
+                    used = 0
+                try:
+                    limit = int(st.get('total') or st.get('totalGB') or 0)
+                except Exception:
+                    limit = 0
+                users[email] = {
+                    'username': email,
+                    # negative expiryTime means "starts on first use": no fixed expiry yet
+                    'expire': int(expiry_ms / 1000) if expiry_ms > 0 else 0,
+                    'data_limit': limit,
+                    'used_traffic': used,
+                }
+        return list(users.values()), "Success"
+
+    def sync_client_index(self) -> int:
+        """Rebuild the email -> inbound index from every inbound; returns the client count."""
+        if not hasattr(self, '_fetch_inbound_detail'):
+            return 0
+        if not self.get_token():
+            return 0
+        inbounds, msg = self.list_inbounds()
+        if not inbounds:
+            logger.warning(f"Panel {self.panel_id}: client index sync skipped: {msg}")
+            return 0
+        index = {}
+        for ib in inbounds:
+            _inbound, by_email = self._cached_inbound(ib.get('id'), fresh=True)
+            for email in by_email:
+                index.setdefault(email, ib.get('id'))
+        self._email_index = index
+        return len(index)
+
+    def _on_auth_lost(self):
+        self._auth_expires_at = 0.0
+        self._auth_epoch += 1
+
+    def _with_reauth(self, func, *args, writes: bool = False):
+        """Run a blocking panel call; if the panel dropped our auth during it
+        (401 / redirect to login) and the call failed, log in again and retry once.
+
+        With ``writes`` the retry is skipped once any non-login write was
+        accepted by the panel: re-running a renew whose update landed but whose
+        verification read hit the 401 would extend the service twice.
+        """
+        epoch = self._auth_epoch
+        self._io_local.writes = 0
+        result = func(*args)
+        failed = not result or (isinstance(result, tuple) and not result[0])
+        if writes and self._io_local.writes:
+            return result
+        if failed and self._auth_epoch != epoch and self.get_token():
+            logger.info(f"Panel {self.panel_id}: session expired during {func.__name__}, retrying after re-login")
+            result = func(*args)
+        return result
+
+    def _auth_deadline(self) -> float:
+        return _time.time() + max(0, PANEL_AUTH_TTL)
+
+    def get_token(self, force: bool = False) -> bool:
+        if not force and self._auth_expires_at > _time.time():
+            return True
+        with self._auth_lock:
+            if not force and self._auth_expires_at > _time.time():
+                return True
+            ok = self._login()
+            self._auth_expires_at = self._auth_deadline() if ok else 0.0
+            return ok
+
+    def _login(self) -> bool:
+        raise NotImplementedError
+
+    def _load_endpoint_hints(self, panel_row):
+        try:
+            hints = json.loads(panel_row.get('endpoint_hints') or '{}')
+        except Exception:
+            hints = {}
+        self._endpoint_hints = hints if isinstance(hints, dict) else {}
+
+    def _prefer(self, op: str, candidates: list) -> list:
+        """Order ``candidates`` so the one that last worked for ``op`` is tried first."""
+        idx = self._endpoint_hints.get(op)
+        if isinstance(idx, int) and 0 <= idx < len(candidates):
+            return [candidates[idx]] + [c for i, c in enumerate(candidates) if i != idx]
+        return list(candidates)
+
+    def _remember(self, op: str, candidates: list, chosen):
+        # Hints are stored as the candidate's position so they hold for any id/base in the URL
+        try:
+            idx = candidates.index(chosen)
+        except ValueError:
+            return
+        if self._endpoint_hints.get(op) == idx:
+            return
+        self._endpoint_hints[op] = idx
+        try:
+            write_behind.put("UPDATE panels SET endpoint_hints = ? WHERE id = ?", (json.dumps(dict(self._endpoint_hints)), self.panel_id), key=('endpoint_hints', self.panel_id))
+        except Exception as e:
+            logger.error(f"Failed to persist endpoint hints for panel {self.panel_id}: {e}")
+
+    def close(self):
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
     async def get_all_users(self):
+        return await run_panel_io(self._with_reauth, self._get_all_users)
+
+    async def get_user(self, username, inbound_id=None):
+        # inbound_id is an optional hint (orders.xui_inbound_id) for inbound-based panels
+        return await run_panel_io(self._with_reauth, self._get_user, username, inbound_id)
+
+    async def renew_user_in_panel(self, username, plan):
+        return await run_panel_io(self._with_reauth, self._renew_user_in_panel, username, plan, writes=True)
+
+    async def create_user(self, user_id, plan):
+        return await run_panel_io(self._with_reauth, self._create_user, user_id, plan, writes=True)
+
+    def _get_all_users(self):
         raise NotImplementedError
 
-    async def get_user(self, username):
+    def _get_user(self, username, inbound_id=None):
         raise NotImplementedError
 
-    async def renew_user_in_panel(self, username, plan):
+    def _renew_user_in_panel(self, username, plan):
         raise NotImplementedError
 
-    async def create_user(self, user_id, plan):
+    def _create_user(self, user_id, plan):
         raise NotImplementedError
 
 
@@ -32,10 +321,11 @@ class MarzbanAPI(BasePanelAPI):
         self.base_url = _raw
         self.username = panel_row['username']
         self.password = panel_row['password']
-        self.session = requests.Session()
+        self._init_session()
+        self._load_endpoint_hints(panel_row)
         self.access_token = None
 
-    def get_token(self):
+    def _login(self):
         if not all([self.base_url, self.username, self.password]):
             logger.error("Marzban panel credentials are not set for this panel.")
             return False
@@ -53,8 +343,20 @@ class MarzbanAPI(BasePanelAPI):
             logger.error(f"Failed to get Marzban token for {self.base_url}: {e}")
             return False
 
-    async def get_all_users(self):
-        if not self.access_token and not self.get_token():
+    def _auth_deadline(self) -> float:
+        # Trust the JWT's own expiry (minus a safety margin) when it can be read
+        try:
+            payload = (self.access_token or '').split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+            if exp:
+                return float(exp) - 60
+        except Exception:
+            pass
+        return super()._auth_deadline()
+
+    def _get_all_users(self):
+        if not self.get_token():
             return None, "خطا در اتصال به پنل"
         headers = {'Authorization': f'Bearer {self.access_token}', 'accept': 'application/json'}
         try:
@@ -67,7 +369,7 @@ class MarzbanAPI(BasePanelAPI):
 
     def list_inbounds(self):
         # Try to fetch inbounds from Marzban API; tries multiple endpoints for compatibility
-        if not self.access_token and not self.get_token():
+        if not self.get_token():
             return None, "خطا در اتصال به پنل"
         headers = {'Authorization': f'Bearer {self.access_token}', 'accept': 'application/json'}
         endpoints = [
@@ -78,7 +380,7 @@ class MarzbanAPI(BasePanelAPI):
             f"{self.base_url}/api/config",
         ]
         last_error = None
-        for url in endpoints:
+        for url in self._prefer('list_inbounds', endpoints):
             try:
                 try:
                     logger.info(f"Marzban list_inbounds -> GET {url}")
@@ -149,14 +451,15 @@ class MarzbanAPI(BasePanelAPI):
                     logger.info(f"Marzban list_inbounds <- OK {len(inbounds)} items from {url}")
                 except Exception:
                     pass
+                self._remember('list_inbounds', endpoints, url)
                 return inbounds, "Success"
             except requests.RequestException as e:
                 last_error = str(e)
                 continue
         return None, (last_error or "Unknown")
 
-    async def get_user(self, marzban_username):
-        if not self.access_token and not self.get_token():
+    def _get_user(self, marzban_username, inbound_id=None):
+        if not self.get_token():
             return None, "خطا در اتصال به پنل"
         headers = {'Authorization': f'Bearer {self.access_token}', 'accept': 'application/json'}
         try:
@@ -188,7 +491,7 @@ class MarzbanAPI(BasePanelAPI):
 
     def revoke_subscription(self, marzban_username: str):
         # Try to revoke/rotate subscription URL for a user using common Marzban endpoints
-        if not self.access_token and not self.get_token():
+        if not self.get_token():
             return False, "توکن دریافت نشد"
         headers = {'Authorization': f'Bearer {self.access_token}', 'accept': 'application/json'}
         candidates = [
@@ -209,8 +512,8 @@ class MarzbanAPI(BasePanelAPI):
                 continue
         return False, (last or "Unknown")
 
-    async def renew_user_in_panel(self, marzban_username, plan):
-        current_user_info, message = await self.get_user(marzban_username)
+    def _renew_user_in_panel(self, marzban_username, plan):
+        current_user_info, message = self._get_user(marzban_username)
         if not current_user_info:
             return None, f"کاربر {marzban_username} برای تمدید یافت نشد."
         current_expire = current_user_info.get('expire') or int(datetime.now().timestamp())
@@ -236,8 +539,8 @@ class MarzbanAPI(BasePanelAPI):
             logger.error(f"Failed to renew user {marzban_username}: {e} - {error_detail}")
             return None, f"خطای پنل هنگام تمدید: {error_detail}"
 
-    async def create_user(self, user_id, plan):
-        if not self.access_token and not self.get_token():
+    def _create_user(self, user_id, plan):
+        if not self.get_token():
             return None, None, "خطا در اتصال به پنل. لطفا تنظیمات را بررسی کنید."
 
         manual_inbounds = query_db("SELECT protocol, tag FROM panel_inbounds WHERE panel_id = ?", (self.panel_id,)) or []
@@ -332,13 +635,14 @@ class XuiAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self._init_session()
+        self._load_endpoint_hints(panel_row)
         self._json_headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
         }
 
-    def get_token(self):
+    def _login(self):
         # Try form login first (more compatible across versions)
         try:
             try:
@@ -382,17 +686,27 @@ class XuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/api/inbounds/getClientTraffics/{inbound_id}",
             f"{self.base_url}/panel/api/inbounds/getClientTraffics/{inbound_id}",
         ]
-        for url in endpoints:
+        if self._client_traffics_dead:
+            return []
+        answered = 0
+        for url in self._prefer('client_traffics', endpoints):
             try:
                 resp = self.session.get(url, headers={'Accept': 'application/json'}, timeout=12)
+                if resp.status_code == 401:
+                    continue
+                answered += 1
                 if resp.status_code != 200:
                     continue
                 data = resp.json()
                 items = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(items, list):
+                    self._remember('client_traffics', endpoints, url)
                     return items
             except Exception:
                 continue
+        # Real 3x-UI takes an email here, not an inbound id; stop probing once every URL said no
+        if answered == len(endpoints):
+            self._client_traffics_dead = True
         return []
 
     def _fetch_client_traffic_by_email(self, email: str):
@@ -402,7 +716,7 @@ class XuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/API/inbounds/getClientTraffics/{email}",
             f"{self.base_url}/panel/API/inbounds/getClientTraffics/{email}",
         ]
-        for url in endpoints:
+        for url in self._prefer('client_traffic_by_email', endpoints):
             try:
                 resp = self.session.get(url, headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
@@ -410,6 +724,7 @@ class XuiAPI(BasePanelAPI):
                 data = resp.json()
                 obj = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(obj, dict):
+                    self._remember('client_traffic_by_email', endpoints, url)
                     return obj
             except Exception:
                 continue
@@ -429,7 +744,7 @@ class XuiAPI(BasePanelAPI):
             ]
             last_error = None
             for attempt in range(2):
-                for url in endpoints:
+                for url in self._prefer('list_inbounds', endpoints):
                     try:
                         resp = self.session.get(url, headers={'Accept': 'application/json'}, timeout=12)
                     except requests.RequestException as e:
@@ -474,11 +789,14 @@ class XuiAPI(BasePanelAPI):
                             'remark': it.get('remark') or it.get('tag') or str(it.get('id')),
                             'protocol': it.get('protocol') or it.get('type') or 'unknown',
                             'port': it.get('port') or it.get('listen_port') or 0,
+                            # Per-client usage rows (email/up/down/total/expiryTime) from the same response
+                            'client_stats': it.get('clientStats') or [],
                         })
+                    self._remember('list_inbounds', endpoints, url)
                     return inbounds, "Success"
                 # retry after re-login once
                 if attempt == 0:
-                    self.get_token()
+                    self.get_token(force=True)
             return None, (last_error or 'Unknown')
         except requests.RequestException as e:
             logger.error(f"X-UI list_inbounds error: {e}")
@@ -538,94 +856,81 @@ class XuiAPI(BasePanelAPI):
             logger.error(f"X-UI create_user_on_inbound error: {e}")
             return None, None, str(e)
 
-    async def get_all_users(self):
-        return None, "Not supported for X-UI"
+    def _get_all_users(self):
+        return self._get_all_inbound_clients()
 
-    async def get_user(self, username):
+    def _get_user(self, username, inbound_id=None):
         # Find client by email across inbounds and map to common fields
         if not self.get_token():
             return None, "خطا در ورود به پنل X-UI"
-        inbounds, msg = self.list_inbounds()
-        if not inbounds:
-            return None, msg
-        for ib in inbounds:
-            inbound_id = ib.get('id')
-            inbound = self._fetch_inbound_detail(inbound_id)
-            if not inbound:
+        for inbound_id in self._inbounds_for_email(username, inbound_id):
+            inbound, by_email = self._cached_inbound(inbound_id)
+            c = by_email.get(username)
+            if not c:
                 continue
-            settings_str = inbound.get('settings')
+            total_bytes = int(c.get('totalGB', 0) or 0)
+            # Try compute used traffic if present in client or stats
+            used_bytes = 0
             try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
+                down = int(c.get('downlink', 0) or 0)
             except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                continue
-            for c in clients:
-                if c.get('email') == username:
-                    total_bytes = int(c.get('totalGB', 0) or 0)
-                    # Try compute used traffic if present in client or stats
-                    used_bytes = 0
-                    try:
-                        down = int(c.get('downlink', 0) or 0)
-                    except Exception:
-                        down = 0
-                    try:
-                        up = int(c.get('uplink', 0) or 0)
-                    except Exception:
-                        up = 0
-                    try:
-                        used_bytes = int(c.get('total', 0) or 0)
-                    except Exception:
-                        used_bytes = down + up
-                    if used_bytes == 0:
-                        # Fetch from getClientTraffics endpoint (by inbound)
-                        stats = self._fetch_client_traffics(inbound_id) or []
-                        for s in stats:
-                            if (s.get('email') or s.get('name')) == username:
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                                break
-                        if used_bytes == 0:
-                            # Direct by email
-                            s = self._fetch_client_traffic_by_email(username)
-                            if isinstance(s, dict):
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                    expiry_ms = int(c.get('expiryTime', 0) or 0)
-                    expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
-                    subid = c.get('subId') or ''
-                    # Build subscription URL
-                    if self.sub_base:
-                        origin = self.sub_base
-                    else:
-                        parts = urlsplit(self.base_url)
-                        host = parts.hostname or ''
-                        port = ''
-                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                            port = f":{parts.port}"
-                        origin = f"{parts.scheme}://{host}{port}"
-                    sub_link = f"{origin}/sub/{subid}?name={subid}" if subid else ''
-                    return {
-                        'data_limit': total_bytes,
-                        'used_traffic': used_bytes,
-                        'expire': expire,
-                        'subscription_url': sub_link,
-                    }, "Success"
+                down = 0
+            try:
+                up = int(c.get('uplink', 0) or 0)
+            except Exception:
+                up = 0
+            try:
+                used_bytes = int(c.get('total', 0) or 0)
+            except Exception:
+                used_bytes = down + up
+            if used_bytes == 0:
+                # clientStats of the inbound detail, else the getClientTraffics endpoint (by inbound)
+                stats = (inbound or {}).get('clientStats') or self._fetch_client_traffics(inbound_id) or []
+                for s in stats:
+                    if (s.get('email') or s.get('name')) == username:
+                        try:
+                            d = int(s.get('down') or s.get('download') or 0)
+                        except Exception:
+                            d = 0
+                        try:
+                            u = int(s.get('up') or s.get('upload') or 0)
+                        except Exception:
+                            u = 0
+                        used_bytes = d + u
+                        break
+                if used_bytes == 0:
+                    # Direct by email
+                    s = self._fetch_client_traffic_by_email(username)
+                    if isinstance(s, dict):
+                        try:
+                            d = int(s.get('down') or s.get('download') or 0)
+                        except Exception:
+                            d = 0
+                        try:
+                            u = int(s.get('up') or s.get('upload') or 0)
+                        except Exception:
+                            u = 0
+                        used_bytes = d + u
+            expiry_ms = int(c.get('expiryTime', 0) or 0)
+            expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
+            subid = c.get('subId') or ''
+            # Build subscription URL
+            if self.sub_base:
+                origin = self.sub_base
+            else:
+                parts = urlsplit(self.base_url)
+                host = parts.hostname or ''
+                port = ''
+                if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                    port = f":{parts.port}"
+                origin = f"{parts.scheme}://{host}{port}"
+            sub_link = f"{origin}/sub/{subid}?name={subid}" if subid else ''
+            return {
+                'data_limit': total_bytes,
+                'used_traffic': used_bytes,
+                'expire': expire,
+                'subscription_url': sub_link,
+            }, "Success"
         return None, "کاربر یافت نشد"
 
     def _fetch_inbound_detail(self, inbound_id: int):
@@ -636,7 +941,7 @@ class XuiAPI(BasePanelAPI):
             f"/xui/api/inbounds/get/{inbound_id}",
             f"/panel/api/inbounds/get/{inbound_id}",
         ]
-        for p in paths:
+        for p in self._prefer('inbound_detail', paths):
             try:
                 resp = self.session.get(f"{self.base_url}{p}", headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
@@ -644,12 +949,13 @@ class XuiAPI(BasePanelAPI):
                 data = resp.json()
                 inbound = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(inbound, dict):
+                    self._remember('inbound_detail', paths, p)
                     return inbound
             except Exception:
                 continue
         return None
 
-    async def renew_user_in_panel(self, username, plan):
+    def _renew_user_in_panel(self, username, plan):
         # Login first
         if not self.get_token():
             return None, "خطا در ورود به پنل X-UI"
@@ -762,7 +1068,7 @@ class XuiAPI(BasePanelAPI):
                     return None, (last_err or "به‌روزرسانی کلاینت ناموفق بود")
         return None, "کلاینت برای تمدید یافت نشد"
 
-    async def create_user(self, user_id, plan):
+    def _create_user(self, user_id, plan):
         return None, None, "برای X-UI ابتدا اینباند را انتخاب کنید."
 
     def renew_user_on_inbound(self, inbound_id: int, username: str, add_gb: float, add_days: int):
@@ -1055,7 +1361,7 @@ class XuiAPI(BasePanelAPI):
             return None, str(e)
 
     def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None) -> list:
-        inbound = self._fetch_inbound_detail(inbound_id)
+        inbound, _by_email = self._cached_inbound(inbound_id)
         if not inbound:
             return []
         # helper to find client
@@ -1333,14 +1639,15 @@ class ThreeXuiAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self._init_session()
+        self._load_endpoint_hints(panel_row)
         self._json_headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
             'X-Requested-With': 'XMLHttpRequest',
         }
 
-    def get_token(self):
+    def _login(self):
         # Try form login first (more compatible)
         try:
             try:
@@ -1391,7 +1698,7 @@ class ThreeXuiAPI(BasePanelAPI):
             ]
             last_error = None
             for attempt in range(2):
-                for url in endpoints:
+                for url in self._prefer('list_inbounds', endpoints):
                     try:
                         resp = self.session.get(url, headers=self._json_headers, timeout=12)
                     except requests.RequestException as e:
@@ -1432,10 +1739,13 @@ class ThreeXuiAPI(BasePanelAPI):
                             'remark': it.get('remark') or it.get('tag') or str(it.get('id')),
                             'protocol': it.get('protocol') or it.get('type') or 'unknown',
                             'port': it.get('port') or it.get('listen_port') or 0,
+                            # Per-client usage rows (email/up/down/total/expiryTime) from the same response
+                            'client_stats': it.get('clientStats') or [],
                         })
+                    self._remember('list_inbounds', endpoints, url)
                     return inbounds, "Success"
                 if attempt == 0:
-                    self.get_token()
+                    self.get_token(force=True)
             return None, (last_error or 'Unknown')
         except requests.RequestException as e:
             logger.error(f"3x-UI list_inbounds error: {e}")
@@ -1448,17 +1758,27 @@ class ThreeXuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/API/inbounds/getClientTraffics/{inbound_id}",
             f"{self.base_url}/panel/API/inbounds/getClientTraffics/{inbound_id}",
         ]
-        for url in endpoints:
+        if self._client_traffics_dead:
+            return []
+        answered = 0
+        for url in self._prefer('client_traffics', endpoints):
             try:
                 resp = self.session.get(url, headers=self._json_headers, timeout=12)
+                if resp.status_code == 401:
+                    continue
+                answered += 1
                 if resp.status_code != 200:
                     continue
                 data = resp.json()
                 items = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(items, list):
+                    self._remember('client_traffics', endpoints, url)
                     return items
             except Exception:
                 continue
+        # Real 3x-UI takes an email here, not an inbound id; stop probing once every URL said no
+        if answered == len(endpoints):
+            self._client_traffics_dead = True
         return []
 
     def _fetch_client_traffic_by_email(self, email: str):
@@ -1468,7 +1788,7 @@ class ThreeXuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/API/inbounds/getClientTraffics/{email}",
             f"{self.base_url}/panel/API/inbounds/getClientTraffics/{email}",
         ]
-        for url in endpoints:
+        for url in self._prefer('client_traffic_by_email', endpoints):
             try:
                 resp = self.session.get(url, headers=self._json_headers, timeout=12)
                 if resp.status_code != 200:
@@ -1476,6 +1796,7 @@ class ThreeXuiAPI(BasePanelAPI):
                 data = resp.json()
                 obj = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(obj, dict):
+                    self._remember('client_traffic_by_email', endpoints, url)
                     return obj
             except Exception:
                 continue
@@ -1604,95 +1925,83 @@ class ThreeXuiAPI(BasePanelAPI):
             logger.error(f"3x-UI create_user_on_inbound error: {e}")
             return None, None, str(e)
 
-    async def get_all_users(self):
-        return None, "Not supported for 3x-UI"
+    def _get_all_users(self):
+        return self._get_all_inbound_clients()
 
-    async def get_user(self, username):
+    def _get_user(self, username, inbound_id=None):
         if not self.get_token():
             return None, "خطا در ورود به پنل 3x-UI"
-        inbounds, msg = self.list_inbounds()
-        if not inbounds:
-            return None, msg
-        for ib in inbounds:
-            inbound_id = ib.get('id')
-            inbound = self._fetch_inbound_detail(inbound_id)
-            if not inbound:
+        for inbound_id in self._inbounds_for_email(username, inbound_id):
+            inbound, by_email = self._cached_inbound(inbound_id)
+            c = by_email.get(username)
+            if not c:
                 continue
-            settings_str = inbound.get('settings')
+            total_bytes = int(c.get('totalGB', 0) or 0)
+            used_bytes = 0
             try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
+                down = int(c.get('downlink', 0) or 0)
             except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                continue
-            for c in clients:
-                if c.get('email') == username:
-                    total_bytes = int(c.get('totalGB', 0) or 0)
-                    used_bytes = 0
-                    try:
-                        down = int(c.get('downlink', 0) or 0)
-                    except Exception:
-                        down = 0
-                    try:
-                        up = int(c.get('uplink', 0) or 0)
-                    except Exception:
-                        up = 0
+                down = 0
+            try:
+                up = int(c.get('uplink', 0) or 0)
+            except Exception:
+                up = 0
+            try:
+                used_bytes = int(c.get('total', 0) or 0)
+            except Exception:
+                used_bytes = down + up
+            if used_bytes == 0:
+                # clientStats of the inbound detail, else the stats endpoint
+                stats = (inbound or {}).get('clientStats') or []
+                if not stats:
                     try:
-                        used_bytes = int(c.get('total', 0) or 0)
+                        stats = self._fetch_client_traffics(inbound_id)
                     except Exception:
-                        used_bytes = down + up
-                    if used_bytes == 0:
-                        # try stats endpoint
                         stats = []
+                for s in (stats or []):
+                    if (s.get('email') or s.get('name')) == username:
                         try:
-                            stats = self._fetch_client_traffics(inbound_id)
+                            d = int(s.get('down') or s.get('download') or 0)
                         except Exception:
-                            stats = []
-                        for s in (stats or []):
-                            if (s.get('email') or s.get('name')) == username:
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                                break
-                        if used_bytes == 0:
-                            # direct by email
-                            s = self._fetch_client_traffic_by_email(username)
-                            if isinstance(s, dict):
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                    expiry_ms = int(c.get('expiryTime', 0) or 0)
-                    expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
-                    subid = c.get('subId') or ''
-                    if self.sub_base:
-                        origin = self.sub_base
-                    else:
-                        parts = urlsplit(self.base_url)
-                        host = parts.hostname or ''
-                        port = ''
-                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                            port = f":{parts.port}"
-                        origin = f"{parts.scheme}://{host}{port}"
-                    sub_link = f"{origin}/sub/{subid}" if subid else ''
-                    return {
-                        'data_limit': total_bytes,
-                        'used_traffic': used_bytes,
-                        'expire': expire,
-                        'subscription_url': sub_link,
-                    }, "Success"
+                            d = 0
+                        try:
+                            u = int(s.get('up') or s.get('upload') or 0)
+                        except Exception:
+                            u = 0
+                        used_bytes = d + u
+                        break
+                if used_bytes == 0:
+                    # direct by email
+                    s = self._fetch_client_traffic_by_email(username)
+                    if isinstance(s, dict):
+                        try:
+                            d = int(s.get('down') or s.get('download') or 0)
+                        except Exception:
+                            d = 0
+                        try:
+                            u = int(s.get('up') or s.get('upload') or 0)
+                        except Exception:
+                            u = 0
+                        used_bytes = d + u
+            expiry_ms = int(c.get('expiryTime', 0) or 0)
+            expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
+            subid = c.get('subId') or ''
+            if self.sub_base:
+                origin = self.sub_base
+            else:
+                parts = urlsplit(self.base_url)
+                host = parts.hostname or ''
+                port = ''
+                if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                    port = f":{parts.port}"
+                origin = f"{parts.scheme}://{host}{port}"
+            sub_link = f"{origin}/sub/{subid}" if subid else ''
+            return {
+                'data_limit': total_bytes,
+                'used_traffic': used_bytes,
+                'expire': expire,
+                'subscription_url': sub_link,
+            }, "Success"
         return None, "کاربر یافت نشد"
 
     def _fetch_inbound_detail(self, inbound_id: int):
@@ -1704,7 +2013,7 @@ class ThreeXuiAPI(BasePanelAPI):
             f"/xui/API/inbounds/get/{inbound_id}",
             f"/panel/API/inbounds/get/{inbound_id}",
         ]
-        for p in paths:
+        for p in self._prefer('inbound_detail', paths):
             try:
                 resp = self.session.get(f"{self.base_url}{p}", headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
@@ -1712,13 +2021,14 @@ class ThreeXuiAPI(BasePanelAPI):
                 data = resp.json()
                 inbound = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(inbound, dict):
+                    self._remember('inbound_detail', paths, p)
                     return inbound
             except Exception:
                 continue
         return None
 
     def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None) -> list:
-        inbound = self._fetch_inbound_detail(inbound_id)
+        inbound, _by_email = self._cached_inbound(inbound_id)
         if not inbound:
             return []
         # Retry a little to ensure client appears
@@ -2097,7 +2407,7 @@ class ThreeXuiAPI(BasePanelAPI):
         except Exception as e:
             return None, str(e)
 
-    async def renew_user_in_panel(self, username, plan):
+    def _renew_user_in_panel(self, username, plan):
         if not self.get_token():
             return None, "خطا در ورود به پنل 3x-UI"
         inbounds, msg = self.list_inbounds()
@@ -2165,14 +2475,15 @@ class TxUiAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self._init_session()
+        self._load_endpoint_hints(panel_row)
         self._json_headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
             'X-Requested-With': 'XMLHttpRequest',
         }
 
-    def get_token(self):
+    def _login(self):
         try:
             resp = self.session.post(
                 f"{self.base_url}/login",
@@ -2198,7 +2509,7 @@ class TxUiAPI(BasePanelAPI):
             ]
             last_error = None
             for attempt in range(2):
-                for url in endpoints:
+                for url in self._prefer('list_inbounds', endpoints):
                     resp = self.session.get(url, headers=self._json_headers, timeout=12)
                     if resp.status_code != 200:
                         last_error = f"HTTP {resp.status_code}"
@@ -2235,10 +2546,13 @@ class TxUiAPI(BasePanelAPI):
                             'remark': it.get('remark') or it.get('tag') or str(it.get('id')),
                             'protocol': it.get('protocol') or it.get('type') or 'unknown',
                             'port': it.get('port') or it.get('listen_port') or 0,
+                            # Per-client usage rows (email/up/down/total/expiryTime) from the same response
+                            'client_stats': it.get('clientStats') or [],
                         })
+                    self._remember('list_inbounds', endpoints, url)
                     return inbounds, "Success"
                 if attempt == 0:
-                    self.get_token()
+                    self.get_token(force=True)
             if last_error:
                 logger.error(f"TX-UI list_inbounds error: {last_error}")
                 return None, last_error
@@ -2363,50 +2677,37 @@ class TxUiAPI(BasePanelAPI):
             logger.error(f"TX-UI create_user_on_inbound error: {e}")
             return None, None, str(e)
 
-    async def get_all_users(self):
-        return None, "Not supported for TX-UI"
+    def _get_all_users(self):
+        return self._get_all_inbound_clients()
 
-    async def get_user(self, username):
+    def _get_user(self, username, inbound_id=None):
         if not self.get_token():
             return None, "خطا در ورود به پنل TX-UI"
-        inbounds, msg = self.list_inbounds()
-        if not inbounds:
-            return None, msg
-        for ib in inbounds:
-            inbound_id = ib.get('id')
-            inbound = self._fetch_inbound_detail(inbound_id)
-            if not inbound:
-                continue
-            settings_str = inbound.get('settings')
-            try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
+        for inbound_id in self._inbounds_for_email(username, inbound_id):
+            _inbound, by_email = self._cached_inbound(inbound_id)
+            c = by_email.get(username)
+            if not c:
                 continue
-            for c in clients:
-                if c.get('email') == username:
-                    total_bytes = int(c.get('totalGB', 0) or 0)
-                    expiry_ms = int(c.get('expiryTime', 0) or 0)
-                    expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
-                    subid = c.get('subId') or ''
-                    if self.sub_base:
-                        origin = self.sub_base
-                    else:
-                        parts = urlsplit(self.base_url)
-                        host = parts.hostname or ''
-                        port = ''
-                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                            port = f":{parts.port}"
-                        origin = f"{parts.scheme}://{host}{port}"
-                    sub_link = f"{origin}/sub/{subid}" if subid else ''
-                    return {
-                        'data_limit': total_bytes,
-                        'used_traffic': 0,
-                        'expire': expire,
-                        'subscription_url': sub_link,
-                    }, "Success"
+            total_bytes = int(c.get('totalGB', 0) or 0)
+            expiry_ms = int(c.get('expiryTime', 0) or 0)
+            expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
+            subid = c.get('subId') or ''
+            if self.sub_base:
+                origin = self.sub_base
+            else:
+                parts = urlsplit(self.base_url)
+                host = parts.hostname or ''
+                port = ''
+                if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                    port = f":{parts.port}"
+                origin = f"{parts.scheme}://{host}{port}"
+            sub_link = f"{origin}/sub/{subid}" if subid else ''
+            return {
+                'data_limit': total_bytes,
+                'used_traffic': 0,
+                'expire': expire,
+                'subscription_url': sub_link,
+            }, "Success"
         return None, "کاربر یافت نشد"
 
     def _fetch_inbound_detail(self, inbound_id: int):
@@ -2415,7 +2716,7 @@ class TxUiAPI(BasePanelAPI):
             f"/xui/api/inbounds/get/{inbound_id}",
             f"/panel/api/inbounds/get/{inbound_id}",
         ]
-        for p in paths:
+        for p in self._prefer('inbound_detail', paths):
             try:
                 resp = self.session.get(f"{self.base_url}{p}", headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
@@ -2423,13 +2724,14 @@ class TxUiAPI(BasePanelAPI):
                 data = resp.json()
                 inbound = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(inbound, dict):
+                    self._remember('inbound_detail', paths, p)
                     return inbound
             except Exception:
                 continue
         return None
 
     def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None) -> list:
-        inbound = self._fetch_inbound_detail(inbound_id)
+        inbound, _by_email = self._cached_inbound(inbound_id)
         if not inbound:
             return []
         # helper to find client by preferred id or email
@@ -2582,7 +2884,7 @@ class TxUiAPI(BasePanelAPI):
         except Exception:
             return []
 
-    async def renew_user_in_panel(self, username, plan):
+    def _renew_user_in_panel(self, username, plan):
         if not self.get_token():
             return None, "خطا در ورود به پنل TX-UI"
         inbounds, msg = self.list_inbounds()
@@ -2802,9 +3104,11 @@ class MarzneshinAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self._init_session()
+        self._load_endpoint_hints(panel_row)
         self._json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
         self._last_token_error = None
+        self._token_from_login = False
         
     def _log_json(self, title: str, data):
         try:
@@ -2845,6 +3149,16 @@ class MarzneshinAPI(BasePanelAPI):
             return obj
         return None
 
+    def _login(self) -> bool:
+        return self._ensure_token()
+
+    def _on_auth_lost(self):
+        super()._on_auth_lost()
+        # A configured API token is kept; only a login-obtained one is dropped and re-requested
+        if self._token_from_login:
+            self.token = ''
+            self._token_from_login = False
+
     def _ensure_token(self) -> bool:
         if self.token:
             return True
@@ -2888,38 +3202,41 @@ class MarzneshinAPI(BasePanelAPI):
 
         # Try multiple token endpoints (form and JSON) commonly used by Marzneshin
         last_err = None
+        candidates = []
         for base in bases:
-            candidates = [
+            candidates.extend([
                 (f"{base}/api/admins/token", "form"),
                 (f"{base}/api/admins/token/", "form"),
                 (f"{base}/api/auth/token", "form"),
                 (f"{base}/api/auth/login", "json"),
-            ]
-            for url, mode in candidates:
+            ])
+        for url, mode in self._prefer('token', candidates):
+            try:
+                if mode == "form":
+                    resp = self.session.post(url, data={"username": self.username, "password": self.password, "grant_type": "password"}, headers={"Accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"}, timeout=12)
+                else:
+                    resp = self.session.post(url, json={"username": self.username, "password": self.password}, headers={"Accept": "application/json", "Content-Type": "application/json"}, timeout=12)
+                if resp.status_code not in (200, 201):
+                    last_err = f"HTTP {resp.status_code} @ {url}"
+                    continue
                 try:
-                    if mode == "form":
-                        resp = self.session.post(url, data={"username": self.username, "password": self.password, "grant_type": "password"}, headers={"Accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"}, timeout=12)
-                    else:
-                        resp = self.session.post(url, json={"username": self.username, "password": self.password}, headers={"Accept": "application/json", "Content-Type": "application/json"}, timeout=12)
-                    if resp.status_code not in (200, 201):
-                        last_err = f"HTTP {resp.status_code} @ {url}"
-                        continue
-                    try:
-                        data = resp.json()
-                    except ValueError:
-                        last_err = f"non-JSON @ {url}"
-                        continue
-                    token_val = self._extract_token_from_obj(data)
-                    if isinstance(token_val, str) and token_val:
-                        if token_val.lower().startswith("bearer "):
-                            token_val = token_val[7:].strip()
-                        self.token = token_val.strip()
-                        self._last_token_error = None
-                        return True
-                    last_err = f"no token in response @ {url}"
-                except requests.RequestException:
-                    last_err = f"request error @ {url}"
+                    data = resp.json()
+                except ValueError:
+                    last_err = f"non-JSON @ {url}"
                     continue
+                token_val = self._extract_token_from_obj(data)
+                if isinstance(token_val, str) and token_val:
+                    if token_val.lower().startswith("bearer "):
+                        token_val = token_val[7:].strip()
+                    self.token = token_val.strip()
+                    self._last_token_error = None
+                    self._token_from_login = True
+                    self._remember('token', candidates, (url, mode))
+                    return True
+                last_err = f"no token in response @ {url}"
+            except requests.RequestException:
+                last_err = f"request error @ {url}"
+                continue
         if last_err:
             self._last_token_error = last_err
             from .config import logger
@@ -2968,46 +3285,47 @@ class MarzneshinAPI(BasePanelAPI):
                 last_err = None
                 tried_refresh = False
                 header_sets = self._token_header_variants()
-                for url in endpoints:
-                    for candidate in [url, f"{url}?page=1&size=100"]:
-                        for hdrs in header_sets:
-                            try:
-                                resp = self.session.get(candidate, headers=hdrs, timeout=12)
-                            except requests.RequestException as e:
-                                last_err = str(e)
-                                continue
-                            if resp.status_code == 401 and not tried_refresh:
-                                # try to refresh token once
-                                if self._ensure_token():
-                                    tried_refresh = True
-                                    header_sets = self._token_header_variants()
-                                    continue
-                            if resp.status_code != 200:
-                                last_err = f"HTTP {resp.status_code} @ {candidate}"
-                                continue
-                            try:
-                                data = resp.json()
-                            except ValueError:
-                                last_err = f"non-JSON @ {candidate}"
+                candidates = [c for url in endpoints for c in (url, f"{url}?page=1&size=100")]
+                for candidate in self._prefer('list_inbounds', candidates):
+                    for hdrs in header_sets:
+                        try:
+                            resp = self.session.get(candidate, headers=hdrs, timeout=12)
+                        except requests.RequestException as e:
+                            last_err = str(e)
+                            continue
+                        if resp.status_code == 401 and not tried_refresh:
+                            # try to refresh token once
+                            if self._ensure_token():
+                                tried_refresh = True
+                                header_sets = self._token_header_variants()
                                 continue
-                            items = self._find_first_list_of_dicts(data)
-                            if not isinstance(items, list):
-                                last_err = "لیست اینباند نامعتبر است"
+                        if resp.status_code != 200:
+                            last_err = f"HTTP {resp.status_code} @ {candidate}"
+                            continue
+                        try:
+                            data = resp.json()
+                        except ValueError:
+                            last_err = f"non-JSON @ {candidate}"
+                            continue
+                        items = self._find_first_list_of_dicts(data)
+                        if not isinstance(items, list):
+                            last_err = "لیست اینباند نامعتبر است"
+                            continue
+                        inbounds = []
+                        for it in items:
+                            if not isinstance(it, dict):
                                 continue
-                            inbounds = []
-                            for it in items:
-                                if not isinstance(it, dict):
-                                    continue
-                                inbounds.append({
-                                    'id': it.get('id') or it.get('tag') or it.get('remark') or '',
-                                    'remark': it.get('tag') or it.get('remark') or str(it.get('id') or ''),
-                                    'protocol': it.get('protocol') or it.get('type') or 'unknown',
-                                    'port': it.get('port') or 0,
-                                    'tag': it.get('tag') or it.get('remark') or str(it.get('id') or ''),
-                                    'network': it.get('network') or '',
-                                    'tls': it.get('tls') or '',
-                                })
-                            return inbounds, "Success"
+                            inbounds.append({
+                                'id': it.get('id') or it.get('tag') or it.get('remark') or '',
+                                'remark': it.get('tag') or it.get('remark') or str(it.get('id') or ''),
+                                'protocol': it.get('protocol') or it.get('type') or 'unknown',
+                                'port': it.get('port') or 0,
+                                'tag': it.get('tag') or it.get('remark') or str(it.get('id') or ''),
+                                'network': it.get('network') or '',
+                                'tls': it.get('tls') or '',
+                            })
+                        self._remember('list_inbounds', candidates, candidate)
+                        return inbounds, "Success"
                 if last_err:
                     logger.error(f"Marzneshin list_inbounds (token) error: {last_err}")
             # No token provided -> do not attempt cookie login for Marزنسhin
@@ -3120,7 +3438,7 @@ class MarzneshinAPI(BasePanelAPI):
             logger.error(f"Marzneshin create_user_on_inbound error: {e}")
             return None, None, str(e)
 
-    async def create_user(self, user_id, plan):
+    def _create_user(self, user_id, plan):
         """Create a user via Marzneshin API and return subscription link only.
 
         Returns: (username, subscription_url, message)
@@ -3155,7 +3473,7 @@ class MarzneshinAPI(BasePanelAPI):
             if ru.status_code not in (200, 201):
                 return None, None, f"HTTP {ru.status_code} @ /api/users: {(ru.text or '')[:200]}"
             # Fetch user info to get subscription_url
-            user_info, _ = await self.get_user(new_username)
+            user_info, _ = self._get_user(new_username)
             sub_link = None
             if isinstance(user_info, dict):
                 sub_link = user_info.get('subscription_url') or user_info.get('subscription') or None
@@ -3166,7 +3484,7 @@ class MarzneshinAPI(BasePanelAPI):
         except requests.RequestException as e:
             return None, None, str(e)
 
-    async def get_user(self, username):
+    def _get_user(self, username, inbound_id=None):
         # Marzneshin: use /api/users/{username} for core info and /sub/{username}/{key}/info|usage for stats
         # 1) Ensure token and get user
         if not self.token and not self._ensure_token():
@@ -3271,7 +3589,7 @@ class MarzneshinAPI(BasePanelAPI):
             'subscription_url': sub_url or '',
         }, "Success"
 
-    async def renew_user_in_panel(self, username, plan):
+    def _renew_user_in_panel(self, username, plan):
         # Marzneshin renewal via PUT /api/users/{username}: add days and bytes
         if not self.token and not self._ensure_token():
             detail = (self._last_token_error or "نامشخص")
@@ -3336,7 +3654,7 @@ class MarzneshinAPI(BasePanelAPI):
         except requests.RequestException as e:
             return None, str(e)
 
-    async def create_user(self, user_id, plan):
+    def _create_user(self, user_id, plan):
         # Ensure token
         if not self.token and not self._ensure_token():
             detail = (self._last_token_error or "نامشخص")
@@ -3849,10 +4167,38 @@ class MarzneshinAPI(BasePanelAPI):
             return None
 
 
+# One long-lived client per panel id, so sessions (keep-alive + cookies) and
+# auth tokens survive between calls. Dropped on panel add/delete.
+_panel_clients = {}
+_panel_clients_lock = threading.Lock()
+
+
+def invalidate_panel_client(panel_id=None):
+    """Forget the cached client for ``panel_id`` (or every panel when None)."""
+    with _panel_clients_lock:
+        if panel_id is None:
+            dropped = list(_panel_clients.values())
+            _panel_clients.clear()
+        else:
+            client = _panel_clients.pop(int(panel_id), None)
+            dropped = [client] if client else []
+    for client in dropped:
+        client.close()
+
+
 def VpnPanelAPI(panel_id: int) -> BasePanelAPI:
+    client = _panel_clients.get(int(panel_id))
+    if client is not None:
+        return client
     panel_row = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True)
     if not panel_row:
         raise ValueError(f"Panel with ID {panel_id} not found in database.")
+    client = _build_panel_client(panel_row)
+    with _panel_clients_lock:
+        return _panel_clients.setdefault(int(panel_id), client)
+
+
+def _build_panel_client(panel_row) -> BasePanelAPI:
     ptype = (panel_row.get('panel_type') or 'marzban').lower()
     if ptype == 'marzban':
         return MarzbanAPI(panel_row)
@@ -0,0 +1,53 @@
+import threading
+
+from .config import logger
+from .db import query_db, execute_db
+
+
+# In-memory snapshot of the `settings` table. Loaded once, then kept in sync by
+# set_setting(), which is the only way handlers should change a setting.
+_cache = None
+_lock = threading.Lock()
+
+
+def _snapshot() -> dict:
+    global _cache
+    cache = _cache
+    if cache is None:
+        with _lock:
+            if _cache is None:
+                rows = query_db("SELECT key, value FROM settings") or []
+                _cache = {r['key']: r['value'] for r in rows}
+            cache = _cache
+    return cache
+
+
+def get_setting(key: str, default=None):
+    value = _snapshot().get(key)
+    return default if value is None else value
+
+
+def get_settings() -> dict:
+    """All settings as a dict (a copy, safe to modify)."""
+    return dict(_snapshot())
+
+
+def set_setting(key: str, value) -> bool:
+    """Write a setting to the DB and the cache; returns False if the write failed."""
+    if execute_db(
+        "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    ) is None:
+        logger.error(f"Failed to save setting {key}")
+        return False
+    with _lock:
+        if _cache is not None:
+            _cache[key] = value
+    return True
+
+
+def reload_settings():
+    """Drop the snapshot; the next read reloads it from the DB."""
+    global _cache
+    with _lock:
+        _cache = None
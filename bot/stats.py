@@ -0,0 +1,58 @@
+import sqlite3
+from datetime import datetime
+
+from .db import get_connection
+
+
+# Reads of the precomputed stats tables (stats_revenue / stats_counters), which
+# triggers on orders and users keep current. Every lookup is a primary-key hit
+# or a scan of one period's breakdown rows, whatever the size of the history.
+
+PAYMENT_METHOD_LABELS = {
+    'wallet': 'کیف پول',
+    'card': 'کارت به کارت',
+    'crypto': 'رمزارز',
+    'gateway': 'درگاه پرداخت',
+    'trial': 'تست رایگان',
+    '': 'نامشخص',
+}
+
+
+def _counter(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute("SELECT value FROM stats_counters WHERE name = ?", (name,)).fetchone()
+    return int((row[0] if row else 0) or 0)
+
+
+def _revenue(conn: sqlite3.Connection, period: str) -> tuple[int, int]:
+    row = conn.execute(
+        "SELECT orders, revenue FROM stats_revenue WHERE period = ? AND dim = 'all' AND key = ''", (period,)
+    ).fetchone()
+    return (int(row[0] or 0), int(row[1] or 0)) if row else (0, 0)
+
+
+def _breakdown(conn: sqlite3.Connection, period: str, dim: str) -> list:
+    rows = conn.execute(
+        "SELECT key, orders, revenue FROM stats_revenue WHERE period = ? AND dim = ? AND orders > 0 ORDER BY revenue DESC",
+        (period, dim),
+    ).fetchall()
+    return [{'key': r[0], 'orders': int(r[1] or 0), 'revenue': int(r[2] or 0)} for r in rows]
+
+
+def read_stats(conn: sqlite3.Connection | None = None) -> dict:
+    """Users, buyers, today's and this month's revenue, and this month's per plan/panel/method breakdowns."""
+    conn = conn or get_connection()
+    now = datetime.now()
+    today, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+    daily_orders, daily_rev = _revenue(conn, today)
+    monthly_orders, monthly_rev = _revenue(conn, month)
+    return {
+        'total_users': _counter(conn, 'users'),
+        'buyers': _counter(conn, 'buyers'),
+        'daily_orders': daily_orders,
+        'daily_revenue_toman': daily_rev,
+        'monthly_orders': monthly_orders,
+        'monthly_revenue_toman': monthly_rev,
+        'monthly_by_plan': _breakdown(conn, month, 'plan'),
+        'monthly_by_panel': _breakdown(conn, month, 'panel'),
+        'monthly_by_method': _breakdown(conn, month, 'method'),
+    }
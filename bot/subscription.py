@@ -0,0 +1,116 @@
+import asyncio
+import base64
+import time
+from collections import OrderedDict
+
+import httpx
+
+from .config import logger, SUB_CACHE_TTL, SUB_CACHE_SIZE, SUB_FETCH_TIMEOUT
+
+
+# Subscription content (the panel's /sub endpoint) decoded into config URIs.
+# Results are cached per URL for SUB_CACHE_TTL seconds; after that the panel is
+# asked again with If-None-Match / If-Modified-Since, so an unchanged
+# subscription costs a 304 instead of a full download and decode. Concurrent
+# lookups of the same URL share one request.
+
+_SCHEMES = ("vmess://", "vless://", "trojan://", "ss://", "hy2://")
+_HEADERS = {
+    'Accept': 'text/plain, application/octet-stream, */*',
+    'User-Agent': 'Mozilla/5.0',
+}
+
+_cache: "OrderedDict[str, dict]" = OrderedDict()
+_inflight: dict = {}
+_client: httpx.AsyncClient | None = None
+
+
+def parse_subscription(raw: str) -> list[str]:
+    """Config URIs from subscription content, plain-text or base64-encoded."""
+    raw = (raw or '').strip()
+    if any(proto in raw for proto in _SCHEMES):
+        text = raw
+    else:
+        # Remove whitespace and fix padding before decoding
+        compact = "".join(raw.split())
+        missing = len(compact) % 4
+        if missing:
+            compact += "=" * (4 - missing)
+        try:
+            text = base64.b64decode(compact, validate=False).decode('utf-8', errors='ignore')
+        except Exception:
+            text = raw
+    lines = [ln.strip() for ln in (text or '').splitlines()]
+    return [ln for ln in lines if ln and ln.startswith(_SCHEMES)]
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(headers=_HEADERS, timeout=SUB_FETCH_TIMEOUT, follow_redirects=True)
+    return _client
+
+
+def _remember(url: str, entry: dict):
+    _cache[url] = entry
+    _cache.move_to_end(url)
+    while len(_cache) > max(1, SUB_CACHE_SIZE):
+        _cache.popitem(last=False)
+
+
+async def _fetch(url: str, cached: dict | None) -> list[str]:
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    try:
+        resp = await _get_client().get(url, headers=headers)
+        if resp.status_code == 304 and cached:
+            cached['fetched_at'] = time.monotonic()
+            _cache.move_to_end(url)
+            return cached['configs']
+        resp.raise_for_status()
+        configs = parse_subscription(resp.text)
+    except Exception as e:
+        logger.error(f"Failed to fetch/parse subscription from {url}: {e}")
+        # A stale answer beats none when the panel is briefly unreachable
+        return cached['configs'] if cached else []
+    _remember(url, {
+        'configs': configs,
+        'etag': resp.headers.get('etag'),
+        'last_modified': resp.headers.get('last-modified'),
+        'fetched_at': time.monotonic(),
+    })
+    return configs
+
+
+async def fetch_subscription_configs(url: str, fresh: bool = False) -> list[str]:
+    """Config URIs served at subscription ``url`` ([] on failure).
+
+    ``fresh`` skips the TTL and revalidates with the panel, e.g. when the user
+    explicitly asks for an updated link.
+    """
+    if not url:
+        return []
+    cached = _cache.get(url)
+    if cached and not fresh and time.monotonic() - cached['fetched_at'] < SUB_CACHE_TTL:
+        _cache.move_to_end(url)
+        return list(cached['configs'])
+    task = _inflight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_fetch(url, cached))
+        _inflight[url] = task
+        task.add_done_callback(lambda t: _inflight.pop(url) if _inflight.get(url) is t else None)
+    return list(await asyncio.shield(task))
+
+
+async def close_subscription_client():
+    global _client
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception:
+            pass
+        _client = None
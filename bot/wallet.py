@@ -0,0 +1,80 @@
+import sqlite3
+from datetime import datetime
+
+from .config import logger
+from .db import adb, get_connection
+
+
+# Wallet balance changes. Each call is a single transaction: the balance update,
+# its wallet_transactions ledger row and (for purchases) the order row commit
+# together, so a crash or a concurrent double-tap can't leave them out of step.
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _debit(user_id: int, amount: int, method: str, order: dict | None):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO user_wallets (user_id, balance) VALUES (?, 0)", (user_id,))
+            # Conditional debit: two concurrent purchases can never both pass the balance check
+            cur = conn.execute(
+                "UPDATE user_wallets SET balance = balance - ? WHERE user_id = ? AND balance >= ?",
+                (amount, user_id, amount),
+            )
+            if cur.rowcount == 0:
+                row = conn.execute("SELECT balance FROM user_wallets WHERE user_id = ?", (user_id,)).fetchone()
+                return False, (row['balance'] if row else 0), None
+            order_id = None
+            if order:
+                cols = list(order.keys())
+                cur = conn.execute(
+                    f"INSERT INTO orders ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+                    tuple(order[c] for c in cols),
+                )
+                order_id = cur.lastrowid
+            conn.execute(
+                "INSERT INTO wallet_transactions (user_id, amount, direction, method, status, created_at, reference) VALUES (?, ?, 'debit', ?, 'approved', ?, ?)",
+                (user_id, amount, method, _now(), f"order_{order_id}" if order_id else None),
+            )
+            row = conn.execute("SELECT balance FROM user_wallets WHERE user_id = ?", (user_id,)).fetchone()
+            return True, row['balance'], order_id
+    except sqlite3.Error as e:
+        logger.error(f"Wallet debit failed for {user_id}: {e}")
+        return False, None, None
+
+
+async def debit_wallet(user_id: int, amount: int, method: str = 'wallet', order: dict | None = None):
+    """Take ``amount`` from the user's wallet if the balance covers it.
+
+    ``order`` (column -> value) is inserted into ``orders`` in the same
+    transaction. Returns ``(ok, balance, order_id)``; on insufficient funds
+    ``ok`` is False and ``balance`` is the current balance, on a DB error it is None.
+    """
+    return await adb.run(_debit, int(user_id), int(amount), method, order)
+
+
+def _credit(user_id: int, amount: int, method: str, reference: str | None):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO user_wallets (user_id, balance) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET balance = COALESCE(balance, 0) + excluded.balance",
+                (user_id, amount),
+            )
+            conn.execute(
+                "INSERT INTO wallet_transactions (user_id, amount, direction, method, status, created_at, reference, meta) VALUES (?, ?, 'credit', ?, 'approved', ?, ?, ?)",
+                (user_id, amount, method, _now(), reference, None),
+            )
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Wallet credit failed for {user_id}: {e}")
+        return False
+
+
+async def credit_wallet(user_id: int, amount: int, method: str, reference: str | None = None) -> bool:
+    """Add ``amount`` to the wallet and record an approved credit, in one transaction."""
+    return await adb.run(_credit, int(user_id), int(amount), method, reference)